@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Several Chomikuj accounts behind one uploader.
+Each account keeps a pool of logged-in ChomikUploader sessions; a sharding
+policy decides which account takes the next file:
+
+  round_robin   - rotate through accounts file by file
+  by_folder     - hash of the destination folder, so a tree stays on one account
+  least_loaded  - account with the fewest bytes currently in flight
+"""
+import json
+import threading
+import time
+import zlib
+
+POLICIES = ("round_robin", "by_folder", "least_loaded")
+# After a failed login an account is passed over for LOGIN_FAIL_BACKOFF seconds,
+# doubling with every further failure up to LOGIN_FAIL_COOLDOWN. It is only passed
+# over while another account is ready: when none is, the one coming back first
+# gets a login attempt anyway, so a single account retries on the next upload.
+LOGIN_FAIL_BACKOFF = 5
+LOGIN_FAIL_COOLDOWN = 60
+
+
+def parse_accounts(spec, username=None, password=None):
+    """
+    CHOMIK_ACCOUNTS as JSON ([{"username": .., "password": ..}, ...]) or
+    "user:pass;user2:pass2" (split on the first ':'). Falls back to the single
+    CHOMIK_USERNAME / CHOMIK_PASSWORD pair.
+    """
+    accounts = []
+    spec = (spec or "").strip()
+    if spec.startswith("["):
+        for item in json.loads(spec):
+            accounts.append((item["username"], item["password"]))
+    elif spec:
+        for part in spec.split(";"):
+            part = part.strip()
+            if not part:
+                continue
+            if ":" not in part:
+                raise ValueError("Invalid account entry (expected user:password): " + part.split(":")[0])
+            user, pw = part.split(":", 1)
+            accounts.append((user.strip(), pw))
+    if not accounts and username and password:
+        accounts.append((username, password))
+    return accounts
+
+
+class Account:
+    __slots__ = ("username", "password", "idle", "active", "inflight_bytes", "disabled_until",
+                 "login_failures")
+
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        self.idle = []
+        self.active = 0
+        self.inflight_bytes = 0
+        self.disabled_until = 0.0
+        self.login_failures = 0
+
+
+class AccountPool:
+
+    def __init__(self, accounts, uploader_cls, policy="round_robin"):
+        if policy not in POLICIES:
+            raise ValueError("Unknown sharding policy: " + str(policy))
+        self.accounts = [Account(u, p) for u, p in accounts]
+        self.policy = policy
+        self.uploader_cls = uploader_cls
+        self._lock = threading.Lock()
+        self._rr = 0
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def _pick(self, key, candidates):
+        if self.policy == "by_folder" and key is not None:
+            # Stable across restarts (unlike hash()), so a folder keeps its account.
+            return candidates[zlib.crc32(key.encode("utf-8")) % len(candidates)]
+        if self.policy == "least_loaded":
+            return min(candidates, key=lambda a: (a.inflight_bytes, a.active))
+        acc = candidates[self._rr % len(candidates)]
+        self._rr += 1
+        return acc
+
+    def acquire(self, key=None, size=0):
+        """
+        Return (account, uploader) with a logged-in session, or (None, None)
+        when no account can log in. Pair every success with release().
+        """
+        tried = set()
+        while True:
+            with self._lock:
+                now = time.time()
+                candidates = [a for a in self.accounts if a.username not in tried]
+                if not candidates:
+                    return None, None
+                ready = [a for a in candidates if a.disabled_until <= now]
+                acc = self._pick(key, ready) if ready else min(candidates, key=lambda a: a.disabled_until)
+                acc.active += 1
+                acc.inflight_bytes += size
+                uploader = acc.idle.pop() if acc.idle else None
+            if uploader is None:
+                uploader = self.uploader_cls(acc.username, acc.password)
+            if uploader.login():
+                with self._lock:
+                    acc.login_failures = 0
+                return acc, uploader
+            with self._lock:
+                acc.active -= 1
+                acc.inflight_bytes -= size
+                acc.login_failures += 1
+                acc.disabled_until = time.time() + min(
+                    LOGIN_FAIL_COOLDOWN, LOGIN_FAIL_BACKOFF * 2 ** (acc.login_failures - 1))
+            tried.add(acc.username)
+
+    def release(self, acc, uploader, size=0):
+        with self._lock:
+            acc.active -= 1
+            acc.inflight_bytes -= size
+            acc.idle.append(uploader)
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                {
+                    "username": a.username,
+                    "active": a.active,
+                    "inflight_bytes": a.inflight_bytes,
+                    "sessions": a.active + len(a.idle),
+                    "disabled": a.disabled_until > time.time(),
+                }
+                for a in self.accounts
+            ]
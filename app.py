@@ -2,6 +2,8 @@ import os
 import json
 import hashlib
 import hmac
+import collections
+import fcntl
 import sqlite3
 import threading
 import time
@@ -9,10 +11,23 @@ import uuid
 from functools import wraps
 from flask import Flask, request, redirect, render_template_string, Response, session
 
+import history
+from accounts import AccountPool, parse_accounts
+from archive import FORMATS as ARCHIVE_FORMATS, ArchiveEntry, open_archive
 from chomik import ChomikUploader
+from prehash import PreHasher
+from profiler import profile_call, sample as sample_stacks
+from progress import SAMPLE_SECONDS as PROGRESS_SAMPLE_SECONDS, ProgressSampler
+from statusdb import CLAIM_LEASE_SECONDS, SharedStatus
+from statusstore import StatusStore
+from concurrency import AdaptiveConcurrency
+from iosched import DeviceScheduler
+from metrics import UPLOADS_FINISHED, UPLOADS_STARTED, Gauge, render as render_metrics
+from ordering import ORDERS as BATCH_ORDERS, order_files
+from throttle import TokenBucket, parse_rate, parse_schedule, parse_size
 
 BROWSE_FOLDER = '/app/browse'
-HISTORY_DB = os.environ.get('UPLOAD_HISTORY_DB', '/app/data/upload_history.db')
+HISTORY_DB = history.HISTORY_DB
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'default-secret-key-change-me')
 
@@ -22,135 +37,119 @@ PANEL_PASSWORD = os.environ.get('PANEL_PASSWORD', '')
 if PANEL_PASSWORD and not PASSWORD_HASH:
     PASSWORD_HASH = hashlib.sha256(PANEL_PASSWORD.encode()).hexdigest()
 
-upload_status = {}
+upload_status = StatusStore()
+batch_status = {}
 upload_lock = threading.Lock()
-history_lock = threading.Lock()
+# Uploads in progress, keyed by ('path', abs_path, size, mtime) and ('sha', checksum);
+# the value is set once the owner is done so identical jobs can re-check history.
+inflight = {}
+inflight_lock = threading.Lock()
+# cProfile reports of uploads started with "profile": true, newest last.
+upload_profiles = collections.OrderedDict()
+UPLOAD_PROFILES_KEEP = 50
+profile_lock = threading.Lock()  # one sampling run at a time
 
 STATUS_TTL_SECONDS = 600
-PROGRESS_THROTTLE_BYTES = 262144  # 256 KB
-PROGRESS_THROTTLE_SECONDS = 0.25
-HASH_CHUNK_SIZE = 65536  # 64 KB
-
-
-def _history_init():
-    db_dir = os.path.dirname(HISTORY_DB)
-    if db_dir:
-        os.makedirs(db_dir, exist_ok=True)
-    with sqlite3.connect(HISTORY_DB) as c:
-        c.execute("""CREATE TABLE IF NOT EXISTS uploads(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            abs_path TEXT NOT NULL,
-            filename TEXT NOT NULL,
-            dest_path TEXT NOT NULL,
-            size INTEGER NOT NULL,
-            mtime REAL NOT NULL,
-            checksum TEXT,
-            finished_at REAL NOT NULL,
-            UNIQUE(abs_path, dest_path, size, mtime))""")
-        # Migrate pre-checksum DBs created by older versions.
-        cols = [r[1] for r in c.execute("PRAGMA table_info(uploads)").fetchall()]
-        if 'checksum' not in cols:
-            c.execute("ALTER TABLE uploads ADD COLUMN checksum TEXT")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_lookup ON uploads(abs_path, dest_path)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_checksum ON uploads(checksum)")
-        # Cache file content hashes so each (path,size,mtime) is hashed at most once.
-        c.execute("""CREATE TABLE IF NOT EXISTS file_hashes(
-            abs_path TEXT NOT NULL,
-            size INTEGER NOT NULL,
-            mtime REAL NOT NULL,
-            checksum TEXT NOT NULL,
-            UNIQUE(abs_path, size, mtime))""")
-
-
-def _history_is_uploaded(abs_path, dest_path, size, mtime):
-    try:
-        with history_lock, sqlite3.connect(HISTORY_DB) as c:
-            row = c.execute(
-                "SELECT 1 FROM uploads WHERE abs_path=? AND dest_path=? AND size=? AND mtime=?",
-                (abs_path, dest_path, size, mtime),
-            ).fetchone()
-        return row is not None
-    except sqlite3.Error:
-        return False
-
-
-def _history_any_uploaded(abs_path, size, mtime):
+# "inline": the web process uploads in its own threads. "queue": it only enqueues jobs
+# in SHARED_STATUS_DB and worker.py processes run them.
+UPLOAD_MODE = os.environ.get('UPLOAD_MODE', 'inline')
+# With several server processes (gunicorn), status and dedupe claims are shared through
+# this SQLite file; each process publishes its changed records every STATUS_PUBLISH_SECONDS.
+SHARED_STATUS_DB = os.environ.get('SHARED_STATUS_DB', '') or (
+    os.path.join(os.path.dirname(HISTORY_DB), 'status.db') if UPLOAD_MODE == 'queue' else '')
+STATUS_PUBLISH_SECONDS = 0.5
+SHARED_SWEEP_SECONDS = 5
+SHARED_HEARTBEAT_SECONDS = CLAIM_LEASE_SECONDS / 4.0
+shared_status = SharedStatus(SHARED_STATUS_DB) if SHARED_STATUS_DB else None
+UPLOAD_CONCURRENCY_INITIAL = int(os.environ.get('UPLOAD_CONCURRENCY_INITIAL', '2'))
+UPLOAD_CONCURRENCY_MAX = int(os.environ.get('UPLOAD_CONCURRENCY_MAX', '6'))
+# Files bigger than this go up as parallel volumes name.001, name.002, ... (0 = never).
+UPLOAD_SPLIT_SIZE = parse_size(os.environ.get('UPLOAD_SPLIT_SIZE', ''))
+UPLOAD_SPLIT_WORKERS = int(os.environ.get('UPLOAD_SPLIT_WORKERS', '4'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Default processing order of folder batches (see ordering.py); per request: "order".
+UPLOAD_ORDER = os.environ.get('UPLOAD_ORDER', 'locality')
+
+# CHOMIK_ACCOUNTS ("user:pass;user2:pass2" or JSON) spreads uploads over several
+# accounts per CHOMIK_SHARDING; otherwise the single CHOMIK_USERNAME/PASSWORD is used.
+account_pool = AccountPool(
+    parse_accounts(os.environ.get('CHOMIK_ACCOUNTS', ''),
+                   os.environ.get('CHOMIK_USERNAME'), os.environ.get('CHOMIK_PASSWORD')),
+    ChomikUploader,
+    policy=os.environ.get('CHOMIK_SHARDING', 'round_robin'),
+)
+
+# Shared by every upload thread: UPLOAD_RATE_LIMIT caps the aggregate send rate
+# (e.g. "10M" = 10 MiB/s, empty = unlimited), UPLOAD_RATE_SCHEDULE overrides it
+# per time of day (e.g. "08:00-18:00=2M;18:00-08:00=0").
+global_limiter = TokenBucket(
+    os.environ.get('UPLOAD_RATE_LIMIT', ''),
+    schedule=parse_schedule(os.environ.get('UPLOAD_RATE_SCHEDULE', '')),
+)
+
+# Caps concurrent full-speed readers (hashing, upload reads) per storage device;
+# IO_READERS_HDD / IO_READERS_SSD / IO_READERS_UNKNOWN set the slots.
+io_scheduler = DeviceScheduler()
+
+
+def _file_checksum(abs_path, size, mtime, on_chunk=None, io_slot=True):
+    """history.file_checksum; hashing takes a reader slot on the file's device unless io_slot is False."""
+    return history.file_checksum(abs_path, size, mtime, on_chunk, io_scheduler if io_slot else None)
+
+
+history.init()
+
+
+def _uploads_running():
+    with upload_lock:
+        if upload_status.running():
+            return True
+    if shared_status:
+        try:
+            return shared_status.any_running()
+        except sqlite3.Error:
+            return True
+    return False
+
+
+def _elect(name):
+    """
+    True in exactly one of the processes sharing SHARED_STATUS_DB (always True
+    without it). The winner keeps the lock file open for its lifetime.
+    """
+    if not shared_status:
+        return True
+    fh = open(SHARED_STATUS_DB + '.' + name + '.lock', 'w')
     try:
-        with history_lock, sqlite3.connect(HISTORY_DB) as c:
-            row = c.execute(
-                "SELECT 1 FROM uploads WHERE abs_path=? AND size=? AND mtime=? LIMIT 1",
-                (abs_path, size, mtime),
-            ).fetchone()
-        return row is not None
-    except sqlite3.Error:
+        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        fh.close()
         return False
+    _elected.append(fh)
+    return True
 
 
-def _history_checksum_uploaded(checksum):
-    if not checksum:
-        return False
-    try:
-        with history_lock, sqlite3.connect(HISTORY_DB) as c:
-            row = c.execute(
-                "SELECT 1 FROM uploads WHERE checksum=? LIMIT 1",
-                (checksum,),
-            ).fetchone()
-        return row is not None
-    except sqlite3.Error:
-        return False
-
+_elected = []
 
-def _file_checksum(abs_path, size, mtime):
-    """sha256 of the file, cached by (abs_path, size, mtime). None on read error."""
-    try:
-        with history_lock, sqlite3.connect(HISTORY_DB) as c:
-            row = c.execute(
-                "SELECT checksum FROM file_hashes WHERE abs_path=? AND size=? AND mtime=?",
-                (abs_path, size, mtime),
-            ).fetchone()
-        if row:
-            return row[0]
-    except sqlite3.Error:
-        pass
-
-    h = hashlib.sha256()
-    try:
-        with open(abs_path, 'rb') as f:
-            while True:
-                chunk = f.read(HASH_CHUNK_SIZE)
-                if not chunk:
-                    break
-                h.update(chunk)
-    except OSError:
-        return None
-    checksum = h.hexdigest()
 
-    try:
-        with history_lock, sqlite3.connect(HISTORY_DB) as c:
-            c.execute(
-                """INSERT OR IGNORE INTO file_hashes (abs_path, size, mtime, checksum)
-                VALUES (?,?,?,?)""",
-                (abs_path, size, mtime, checksum),
-            )
-    except sqlite3.Error:
-        pass
-    return checksum
+# Optional idle-time hashing of the browse folder (PREHASH_ENABLED=1), so dedupe at
+# upload time finds checksums already cached instead of reading the files then.
+# Created by start_background() in the one web process that wins the election.
+prehasher = None
 
 
-def _history_record(abs_path, filename, dest_path, size, mtime, checksum=None):
-    try:
-        with history_lock, sqlite3.connect(HISTORY_DB) as c:
-            c.execute(
-                """INSERT OR IGNORE INTO uploads
-                (abs_path, filename, dest_path, size, mtime, checksum, finished_at)
-                VALUES (?,?,?,?,?,?,?)""",
-                (abs_path, filename, dest_path, size, mtime, checksum, time.time()),
-            )
-    except sqlite3.Error as e:
-        app.logger.warning('History record failed: ' + str(e))
-
-
-_history_init()
+def _start_prehasher():
+    global prehasher
+    if os.environ.get('PREHASH_ENABLED', '').lower() not in ('1', 'true', 'yes') or not _elect('prehash'):
+        return
+    # No device slot: the pre-hasher pauses mid-file while uploads run and must not
+    # hold a slot an upload's hashing is waiting for.
+    prehasher = PreHasher(
+        BROWSE_FOLDER, lambda *a, **kw: _file_checksum(*a, io_slot=False, **kw), _uploads_running,
+        rate=parse_rate(os.environ.get('PREHASH_RATE', '20M')),
+        interval=int(os.environ.get('PREHASH_INTERVAL', str(6 * 3600))),
+    )
+    prehasher.start()
 
 
 def verify_password(password):
@@ -220,6 +219,7 @@ def get_files_recursive(folder_path):
         return results
     if not os.path.isdir(abs_folder):
         return results
+    # Metadata only: no reader slot, which a hash on the same disk may hold for minutes.
     for dirpath, dirnames, filenames in os.walk(abs_folder):
         dirnames.sort()
         rel_dir = os.path.relpath(dirpath, abs_folder)
@@ -228,53 +228,225 @@ def get_files_recursive(folder_path):
         for fname in sorted(filenames):
             fpath = os.path.join(dirpath, fname)
             try:
-                size = os.path.getsize(fpath)
+                st = os.stat(fpath)
                 rel_path = os.path.join(rel_dir, fname) if rel_dir else fname
                 results.append({
                     'full_path': fpath,
                     'filename': fname,
                     'relative_dir': rel_dir,
                     'relative_path': rel_path,
-                    'size': size,
+                    'size': st.st_size,
+                    'dev': st.st_dev,
+                    'inode': st.st_ino,
                 })
             except Exception:
                 pass
     return results
 
 
+_last_shared_sweep = [0.0]
+
+
 def _sweep_status():
     now = time.time()
+    if shared_status and now - _last_shared_sweep[0] > SHARED_SWEEP_SECONDS:
+        _last_shared_sweep[0] = now
+        try:
+            shared_status.sweep(STATUS_TTL_SECONDS)
+        except sqlite3.Error:
+            pass
     with upload_lock:
+        upload_status.expire(now - STATUS_TTL_SECONDS)
+        # Batches are few; a scan is fine there.
         stale = [
-            uid for uid, rec in upload_status.items()
-            if rec.get('finished_at') and now - rec['finished_at'] > STATUS_TTL_SECONDS
+            bid for bid, batch in batch_status.items()
+            if batch.get('finished_at') and now - batch['finished_at'] > STATUS_TTL_SECONDS
         ]
-        for uid in stale:
-            upload_status.pop(uid, None)
+        for bid in stale:
+            batch_status.pop(bid, None)
+
+
+def _inflight_claim(key, upload_id, claimed):
+    """
+    Block until no other upload holds key, then take it (appended to claimed).
+    Callers re-check history afterwards: the previous holder may have uploaded it.
+    With shared status the key is also claimed across processes.
+    """
+    while True:
+        with inflight_lock:
+            ev = inflight.get(key)
+            if ev is None:
+                inflight[key] = threading.Event()
+                claimed.append(key)
+                break
+        _inflight_waiting(upload_id)
+        ev.wait()
+    if shared_status:
+        while True:
+            try:
+                if shared_status.claim(key):
+                    return
+            except sqlite3.Error:
+                return  # dedupe across processes is best effort
+            _inflight_waiting(upload_id)
+            time.sleep(STATUS_PUBLISH_SECONDS)
+
+
+def _inflight_waiting(upload_id):
+    with upload_lock:
+        rec = upload_status.get(upload_id)
+        if rec is not None:
+            rec['message'] = 'Waiting for identical upload in progress'
 
 
-def _run_upload(upload_id, filepath, filename, username, password, dest_path, force=False):
-    last_progress = {'bytes': 0, 'time': 0.0}
+def _inflight_release(claimed):
+    if shared_status and claimed:
+        try:
+            shared_status.release(claimed)
+        except sqlite3.Error:
+            pass
+    with inflight_lock:
+        for key in claimed:
+            ev = inflight.pop(key, None)
+            if ev is not None:
+                ev.set()
+    del claimed[:]
+
+
+def _status_publisher():
+    """
+    Copy records that changed since the last round into the shared status DB,
+    and renew this process's claim and job leases there.
+    """
+    published_batches = {}
+    last_heartbeat = 0.0
+    while True:
+        time.sleep(STATUS_PUBLISH_SECONDS)
+        if time.time() - last_heartbeat > SHARED_HEARTBEAT_SECONDS:
+            last_heartbeat = time.time()
+            try:
+                shared_status.heartbeat()
+            except sqlite3.Error:
+                pass
+        with upload_lock:
+            uploads = upload_status.take_dirty()
+            batches = [(bid, dict(b)) for bid, b in batch_status.items()]
+        sigs = {bid: json.dumps(b, sort_keys=True) for bid, b in batches}
+        batches = [(bid, b) for bid, b in batches if published_batches.get(bid) != sigs[bid]]
+        if not uploads and not batches:
+            continue
+        try:
+            shared_status.publish(uploads, batches)
+            published_batches = sigs
+        except sqlite3.Error:
+            with upload_lock:
+                upload_status.mark_dirty(uid for uid, _ in uploads)  # write them again next round
+
 
-    def on_progress(sent, total):
-        now = time.time()
-        if sent != total and sent - last_progress['bytes'] < PROGRESS_THROTTLE_BYTES \
-                and now - last_progress['time'] < PROGRESS_THROTTLE_SECONDS:
+def _publish_progress(samples):
+    """Sampler callback: one upload_lock round for every transfer in flight."""
+    with upload_lock:
+        for uid, sent, rate, eta in samples:
+            rec = upload_status.get(uid)
+            if rec is None or rec['finished_at'] is not None:
+                continue
+            rec['bytes_sent'] = sent
+            rec['throughput'] = int(rate)
+            rec['eta'] = round(eta, 1) if eta is not None else None
+            if rec['status'] == 'queued':
+                rec['status'] = 'uploading'
+
+
+# Send loops only store counters; this thread turns them into status every PROGRESS_SAMPLE_SECONDS.
+progress_sampler = ProgressSampler(_publish_progress, PROGRESS_SAMPLE_SECONDS)
+_background_started = []
+
+
+def start_background(prehash=True):
+    """
+    Start this process's background threads: the progress sampler, the status
+    publisher (with SHARED_STATUS_DB) and, with prehash, the pre-hasher election.
+    Importing app starts nothing, so worker.py and one-off imports stay quiet;
+    gunicorn.conf.py calls this in every web worker, worker.py with prehash=False.
+    """
+    with upload_lock:
+        if _background_started:
             return
-        last_progress['bytes'] = sent
-        last_progress['time'] = now
+        _background_started.append(True)
+    progress_sampler.start()
+    if shared_status:
+        upload_status.track_dirty = True
+        threading.Thread(target=_status_publisher, name='status-publisher', daemon=True).start()
+    if prehash:
+        _start_prehasher()
+
+
+def _limiters_for(rate_limit):
+    if not rate_limit:
+        return (global_limiter,)
+    return (global_limiter, TokenBucket(rate_limit))
+
+
+def _profiled(upload_id, fn, *args):
+    """
+    Run fn(*args) under cProfile and keep the report under upload_id; with
+    SHARED_STATUS_DB also there, for the web process when a worker ran the upload.
+    """
+    report = 'profile did not finish'
+    try:
+        _, report = profile_call(fn, *args)
+    finally:
         with upload_lock:
-            rec = upload_status.get(upload_id)
-            if rec is not None:
-                rec['bytes_sent'] = sent
-                if rec['status'] == 'queued':
-                    rec['status'] = 'uploading'
+            upload_profiles[upload_id] = report
+            while len(upload_profiles) > UPLOAD_PROFILES_KEEP:
+                upload_profiles.popitem(last=False)
+        if shared_status:
+            try:
+                shared_status.put_profile(upload_id, report, UPLOAD_PROFILES_KEEP)
+            except sqlite3.Error:
+                pass
 
+
+def _timings_record(timings):
+    """Uploader phase timings as stored on a status record (ms resolution)."""
+    return {k: round(v, 3) if isinstance(v, float) else v for k, v in timings.items()}
+
+
+def _timings_add(total, timings):
+    """Batch aggregate: a new dict with timings added and the file count bumped."""
+    out = dict(total or {'files': 0})
+    out['files'] += 1
+    for k, v in timings.items():
+        out[k] = round(out.get(k, 0) + v, 3)
+    return out
+
+
+def _upload_maybe_split(uploader, filepath, dest, filename, size, split_size, **kwargs):
+    """upload_file, or upload_file_split for files over split_size. Returns (ok, err, volumes)."""
+    kwargs['opener'] = io_scheduler.open
+    if split_size and size > split_size:
+        ok, err = uploader.upload_file_split(filepath, dest, split_size, filename=filename,
+                                             workers=UPLOAD_SPLIT_WORKERS, **kwargs)
+        return ok, err, len(uploader.last_volumes)
+    ok, err = uploader.upload_file(filepath, dest, filename=filename, **kwargs)
+    return ok, err, None
+
+
+def _run_upload(upload_id, filepath, filename, dest_path, force=False, rate_limit=0, split_size=0,
+                controller=None, shard_key=None, limiters=None):
+    """
+    One file. controller (AdaptiveConcurrency) gets the sent bytes and transport
+    errors; shard_key picks the account (default dest_path, a batch passes its base);
+    limiters replaces the ones made for rate_limit (a queued batch shares them).
+    """
+    claimed = []
+    UPLOADS_STARTED.inc()
     try:
         try:
             size = os.path.getsize(filepath)
             mtime = os.path.getmtime(filepath)
         except OSError as e:
+            UPLOADS_FINISHED.inc(result='error')
             with upload_lock:
                 rec = upload_status.get(upload_id)
                 if rec is not None:
@@ -283,7 +455,10 @@ def _run_upload(upload_id, filepath, filename, username, password, dest_path, fo
                     rec['finished_at'] = time.time()
             return
 
-        if not force and _history_is_uploaded(filepath, dest_path, size, mtime):
+        if not force:
+            _inflight_claim(('path', filepath, size, mtime), upload_id, claimed)
+        if not force and history.is_uploaded(filepath, dest_path, size, mtime):
+            UPLOADS_FINISHED.inc(result='cached')
             with upload_lock:
                 rec = upload_status.get(upload_id)
                 if rec is not None:
@@ -294,7 +469,10 @@ def _run_upload(upload_id, filepath, filename, username, password, dest_path, fo
             return
 
         checksum = _file_checksum(filepath, size, mtime)
-        if not force and _history_checksum_uploaded(checksum):
+        if not force and checksum:
+            _inflight_claim(('sha', checksum), upload_id, claimed)
+        if not force and history.checksum_uploaded(checksum):
+            UPLOADS_FINISHED.inc(result='duplicate')
             with upload_lock:
                 rec = upload_status.get(upload_id)
                 if rec is not None:
@@ -304,8 +482,9 @@ def _run_upload(upload_id, filepath, filename, username, password, dest_path, fo
                     rec['finished_at'] = time.time()
             return
 
-        uploader = ChomikUploader(username, password)
-        if not uploader.login():
+        account, uploader = account_pool.acquire(shard_key or dest_path, size)
+        if uploader is None:
+            UPLOADS_FINISHED.inc(result='error')
             with upload_lock:
                 rec = upload_status.get(upload_id)
                 if rec is not None:
@@ -314,132 +493,343 @@ def _run_upload(upload_id, filepath, filename, username, password, dest_path, fo
                     rec['finished_at'] = time.time()
             return
 
-        ok, err = uploader.upload_file(
-            filepath, dest_path, filename=filename, on_progress=on_progress
-        )
+        def on_attempt(attempt, error):
+            if controller is not None:
+                controller.record_error()
+            with upload_lock:
+                rec = upload_status.get(upload_id)
+                if rec is not None:
+                    rec['attempts'] = attempt + 1
+                    rec['bytes_sent'] = 0
+                    rec['message'] = 'Retrying (attempt ' + str(attempt + 1) + '): ' + error
+
+        progress = progress_sampler.register(upload_id, controller.add_bytes if controller else None)
+        try:
+            ok, err, volumes = _upload_maybe_split(
+                uploader, filepath, dest_path, filename, size, split_size,
+                on_progress=progress.update, limiters=limiters or _limiters_for(rate_limit),
+                on_attempt=on_attempt,
+            )
+            # Read before release: another thread may take this uploader right after.
+            transport, attempts, timings = uploader.last_transport, uploader.last_attempts, uploader.last_timings
+        finally:
+            progress_sampler.unregister(upload_id)
+            account_pool.release(account, uploader, size)
+        if controller is not None and not ok and (err or '').startswith(_BACKOFF_ERRORS):
+            controller.record_error()
+        UPLOADS_FINISHED.inc(result='success' if ok else 'error')
         with upload_lock:
             rec = upload_status.get(upload_id)
             if rec is None:
                 return
             rec['finished_at'] = time.time()
+            rec['account'] = account.username
+            rec['transport'] = transport
+            rec['attempts'] = attempts
+            rec['timings'] = _timings_record(timings)
             if ok:
                 rec['status'] = 'success'
                 rec['bytes_sent'] = rec['total_bytes']
-                rec['message'] = 'Uploaded'
+                rec['message'] = 'Uploaded' + (' as ' + str(volumes) + ' volumes' if volumes else '')
             else:
                 rec['status'] = 'error'
                 rec['message'] = err or 'Upload failed'
         if ok:
-            _history_record(filepath, filename, dest_path, size, mtime, checksum)
+            history.record(filepath, filename, dest_path, size, mtime, checksum, volumes,
+                           account.username)
     except Exception as e:
+        UPLOADS_FINISHED.inc(result='error')
         with upload_lock:
             rec = upload_status.get(upload_id)
             if rec is not None:
                 rec['status'] = 'error'
                 rec['message'] = 'Worker exception: ' + str(e)
                 rec['finished_at'] = time.time()
+    finally:
+        _inflight_release(claimed)
+
+
+# Transient-looking failures (network, server refusing) make the batch back off;
+# local problems like a missing file don't say anything about the link.
+_BACKOFF_ERRORS = ('Socket error', 'Upload server rejected', 'Upload server closed',
+                   'UploadToken request failed', 'UploadToken rejected', 'DNS lookup failed')
+
 
+def _run_batch_upload(files_info, base_dest_path, force=False, rate_limit=0, batch_id=None,
+                      split_size=0, profile=False):
+    limiters = _limiters_for(rate_limit)
+    controller = AdaptiveConcurrency(
+        initial=UPLOAD_CONCURRENCY_INITIAL, maximum=UPLOAD_CONCURRENCY_MAX
+    )
+    pending = iter(files_info)
+    pending_lock = threading.Lock()
+    aborted = threading.Event()
 
-def _run_batch_upload(files_info, username, password, base_dest_path, force=False):
     def _fail_all(msg):
         with upload_lock:
             for fi in files_info:
                 rec = upload_status.get(fi['upload_id'])
                 if rec and rec['status'] in ('queued', 'uploading'):
                     rec['status'] = 'error'
+                    UPLOADS_FINISHED.inc(result='error')
                     rec['message'] = msg
                     rec['finished_at'] = time.time()
 
-    try:
-        uploader = None
-        for fi in files_info:
-            upload_id = fi['upload_id']
-            filepath = fi['full_path']
-            filename = fi['filename']
-            rel_dir = fi['relative_dir']
+    def _publish_batch():
+        with upload_lock:
+            batch = batch_status.get(batch_id)
+            if batch is not None:
+                batch['concurrency'] = controller.limit
+                batch['throughput'] = int(controller.throughput)
 
-            dest = (base_dest_path.rstrip('/') + '/' + rel_dir) if rel_dir else base_dest_path
+    def _upload_one(fi, claimed):
+        upload_id = fi['upload_id']
+        filepath = fi['full_path']
+        rel_dir = fi['relative_dir']
 
-            try:
-                size = os.path.getsize(filepath)
-                mtime = os.path.getmtime(filepath)
-            except OSError as e:
-                with upload_lock:
-                    rec = upload_status.get(upload_id)
-                    if rec is not None:
-                        rec['status'] = 'error'
-                        rec['message'] = 'File stat failed: ' + str(e)
-                        rec['finished_at'] = time.time()
-                continue
+        dest = (base_dest_path.rstrip('/') + '/' + rel_dir) if rel_dir else base_dest_path
+        UPLOADS_STARTED.inc()
 
-            if not force and _history_is_uploaded(filepath, dest, size, mtime):
-                with upload_lock:
-                    rec = upload_status.get(upload_id)
-                    if rec is not None:
-                        rec['status'] = 'success'
-                        rec['bytes_sent'] = rec['total_bytes']
-                        rec['message'] = 'Already uploaded (cached)'
-                        rec['finished_at'] = time.time()
-                continue
+        try:
+            size = os.path.getsize(filepath)
+            mtime = os.path.getmtime(filepath)
+        except OSError as e:
+            UPLOADS_FINISHED.inc(result='error')
+            with upload_lock:
+                rec = upload_status.get(upload_id)
+                if rec is not None:
+                    rec['status'] = 'error'
+                    rec['message'] = 'File stat failed: ' + str(e)
+                    rec['finished_at'] = time.time()
+            return
 
-            checksum = _file_checksum(filepath, size, mtime)
-            if not force and _history_checksum_uploaded(checksum):
-                with upload_lock:
-                    rec = upload_status.get(upload_id)
-                    if rec is not None:
-                        rec['status'] = 'success'
-                        rec['bytes_sent'] = rec['total_bytes']
-                        rec['message'] = 'Already uploaded (duplicate content)'
-                        rec['finished_at'] = time.time()
-                continue
+        if not force:
+            _inflight_claim(('path', filepath, size, mtime), upload_id, claimed)
+        if not force and history.is_uploaded(filepath, dest, size, mtime):
+            UPLOADS_FINISHED.inc(result='cached')
+            with upload_lock:
+                rec = upload_status.get(upload_id)
+                if rec is not None:
+                    rec['status'] = 'success'
+                    rec['bytes_sent'] = rec['total_bytes']
+                    rec['message'] = 'Already uploaded (cached)'
+                    rec['finished_at'] = time.time()
+            return
 
-            if uploader is None:
-                uploader = ChomikUploader(username, password)
-                if not uploader.login():
-                    _fail_all('Authentication with Chomikuj failed')
-                    return
+        checksum = _file_checksum(filepath, size, mtime)
+        if not force and checksum:
+            _inflight_claim(('sha', checksum), upload_id, claimed)
+        if not force and history.checksum_uploaded(checksum):
+            UPLOADS_FINISHED.inc(result='duplicate')
+            with upload_lock:
+                rec = upload_status.get(upload_id)
+                if rec is not None:
+                    rec['status'] = 'success'
+                    rec['bytes_sent'] = rec['total_bytes']
+                    rec['message'] = 'Already uploaded (duplicate content)'
+                    rec['finished_at'] = time.time()
+            return
+
+        account, uploader = account_pool.acquire(base_dest_path, size)
+        if uploader is None:
+            aborted.set()
+            _fail_all('Authentication with Chomikuj failed')
+            return
+        try:
+            _send(fi, dest, size, mtime, checksum, account, uploader)
+        finally:
+            account_pool.release(account, uploader, size)
 
-            last_progress = {'bytes': 0, 'time': 0.0}
+    def _send(fi, dest, size, mtime, checksum, account, uploader):
+        upload_id = fi['upload_id']
+        filepath = fi['full_path']
+        filename = fi['filename']
 
-            def on_progress(sent, total, uid=upload_id, lp=last_progress):
-                now = time.time()
-                if sent != total and sent - lp['bytes'] < PROGRESS_THROTTLE_BYTES \
-                        and now - lp['time'] < PROGRESS_THROTTLE_SECONDS:
-                    return
-                lp['bytes'] = sent
-                lp['time'] = now
-                with upload_lock:
-                    rec = upload_status.get(uid)
-                    if rec is not None:
-                        rec['bytes_sent'] = sent
-                        if rec['status'] == 'queued':
-                            rec['status'] = 'uploading'
+        def on_attempt(attempt, error, uid=upload_id):
+            controller.record_error()
+            with upload_lock:
+                rec = upload_status.get(uid)
+                if rec is not None:
+                    rec['attempts'] = attempt + 1
+                    rec['bytes_sent'] = 0
+                    rec['message'] = 'Retrying (attempt ' + str(attempt + 1) + '): ' + error
 
+        progress = progress_sampler.register(upload_id, controller.add_bytes)
+        try:
+            ok, err, volumes = _upload_maybe_split(
+                uploader, filepath, dest, filename, size, split_size,
+                on_progress=progress.update, limiters=limiters, on_attempt=on_attempt,
+            )
+        finally:
+            progress_sampler.unregister(upload_id)
+        if not ok and (err or '').startswith(_BACKOFF_ERRORS):
+            controller.record_error()
+        UPLOADS_FINISHED.inc(result='success' if ok else 'error')
+        with upload_lock:
+            rec = upload_status.get(upload_id)
+            if rec is not None:
+                rec['finished_at'] = time.time()
+                rec['transport'] = uploader.last_transport
+                rec['attempts'] = uploader.last_attempts
+                rec['timings'] = _timings_record(uploader.last_timings)
+                rec['account'] = account.username
+                if ok:
+                    rec['status'] = 'success'
+                    rec['bytes_sent'] = rec['total_bytes']
+                    rec['message'] = 'Uploaded' + (' as ' + str(volumes) + ' volumes' if volumes else '')
+                else:
+                    rec['status'] = 'error'
+                    rec['message'] = err or 'Upload failed'
+            batch = batch_status.get(batch_id)
+            if batch is not None:
+                batch['timings'] = _timings_add(batch.get('timings'), uploader.last_timings)
+        if ok:
+            history.record(filepath, filename, dest, size, mtime, checksum, volumes,
+                           account.username)
+
+    def _worker():
+        while not aborted.is_set():
+            controller.acquire()
             try:
-                ok, err = uploader.upload_file(filepath, dest, filename=filename, on_progress=on_progress)
-                with upload_lock:
-                    rec = upload_status.get(upload_id)
-                    if rec is None:
-                        continue
-                    rec['finished_at'] = time.time()
-                    if ok:
-                        rec['status'] = 'success'
-                        rec['bytes_sent'] = rec['total_bytes']
-                        rec['message'] = 'Uploaded'
+                with pending_lock:
+                    fi = next(pending, None)
+                if fi is None:
+                    return
+                claimed = []
+                try:
+                    if profile:
+                        _profiled(fi['upload_id'], _upload_one, fi, claimed)
                     else:
-                        rec['status'] = 'error'
-                        rec['message'] = err or 'Upload failed'
-                if ok:
-                    _history_record(filepath, filename, dest, size, mtime, checksum)
-            except Exception as e:
-                with upload_lock:
-                    rec = upload_status.get(upload_id)
-                    if rec is not None:
-                        rec['status'] = 'error'
-                        rec['message'] = 'Worker exception: ' + str(e)
-                        rec['finished_at'] = time.time()
+                        _upload_one(fi, claimed)
+                except Exception as e:
+                    UPLOADS_FINISHED.inc(result='error')
+                    with upload_lock:
+                        rec = upload_status.get(fi['upload_id'])
+                        if rec is not None:
+                            rec['status'] = 'error'
+                            rec['message'] = 'Worker exception: ' + str(e)
+                            rec['finished_at'] = time.time()
+                finally:
+                    _inflight_release(claimed)
+            finally:
+                controller.release()
+                _publish_batch()
+
+    try:
+        workers = [
+            threading.Thread(target=_worker, daemon=True)
+            for _ in range(min(controller.maximum, len(files_info)))
+        ]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
     except Exception as e:
         _fail_all('Batch error: ' + str(e))
+    finally:
+        with upload_lock:
+            batch = batch_status.get(batch_id)
+            if batch is not None:
+                batch['finished_at'] = time.time()
+
+
+def _run_archive_upload(upload_id, all_files, fmt, archive_name, dest_path, force=False,
+                        rate_limit=0):
+    """Pack all_files into one stored archive streamed straight into the upload body."""
+    def _finish(status, message):
+        UPLOADS_FINISHED.inc(result='cached' if message.startswith('Already uploaded') else status)
+        with upload_lock:
+            rec = upload_status.get(upload_id)
+            if rec is not None:
+                rec['status'] = status
+                rec['message'] = message
+                rec['finished_at'] = time.time()
+                if status == 'success':
+                    rec['bytes_sent'] = rec['total_bytes']
+
+    UPLOADS_STARTED.inc()
+    try:
+        entries = []
+        for fi in all_files:
+            try:
+                size = os.path.getsize(fi['full_path'])
+                mtime = os.path.getmtime(fi['full_path'])
+            except OSError:
+                continue
+            if not force and history.any_uploaded(fi['full_path'], size, mtime):
+                continue
+            entries.append(ArchiveEntry(fi['full_path'], fi['relative_path'], size, mtime))
+        if not entries:
+            _finish('success', 'Already uploaded (cached)')
+            return
+
+        try:
+            size = open_archive(fmt, entries).size
+        except ValueError as e:
+            _finish('error', str(e))
+            return
+        with upload_lock:
+            rec = upload_status.get(upload_id)
+            if rec is not None:
+                rec['total_bytes'] = size
+                rec['message'] = 'Packing ' + str(len(entries)) + ' files'
+
+        account, uploader = account_pool.acquire(dest_path, size)
+        if uploader is None:
+            _finish('error', 'Authentication with Chomikuj failed')
+            return
+
+        def on_attempt(attempt, error):
+            with upload_lock:
+                rec = upload_status.get(upload_id)
+                if rec is not None:
+                    rec['attempts'] = attempt + 1
+                    rec['bytes_sent'] = 0
+                    rec['message'] = 'Retrying (attempt ' + str(attempt + 1) + '): ' + error
+
+        readers = []
+
+        def open_source():
+            readers.append(open_archive(fmt, entries, io_scheduler.open))
+            return readers[-1]
+
+        progress = progress_sampler.register(upload_id)
+        try:
+            ok, err = uploader.upload_stream(
+                open_source, size, archive_name, dest_path, on_progress=progress.update,
+                limiters=_limiters_for(rate_limit), on_attempt=on_attempt,
+            )
+            # Read before release: another thread may take this uploader right after.
+            transport, attempts, timings = uploader.last_transport, uploader.last_attempts, uploader.last_timings
+        finally:
+            progress_sampler.unregister(upload_id)
+            account_pool.release(account, uploader, size)
+        with upload_lock:
+            rec = upload_status.get(upload_id)
+            if rec is not None:
+                rec['transport'] = transport
+                rec['attempts'] = attempts
+                rec['timings'] = _timings_record(timings)
+                rec['account'] = account.username
+        if not ok:
+            _finish('error', err or 'Upload failed')
+            return
+
+        # Files that changed while being packed went up zero-padded/truncated:
+        # leave them out of history so the next run picks them up again.
+        changed = set(readers[-1].changed) if readers else set()
+        archive_dest = dest_path.rstrip('/') + '/' + archive_name
+        history.record_many(
+            ((e.path, os.path.basename(e.path), archive_dest, e.size, e.mtime, None)
+             for e in entries if e.path not in changed),
+            account=account.username,
+        )
+        message = 'Uploaded ' + str(len(entries)) + ' files as ' + archive_name
+        if changed:
+            message += ' (' + str(len(changed)) + ' changed during upload, not recorded)'
+        _finish('success', message)
+    except Exception as e:
+        _finish('error', 'Worker exception: ' + str(e))
 
 
 HTML_LOGIN = """
@@ -649,6 +1039,18 @@ HTML_FORM = """
 
         window.addEventListener('load', () => { loadFiles(''); restoreActiveUploads(); });
 
+        function rateEta(s) {
+            if (s.status !== 'uploading' || !s.throughput) return '';
+            let out = ` · ${(s.throughput / 1024 / 1024).toFixed(1)} MB/s`;
+            if (s.eta != null) {
+                const sec = Math.round(s.eta);
+                const h = Math.floor(sec / 3600), m = Math.floor(sec % 3600 / 60), r = sec % 60;
+                out += ' · zostało ' + (h ? `${h}:${String(m).padStart(2, '0')}` : m)
+                    + ':' + String(r).padStart(2, '0');
+            }
+            return out;
+        }
+
         function restoreActiveUploads() {
             fetch('/api/uploads/active')
                 .then(r => r.json())
@@ -663,7 +1065,7 @@ HTML_FORM = """
                             const sentMB = (u.bytes_sent / 1024 / 1024).toFixed(2);
                             const totMB  = (u.total_bytes / 1024 / 1024).toFixed(2);
                             updateFileStatus(u.filename, 'uploading',
-                                `Wysyłanie ${sentMB} / ${totMB} MB`, pct);
+                                `Wysyłanie ${sentMB} / ${totMB} MB` + rateEta(u), pct);
                             pollUpload(fileObj, u.upload_id, () => {});
                         } else if (u.status === 'success') {
                             const msg = (u.message === 'Already uploaded (cached)')
@@ -941,7 +1343,7 @@ HTML_FORM = """
                             const sentMB = (s.bytes_sent / 1024 / 1024).toFixed(2);
                             const totMB = (s.total_bytes / 1024 / 1024).toFixed(2);
                             updateFileStatus(file.name, 'uploading',
-                                `Wysyłanie ${sentMB} / ${totMB} MB`, pct);
+                                `Wysyłanie ${sentMB} / ${totMB} MB` + rateEta(s), pct);
                         } else if (s.status === 'success') {
                             clearInterval(handle);
                             const msg = (s.message === 'Already uploaded (cached)')
@@ -1146,6 +1548,15 @@ def api_upload():
     filepath = data.get('filepath')
     filename = data.get('filename')
     force = bool(data.get('force'))
+    profile = bool(data.get('profile'))
+    try:
+        rate_limit = parse_rate(data.get('rate_limit'))
+    except ValueError:
+        return json_response({'success': False, 'message': 'Nieprawidłowy limit przepustowości'}, 400)
+    try:
+        split_size = parse_size(data.get('split_size')) if 'split_size' in data else UPLOAD_SPLIT_SIZE
+    except ValueError:
+        return json_response({'success': False, 'message': 'Nieprawidłowy rozmiar wolumenu'}, 400)
 
     if not filepath or not filename:
         return json_response({'success': False, 'message': 'Brak ścieżki do pliku'}, 400)
@@ -1158,11 +1569,9 @@ def api_upload():
     if not os.path.exists(filepath):
         return json_response({'success': False, 'message': 'Plik nie istnieje'}, 404)
 
-    username = os.environ.get('CHOMIK_USERNAME')
-    password = os.environ.get('CHOMIK_PASSWORD')
     dest_path = os.environ.get('CHOMIK_DEST', '/Moje_Uploady')
 
-    if not username or not password:
+    if not len(account_pool):
         return json_response({
             'success': False,
             'message': 'Brak konfiguracji CHOMIK_USERNAME lub CHOMIK_PASSWORD',
@@ -1170,20 +1579,36 @@ def api_upload():
 
     upload_id = uuid.uuid4().hex
     total_bytes = os.path.getsize(filepath)
-    with upload_lock:
-        upload_status[upload_id] = {
-            'status': 'queued',
-            'bytes_sent': 0,
+    record = {
+        'status': 'queued',
+        'bytes_sent': 0,
+        'total_bytes': total_bytes,
+        'filename': filename,
+        'message': 'Queued',
+        'started_at': time.time(),
+        'finished_at': None,
+    }
+
+    if UPLOAD_MODE == 'queue':
+        error = _enqueue([(upload_id, 'file', {
+            'filepath': filepath, 'filename': filename, 'dest_path': dest_path,
+            'force': force, 'rate_limit': rate_limit, 'split_size': split_size, 'profile': profile,
+        }, record)])
+        if error:
+            return error
+        return json_response({
+            'success': True,
+            'upload_id': upload_id,
             'total_bytes': total_bytes,
-            'filename': filename,
-            'message': 'Queued',
-            'started_at': time.time(),
-            'finished_at': None,
-        }
+            'message': 'Upload queued',
+        }, 202)
 
+    with upload_lock:
+        upload_status[upload_id] = record
+    args = (upload_id, filepath, filename, dest_path, force, rate_limit, split_size)
     t = threading.Thread(
-        target=_run_upload,
-        args=(upload_id, filepath, filename, username, password, dest_path, force),
+        target=_profiled if profile else _run_upload,
+        args=(upload_id, _run_upload) + args if profile else args,
         daemon=True,
     )
     t.start()
@@ -1207,7 +1632,22 @@ def api_upload_folder():
 
     folder_path = data.get('folder_path', '')
     force = bool(data.get('force'))
+    profile = bool(data.get('profile'))
     confirmed = bool(data.get('confirmed'))
+    archive = data.get('archive') or None
+    if archive is not None and archive not in ARCHIVE_FORMATS:
+        return json_response({'success': False, 'message': 'Nieobsługiwany format archiwum'}, 400)
+    order = data.get('order') or UPLOAD_ORDER
+    if order not in BATCH_ORDERS:
+        return json_response({'success': False, 'message': 'Nieznana kolejność wysyłania'}, 400)
+    try:
+        rate_limit = parse_rate(data.get('rate_limit'))
+    except ValueError:
+        return json_response({'success': False, 'message': 'Nieprawidłowy limit przepustowości'}, 400)
+    try:
+        split_size = parse_size(data.get('split_size')) if 'split_size' in data else UPLOAD_SPLIT_SIZE
+    except ValueError:
+        return json_response({'success': False, 'message': 'Nieprawidłowy rozmiar wolumenu'}, 400)
 
     abs_folder = os.path.abspath(
         os.path.join(BROWSE_FOLDER, folder_path) if folder_path else BROWSE_FOLDER
@@ -1218,11 +1658,9 @@ def api_upload_folder():
     if not os.path.isdir(abs_folder):
         return json_response({'success': False, 'message': 'Folder nie istnieje'}, 404)
 
-    username = os.environ.get('CHOMIK_USERNAME')
-    password = os.environ.get('CHOMIK_PASSWORD')
     chomik_dest = os.environ.get('CHOMIK_DEST', '/Moje_Uploady')
 
-    if not username or not password:
+    if not len(account_pool):
         return json_response({
             'success': False,
             'message': 'Brak konfiguracji CHOMIK_USERNAME lub CHOMIK_PASSWORD',
@@ -1240,7 +1678,7 @@ def api_upload_folder():
         for fi in all_files:
             try:
                 fp = fi['full_path']
-                if _history_any_uploaded(fp, os.path.getsize(fp), os.path.getmtime(fp)):
+                if history.any_uploaded(fp, os.path.getsize(fp), os.path.getmtime(fp)):
                     cached_count += 1
             except OSError:
                 continue
@@ -1255,76 +1693,256 @@ def api_upload_folder():
     folder_name = os.path.basename(abs_folder)
     base_dest_path = chomik_dest.rstrip('/') + '/' + folder_name
 
+    if archive:
+        # Archive mode: one upload of a stored archive built on the fly, next to where
+        # the folder itself would have been created.
+        archive_name = folder_name + '_' + time.strftime('%Y%m%d-%H%M%S') + '.' + archive
+        upload_id = uuid.uuid4().hex
+        total_bytes = sum(fi['size'] for fi in all_files)
+        record = {
+            'status': 'queued',
+            'bytes_sent': 0,
+            'total_bytes': total_bytes,
+            'filename': archive_name,
+            'message': 'Queued',
+            'started_at': time.time(),
+            'finished_at': None,
+        }
+        if UPLOAD_MODE == 'queue':
+            error = _enqueue([(upload_id, 'archive', {
+                'files': [{'full_path': fi['full_path'], 'relative_path': fi['relative_path']}
+                          for fi in all_files],
+                'fmt': archive, 'archive_name': archive_name, 'dest_path': chomik_dest,
+                'force': force, 'rate_limit': rate_limit,
+            }, record)])
+            if error:
+                return error
+        else:
+            with upload_lock:
+                upload_status[upload_id] = record
+            t = threading.Thread(
+                target=_run_archive_upload,
+                args=(upload_id, all_files, archive, archive_name, chomik_dest, force, rate_limit),
+                daemon=True,
+            )
+            t.start()
+        return json_response({
+            'success': True,
+            'uploads': [{
+                'upload_id': upload_id,
+                'filename': archive_name,
+                'relative_path': archive_name,
+                'total_bytes': total_bytes,
+            }],
+            'message': f'Archive upload started: {len(all_files)} files',
+        }, 202)
+
+    all_files = order_files(all_files, order)
     files_info = []
     uploads_response = []
+    records = {}
     now = time.time()
-    with upload_lock:
-        for fi in all_files:
-            uid = uuid.uuid4().hex
-            upload_status[uid] = {
-                'status': 'queued',
-                'bytes_sent': 0,
-                'total_bytes': fi['size'],
-                'filename': fi['relative_path'],
-                'message': 'Queued',
-                'started_at': now,
-                'finished_at': None,
-            }
-            files_info.append({
-                'upload_id': uid,
-                'full_path': fi['full_path'],
-                'filename': fi['filename'],
-                'relative_dir': fi['relative_dir'],
-            })
-            uploads_response.append({
-                'upload_id': uid,
-                'filename': fi['filename'],
-                'relative_path': fi['relative_path'],
-                'total_bytes': fi['size'],
-            })
+    batch_id = uuid.uuid4().hex
+    batch = {
+        'folder': folder_name,
+        'files': len(all_files),
+        'order': order,
+        'concurrency': min(UPLOAD_CONCURRENCY_INITIAL, UPLOAD_CONCURRENCY_MAX),
+        'throughput': 0,
+        'started_at': now,
+        'finished_at': None,
+    }
+    for fi in all_files:
+        uid = uuid.uuid4().hex
+        records[uid] = {
+            'status': 'queued',
+            'bytes_sent': 0,
+            'total_bytes': fi['size'],
+            'filename': fi['relative_path'],
+            'message': 'Queued',
+            'started_at': now,
+            'finished_at': None,
+            'batch_id': batch_id,
+        }
+        files_info.append({
+            'upload_id': uid,
+            'full_path': fi['full_path'],
+            'filename': fi['filename'],
+            'relative_dir': fi['relative_dir'],
+        })
+        uploads_response.append({
+            'upload_id': uid,
+            'filename': fi['filename'],
+            'relative_path': fi['relative_path'],
+            'total_bytes': fi['size'],
+        })
+
+    if UPLOAD_MODE == 'queue':
+        # One job per file in batch order; workers share the files out between them.
+        jobs = []
+        for fi in files_info:
+            rel_dir = fi['relative_dir']
+            jobs.append((fi['upload_id'], 'file', {
+                'filepath': fi['full_path'], 'filename': fi['filename'],
+                'dest_path': (base_dest_path.rstrip('/') + '/' + rel_dir) if rel_dir else base_dest_path,
+                'shard_key': base_dest_path, 'batch_id': batch_id, 'force': force,
+                'rate_limit': rate_limit, 'split_size': split_size, 'profile': profile,
+            }, records[fi['upload_id']]))
+        error = _enqueue(jobs, (batch_id, batch))
+        if error:
+            return error
+        return json_response({
+            'success': True,
+            'batch_id': batch_id,
+            'uploads': uploads_response,
+            'message': f'Batch upload queued: {len(files_info)} files',
+        }, 202)
 
+    with upload_lock:
+        batch_status[batch_id] = batch
+        upload_status.update(records)
     t = threading.Thread(
         target=_run_batch_upload,
-        args=(files_info, username, password, base_dest_path, force),
+        args=(files_info, base_dest_path, force, rate_limit, batch_id, split_size, profile),
         daemon=True,
     )
     t.start()
 
     return json_response({
         'success': True,
+        'batch_id': batch_id,
         'uploads': uploads_response,
         'message': f'Batch upload started: {len(files_info)} files',
     }, 202)
 
 
+def _enqueue(jobs, batch=None):
+    """Queue mode: hand jobs to the workers; an error response if the queue DB failed."""
+    try:
+        shared_status.enqueue(jobs, batch)
+    except sqlite3.Error as e:
+        return json_response({'success': False, 'message': 'Kolejka zadań niedostępna: ' + str(e)}, 503)
+    return None
+
+
+def _queue_depth():
+    with upload_lock:
+        return {(status,): upload_status.count(status) for status in ('queued', 'uploading')}
+
+
+def _active_batches():
+    with upload_lock:
+        return sum(1 for b in batch_status.values() if not b.get('finished_at'))
+
+
+Gauge('chomik_upload_queue', 'Uploads waiting or in progress, by status.', _queue_depth, ('status',))
+Gauge('chomik_batches_active', 'Folder batches still running.', _active_batches)
+Gauge('chomik_jobs', 'Queue mode: jobs waiting for or held by a worker, by state.',
+      lambda: {(k,): v for k, v in shared_status.job_counts().items()} if UPLOAD_MODE == 'queue' else {},
+      ('state',))
+Gauge('chomik_upload_rate_limit_bytes', 'Current global upload cap (0 = unlimited).',
+      lambda: global_limiter.rate)
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Like every other page it needs a login; scrapers, which can't log in, send
+    # METRICS_TOKEN as a Bearer token instead. Without the token only the session works.
+    auth = request.headers.get('Authorization', '')
+    token_ok = METRICS_TOKEN and hmac.compare_digest(
+        auth.encode('utf-8'), ('Bearer ' + METRICS_TOKEN).encode('utf-8'))
+    if not token_ok and 'logged_in' not in session:
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/admin/profile', methods=['POST'])
+@login_required
+def api_admin_profile():
+    """Sample all threads for `seconds`; collapsed stacks for flamegraph.pl / speedscope."""
+    try:
+        data = json.loads(request.data or b'{}')
+        seconds = float(data.get('seconds', 10))
+        interval = float(data.get('interval_ms', 5)) / 1000.0
+    except (ValueError, TypeError, AttributeError):
+        return json_response({'success': False, 'message': 'Nieprawidłowe parametry'}, 400)
+    if not profile_lock.acquire(blocking=False):
+        return json_response({'success': False, 'message': 'Profilowanie już trwa'}, 409)
+    try:
+        stacks = sample_stacks(seconds, interval)
+    finally:
+        profile_lock.release()
+    return Response(stacks, mimetype='text/plain')
+
+
+@app.route('/api/admin/profile/<upload_id>', methods=['GET'])
+@login_required
+def api_admin_upload_profile(upload_id):
+    with upload_lock:
+        report = upload_profiles.get(upload_id)
+    if report is None and shared_status:
+        try:
+            report = shared_status.get_profile(upload_id)
+        except sqlite3.Error:
+            pass
+    if report is None:
+        return json_response({'success': False, 'message': 'Brak profilu dla tego uploadu'}, 404)
+    return Response(report, mimetype='text/plain')
+
+
 @app.route('/api/upload/status/<upload_id>', methods=['GET'])
 @login_required
 def api_upload_status(upload_id):
     with upload_lock:
         rec = upload_status.get(upload_id)
-        if rec is None:
-            return json_response({'success': False, 'message': 'Unknown upload_id'}, 404)
-        snapshot = dict(rec)
+        snapshot = dict(rec) if rec is not None else None
+    if snapshot is None and shared_status:
+        snapshot = shared_status.get(upload_id)
+    if snapshot is None:
+        return json_response({'success': False, 'message': 'Unknown upload_id'}, 404)
     return json_response(snapshot)
 
 
+def _upload_summary(uid, rec):
+    return {
+        'upload_id': uid,
+        'status': rec['status'],
+        'bytes_sent': rec['bytes_sent'],
+        'total_bytes': rec['total_bytes'],
+        'filename': rec['filename'],
+        'message': rec['message'],
+        'attempts': rec.get('attempts', 0),
+        'batch_id': rec.get('batch_id'),
+        'throughput': rec.get('throughput', 0),
+        'eta': rec.get('eta') if rec['status'] == 'uploading' else None,
+    }
+
+
 @app.route('/api/uploads/active', methods=['GET'])
 @login_required
 def api_uploads_active():
     _sweep_status()
     with upload_lock:
-        uploads = [
-            {
-                'upload_id': uid,
-                'status': rec['status'],
-                'bytes_sent': rec['bytes_sent'],
-                'total_bytes': rec['total_bytes'],
-                'filename': rec['filename'],
-                'message': rec['message'],
-            }
-            for uid, rec in upload_status.items()
-        ]
-    return json_response({'uploads': uploads})
+        uploads = [_upload_summary(uid, rec) for uid, rec in upload_status.items()]
+        batches = [dict(batch, batch_id=bid) for bid, batch in batch_status.items()]
+    if shared_status:
+        # Other processes' unfinished records (their finished ones stay readable per id);
+        # ours are fresher in memory than in the DB.
+        try:
+            shared_uploads, shared_batches = shared_status.active()
+        except sqlite3.Error:
+            shared_uploads, shared_batches = [], []
+        local = {u['upload_id'] for u in uploads}
+        uploads.extend(_upload_summary(uid, rec) for uid, rec in shared_uploads if uid not in local)
+        local = {b['batch_id'] for b in batches}
+        batches.extend(dict(b, batch_id=bid) for bid, b in shared_batches if bid not in local)
+    return json_response({
+        'uploads': uploads,
+        'batches': batches,
+        'accounts': account_pool.snapshot(),
+        'prehash': prehasher.snapshot() if prehasher else None,
+        'devices': io_scheduler.snapshot(),
+    })
 
 
 @app.route('/api/history/check', methods=['POST'])
@@ -1352,10 +1970,21 @@ def api_history_check():
             mtime = os.path.getmtime(real)
         except OSError:
             continue
-        if _history_any_uploaded(real, size, mtime):
+        if history.any_uploaded(real, size, mtime):
             uploaded.append(p)
     return json_response({'uploaded': uploaded})
 
 
+@app.route('/api/history/relink', methods=['POST'])
+@login_required
+def api_history_relink():
+    try:
+        result = history.relink(os.path.abspath(BROWSE_FOLDER))
+    except sqlite3.Error as e:
+        return json_response({'success': False, 'message': 'History DB error: ' + str(e)}, 500)
+    return json_response(dict(result, success=True))
+
+
 if __name__ == '__main__':
+    start_background()
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+On-the-fly stored (uncompressed) TAR / ZIP streams over a list of files.
+The exact archive size is known up front from the file list, so the archive
+can go straight into the multipart body with a correct Content-Length and
+nothing is written to disk. ArchiveReader is a plain readable (readinto), so
+the regular send loop and read-ahead work on it unchanged.
+"""
+import struct
+import tarfile
+import time
+import zlib
+
+TAR_BLOCK = 512
+TAR_RECORD = tarfile.RECORDSIZE  # GNU tar / tarfile pad the archive to whole records
+ZIP_MAX = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+ZIP_FLAGS = 0x0008 | 0x0800  # sizes/CRC in data descriptor, UTF-8 names
+FORMATS = ("tar", "zip")
+
+
+class ArchiveEntry:
+    __slots__ = ("path", "arcname", "size", "mtime", "crc")
+
+    def __init__(self, path, arcname, size, mtime):
+        self.path = path
+        self.arcname = arcname.replace("\\", "/")
+        self.size = size
+        self.mtime = mtime
+        self.crc = 0
+
+
+class ArchiveReader:
+    """
+    Sequential reader over a list of segments: bytes, or entries whose content is
+    read from disk. A file that shrank since it was listed is zero-padded (and
+    one that grew is cut) so the stream never deviates from self.size; such
+    files are listed in self.changed.
+    """
+
+    def __init__(self, entries, opener=None):
+        self.entries = entries
+        self.opener = opener or (lambda path: open(path, "rb"))
+        self.changed = []
+        self.size = sum(self._segment_size(seg) for seg in self._layout())
+        self._segments = self._segments_iter()
+        self._cur = None
+        self._fh = None
+        self._left = 0
+
+    def _layout(self):
+        raise NotImplementedError
+
+    def _segments_iter(self):
+        for seg in self._layout():
+            yield seg() if callable(seg) else seg
+
+    @staticmethod
+    def _segment_size(seg):
+        if isinstance(seg, ArchiveEntry):
+            return seg.size
+        if callable(seg):
+            return seg.size
+        return len(seg)
+
+    def readinto(self, buf):
+        mv = memoryview(buf)
+        total = 0
+        while total < len(mv):
+            if self._cur is None:
+                self._cur = next(self._segments, None)
+                if self._cur is None:
+                    break
+                if isinstance(self._cur, ArchiveEntry):
+                    self._left = self._cur.size
+                    self._open_entry()
+                else:
+                    self._cur = memoryview(self._cur)
+            if isinstance(self._cur, ArchiveEntry):
+                n = self._read_entry(mv[total:])
+            else:
+                n = min(len(self._cur), len(mv) - total)
+                mv[total:total + n] = self._cur[:n]
+                self._cur = self._cur[n:]
+                if not len(self._cur):
+                    self._cur = None
+            total += n
+        return total
+
+    def _open_entry(self):
+        self._cur.crc = 0
+        try:
+            self._fh = self.opener(self._cur.path)
+        except OSError:
+            self._fh = None
+            self.changed.append(self._cur.path)
+
+    def _read_entry(self, out):
+        entry = self._cur
+        want = min(self._left, len(out))
+        n = 0
+        if self._fh is not None and want:
+            n = self._fh.readinto(out[:want]) or 0
+            if n < want:
+                self.changed.append(entry.path)
+                self._fh.close()
+                self._fh = None
+        if n < want:
+            out[n:want] = bytes(want - n)
+            n = want
+        entry.crc = zlib.crc32(out[:n], entry.crc)
+        self._left -= n
+        if not self._left:
+            if self._fh is not None:
+                if self._fh.read(1):
+                    self.changed.append(entry.path)
+                self._fh.close()
+                self._fh = None
+            self._cur = None
+        return n
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+class TarStream(ArchiveReader):
+    """POSIX (pax) tar; long or non-ASCII names get pax headers, sizes are exact."""
+
+    def _layout(self):
+        total = 0
+        for e in self.entries:
+            info = tarfile.TarInfo(e.arcname)
+            info.size = e.size
+            info.mtime = int(e.mtime)
+            info.mode = 0o644
+            header = info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+            pad = -e.size % TAR_BLOCK
+            yield header
+            yield e
+            if pad:
+                yield bytes(pad)
+            total += len(header) + e.size + pad
+        total += 2 * TAR_BLOCK
+        yield bytes(2 * TAR_BLOCK + (-total % TAR_RECORD))
+
+
+class ZipStream(ArchiveReader):
+    """
+    Stored ZIP with data descriptors, so CRCs are computed while streaming and
+    each file is read once. No ZIP64: archives must stay under 4 GiB and 65535
+    entries (use tar beyond that).
+    """
+
+    def __init__(self, entries, opener=None):
+        self._offsets = []
+        super().__init__(entries, opener)
+        if self.size > ZIP_MAX or len(entries) > ZIP_MAX_ENTRIES:
+            raise _needs_zip64()
+
+    @staticmethod
+    def _dos_time(mtime):
+        t = time.localtime(mtime)
+        if t.tm_year < 1980:
+            return 0, (1 << 5) | 1
+        return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+                ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+    def _layout(self):
+        self._offsets = []
+        offset = 0
+        for e in self.entries:
+            name = e.arcname.encode("utf-8")
+            dtime, ddate = self._dos_time(e.mtime)
+            local = struct.pack("<4s5H3L2H", b"PK\x03\x04", 20, ZIP_FLAGS, 0, dtime, ddate,
+                                0, 0, 0, len(name), 0) + name
+            self._offsets.append(offset)
+            yield local
+            yield e
+            yield _Deferred(16, lambda e=e: struct.pack("<4s3L", b"PK\x07\x08", e.crc, e.size, e.size))
+            offset += len(local) + e.size + 16
+        cd_size = sum(46 + len(e.arcname.encode("utf-8")) for e in self.entries)
+        if offset > ZIP_MAX or len(self.entries) > ZIP_MAX_ENTRIES:
+            raise _needs_zip64()  # the end record below couldn't even be packed
+        yield _Deferred(cd_size, self._central_directory)
+        yield struct.pack("<4s4H2LH", b"PK\x05\x06", 0, 0, len(self.entries), len(self.entries),
+                          cd_size, offset, 0)
+
+    def _central_directory(self):
+        out = []
+        for e, off in zip(self.entries, self._offsets):
+            name = e.arcname.encode("utf-8")
+            dtime, ddate = self._dos_time(e.mtime)
+            out.append(struct.pack("<4s6H3L5H2L", b"PK\x01\x02", 20, 20, ZIP_FLAGS, 0, dtime, ddate,
+                                   e.crc, e.size, e.size, len(name), 0, 0, 0, 0, 0o100644 << 16, off))
+            out.append(name)
+        return b"".join(out)
+
+
+def _needs_zip64():
+    return ValueError("ZIP archive would need ZIP64 (over 4 GiB or 65535 files); use tar")
+
+
+class _Deferred:
+    """Segment of known size whose bytes depend on data streamed before it (CRCs)."""
+
+    def __init__(self, size, build):
+        self.size = size
+        self._build = build
+
+    def __call__(self):
+        data = self._build()
+        assert len(data) == self.size
+        return data
+
+
+def open_archive(fmt, entries, opener=None):
+    """TarStream / ZipStream over entries; opener(path) replaces open(path, "rb")."""
+    if fmt == "tar":
+        return TarStream(entries, opener)
+    if fmt == "zip":
+        return ZipStream(entries, opener)
+    raise ValueError("Unknown archive format: " + str(fmt))
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for Chomikuj: the ChomikBoxService.svc SOAP actions chomik.py
+uses (Auth, Folders, AddFolder, UploadToken) plus the raw multipart upload
+endpoint, with optional latency, bandwidth cap and failure injection.
+
+Standalone (then start the app against it):
+
+    python benchmarks/fake_chomik.py --port 8480 --latency 20 --bandwidth 20M
+    CHOMIK_BOX_URL=http://127.0.0.1:8480/services/ChomikBoxService.svc python app.py
+
+In-process, for benchmarks and ad-hoc tests:
+
+    server = FakeChomik(bandwidth="50M").start()
+    chomik.CHOMIK_BOX_URL = server.box_url
+    ...
+    server.uploads  # [{"user", "path", "filename", "size", "sha256"}, ...]
+    server.stop()
+
+Any username/password logs in unless accounts={"user": "password"} is given.
+"""
+import argparse
+import hashlib
+import html
+import http.server
+import os
+import random
+import socketserver
+import sys
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from throttle import TokenBucket  # noqa: E402
+
+SERVICE_PATH = "/services/ChomikBoxService.svc"
+_ENVELOPE = ('<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"><s:Body>'
+             '<{0}Response xmlns="http://chomikuj.pl/"><{0}Result xmlns:a="http://chomikuj.pl">'
+             '{1}</{0}Result></{0}Response></s:Body></s:Envelope>')
+RECV_SIZE = 256 * 1024
+
+
+def _localname(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _fields(body):
+    """Leaf elements of a SOAP request as {localname: text}; the first one wins (Auth/name vs client/name)."""
+    fields = {}
+    for el in ET.fromstring(body).iter():
+        if len(el) == 0:
+            fields.setdefault(_localname(el.tag), el.text or "")
+    return fields
+
+
+def _esc(value):
+    return html.escape(str(value), quote=False)
+
+
+class FakeChomik:
+
+    def __init__(self, host="127.0.0.1", port=0, upload_port=0, latency=0.0, bandwidth=0,
+                 soap_fail_rate=0.0, upload_fail_rate=0.0, upload_fail_mode="drop",
+                 accounts=None, digest=True, seed=None):
+        self.host = host
+        self.latency = latency
+        self.limiter = TokenBucket(bandwidth)
+        self.soap_fail_rate = soap_fail_rate
+        self.upload_fail_rate = upload_fail_rate
+        self.upload_fail_mode = upload_fail_mode
+        self.accounts = accounts
+        self.digest = digest
+        self.uploads = []
+        self.calls = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._users = {}    # username -> hamster id
+        self._tokens = {}   # session token -> hamster id
+        self._folders = {}  # hamster id -> {folder id: {"name", "parent", "children"}}
+        self._keys = {}     # upload key -> (hamster id, folder id)
+        self._next_id = 1
+        self._soap = _SoapServer((host, port), _SoapHandler, self)
+        self._upload = _UploadServer((host, upload_port), _UploadHandler, self)
+        self._threads = []
+
+    @property
+    def box_url(self):
+        return "http://%s:%d%s" % (self.host, self._soap.server_address[1], SERVICE_PATH)
+
+    @property
+    def upload_address(self):
+        return "%s:%d" % (self.host, self._upload.server_address[1])
+
+    def start(self):
+        for srv in (self._soap, self._upload):
+            t = threading.Thread(target=srv.serve_forever, daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self):
+        for srv in (self._soap, self._upload):
+            srv.shutdown()
+            srv.server_close()
+
+    def fail(self, rate):
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def path_of(self, hamster_id, folder_id):
+        parts = []
+        folders = self._folders.get(hamster_id, {})
+        while folder_id != "0" and folder_id in folders:
+            parts.append(folders[folder_id]["name"])
+            folder_id = folders[folder_id]["parent"]
+        return "/" + "/".join(reversed(parts))
+
+    # SOAP actions: fields -> (response body inside <XResult>, http status)
+
+    def soap(self, action, fields):
+        with self._lock:
+            self.calls[action] = self.calls.get(action, 0) + 1
+        handler = getattr(self, "_soap_" + action, None)
+        if handler is None:
+            return None
+        return _ENVELOPE.format(action, handler(fields))
+
+    def _session(self, fields):
+        with self._lock:
+            return self._tokens.get(fields.get("token", ""))
+
+    def _soap_Auth(self, fields):
+        name = fields.get("name", "")
+        if self.accounts is not None:
+            password = self.accounts.get(name)
+            expected = hashlib.md5(password.encode("utf-8")).hexdigest() if password is not None else None
+            if expected != fields.get("passHash", "").lower():
+                return "<a:status>NotLoggedIn</a:status><a:hamsterId>-1</a:hamsterId><a:token>-1</a:token>"
+        with self._lock:
+            hid = self._users.get(name)
+            if hid is None:
+                hid = self._users[name] = str(self._next_id)
+                self._next_id += 1
+                self._folders[hid] = {"0": {"name": "", "parent": None, "children": []}}
+            token = uuid.uuid4().hex
+            self._tokens[token] = hid
+        return ("<a:status>Ok</a:status><a:hamsterId>%s</a:hamsterId><a:name>%s</a:name>"
+                "<a:token>%s</a:token>" % (hid, _esc(name), token))
+
+    def _soap_Folders(self, fields):
+        hid = self._session(fields)
+        fid = fields.get("folderId", "0")
+        with self._lock:
+            folders = self._folders.get(hid, {})
+            if fid not in folders:
+                return "<a:status>Error</a:status>"
+            children = "".join(
+                "<a:FolderInfo><a:id>%s</a:id><a:name>%s</a:name></a:FolderInfo>"
+                % (cid, _esc(folders[cid]["name"]))
+                for cid in folders[fid]["children"]
+            )
+            return ("<a:status>Ok</a:status><a:folder><a:id>%s</a:id><a:name>%s</a:name>"
+                    "<a:folders>%s</a:folders></a:folder>" % (fid, _esc(folders[fid]["name"]), children))
+
+    def _soap_AddFolder(self, fields):
+        hid = self._session(fields)
+        parent = fields.get("newFolderId", "0")
+        name = fields.get("name", "")
+        with self._lock:
+            folders = self._folders.get(hid, {})
+            if parent not in folders or not name:
+                return "<status>Error</status><errorMessage>InvalidFolder</errorMessage>"
+            if any(folders[c]["name"] == name for c in folders[parent]["children"]):
+                return "<status>Error</status><errorMessage>NameExistsAtDestination</errorMessage>"
+            fid = str(self._next_id)
+            self._next_id += 1
+            folders[fid] = {"name": name, "parent": parent, "children": []}
+            folders[parent]["children"].append(fid)
+        return "<status>Ok</status>"
+
+    def _soap_UploadToken(self, fields):
+        hid = self._session(fields)
+        fid = fields.get("folderId", "0")
+        with self._lock:
+            if fid not in self._folders.get(hid, {}):
+                return "<a:status>Error</a:status><a:errorMessage>InvalidFolder</a:errorMessage>"
+            key = uuid.uuid4().hex
+            self._keys[key] = (hid, fid)
+        return ("<a:status>Ok</a:status><a:key>%s</a:key><a:stamp>%d</a:stamp><a:server>%s</a:server>"
+                % (key, int(time.time() * 1000), self.upload_address))
+
+    def record_upload(self, key, folder_id, filename, size, sha256):
+        with self._lock:
+            hid, fid = self._keys.pop(key, (None, None))
+            if hid is None or fid != folder_id:
+                return False
+            user = next(u for u, h in self._users.items() if h == hid)
+            self.uploads.append({"user": user, "path": self.path_of(hid, fid),
+                                 "filename": filename, "size": size, "sha256": sha256})
+        return True
+
+
+class _SoapServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, fake):
+        self.fake = fake
+        super().__init__(address, handler)
+
+
+class _SoapHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        fake = self.server.fake
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if fake.latency:
+            time.sleep(fake.latency)
+        if self.path.split("?")[0] != SERVICE_PATH:
+            return self._reply(404, b"")
+        if fake.fail(fake.soap_fail_rate):
+            return self._reply(503, b"Service Unavailable")
+        action = (self.headers.get("SOAPAction") or "").strip('"').rsplit("/", 1)[-1]
+        try:
+            resp = fake.soap(action, _fields(body))
+        except ET.ParseError:
+            resp = None
+        if resp is None:
+            return self._reply(500, b"")
+        self._reply(200, resp.encode("utf-8"))
+
+    def _reply(self, status, data):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _UploadServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, handler, fake):
+        self.fake = fake
+        super().__init__(address, handler)
+
+
+class _UploadHandler(socketserver.BaseRequestHandler):
+    """POST /file/ as built by ChomikUploader._build_upload_header, read as a stream."""
+
+    def handle(self):
+        fake = self.server.fake
+        sock = self.request
+        buf = bytearray(RECV_SIZE)
+        data = b""
+        while b"\r\n\r\n" not in data:
+            n = sock.recv_into(buf)
+            if not n:
+                return
+            data += bytes(buf[:n])
+        head, data = data.split(b"\r\n\r\n", 1)
+        headers = dict(
+            line.split(b":", 1) for line in head.split(b"\r\n")[1:] if b":" in line
+        )
+        length = int(headers.get(b"Content-Length", b"0").strip())
+        boundary = b"--" + headers.get(b"Content-Type", b"").split(b"boundary=", 1)[-1].strip()
+
+        marker = b'name="file"; filename="'
+        while marker not in data or b"\r\n\r\n" not in data[data.find(marker):]:
+            n = sock.recv_into(buf)
+            if not n:
+                return
+            data += bytes(buf[:n])
+        cut = data.index(b"\r\n\r\n", data.index(marker)) + 4
+        form, data = data[:cut], data[cut:]
+        fields = {}
+        for part in form.split(boundary)[1:]:
+            name = part.split(b'name="', 1)[-1].split(b'"', 1)[0].decode("utf-8", "replace")
+            fields[name] = part.split(b"\r\n\r\n", 1)[-1].rstrip(b"\r\n")
+        filename = form[form.index(marker) + len(marker):].split(b'"\r\n', 1)[0]
+        filename = filename.replace(b'\\"', b'"').replace(b"\\\\", b"\\").decode("utf-8", "replace")
+
+        tail = b"\r\n" + boundary + b"--\r\n\r\n"
+        size = length - len(form) - len(tail)
+        fail = fake.fail(fake.upload_fail_rate)
+        if fail and fake.upload_fail_mode == "drop":
+            size //= 2  # read half the body, then hang up
+
+        digest = hashlib.sha256() if fake.digest else None
+        received = 0
+        rest = b""
+        if data:
+            take = data[:max(0, size)]
+            rest = data[len(take):]
+            received = len(take)
+            if digest:
+                digest.update(take)
+            fake.limiter.consume(len(take))
+        while received < size:
+            n = sock.recv_into(buf, min(RECV_SIZE, size - received))
+            if not n:
+                return
+            fake.limiter.consume(n)
+            if digest:
+                digest.update(memoryview(buf)[:n])
+            received += n
+        if fail and fake.upload_fail_mode == "drop":
+            return
+
+        while len(rest) < len(tail):
+            chunk = sock.recv(len(tail) - len(rest))
+            if not chunk:
+                return
+            rest += chunk
+        if fake.latency:
+            time.sleep(fake.latency)
+        ok = rest == tail and not fail and fake.record_upload(
+            fields.get("key", b"").decode(), fields.get("folder_id", b"").decode(), filename, size,
+            digest.hexdigest() if digest else None,
+        )
+        body = b'<?xml version="1.0" encoding="UTF-8"?><resp res="%d"/>' % (1 if ok else 0)
+        sock.sendall(b"HTTP/1.0 200 OK\r\nContent-Type: text/xml\r\nContent-Length: %d\r\n\r\n%s"
+                     % (len(body), body))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8480, help="SOAP port (default 8480)")
+    ap.add_argument("--upload-port", type=int, default=0, help="upload port (default: any free)")
+    ap.add_argument("--latency", type=float, default=0, help="added per request, in ms")
+    ap.add_argument("--bandwidth", default="", help="upload cap shared by all connections, e.g. 20M")
+    ap.add_argument("--soap-fail-rate", type=float, default=0, help="share of SOAP calls answered 503")
+    ap.add_argument("--upload-fail-rate", type=float, default=0, help="share of uploads that fail")
+    ap.add_argument("--upload-fail-mode", choices=("drop", "reject"), default="drop",
+                    help="drop the connection halfway, or answer res=0 after the full body")
+    ap.add_argument("--account", action="append", default=[], metavar="USER:PASSWORD",
+                    help="only accept these logins (repeatable; default: any)")
+    ap.add_argument("--quiet", action="store_true", help="don't print every received file")
+    ap.add_argument("--no-digest", action="store_true", help="don't sha256 received files (saves CPU)")
+    args = ap.parse_args(argv)
+
+    accounts = dict(a.split(":", 1) for a in args.account) or None
+    server = FakeChomik(
+        args.host, args.port, args.upload_port, latency=args.latency / 1000.0,
+        bandwidth=args.bandwidth, soap_fail_rate=args.soap_fail_rate,
+        upload_fail_rate=args.upload_fail_rate, upload_fail_mode=args.upload_fail_mode,
+        accounts=accounts, digest=not args.no_digest,
+    ).start()
+    print("CHOMIK_BOX_URL=" + server.box_url, flush=True)
+    print("uploads go to " + server.upload_address, flush=True)
+    try:
+        seen = 0
+        while True:
+            time.sleep(0.5)
+            for up in server.uploads[seen:]:
+                if not args.quiet:
+                    print("%s %s/%s %d bytes" % (up["user"], up["path"].rstrip("/"), up["filename"], up["size"]))
+            seen = len(server.uploads)
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
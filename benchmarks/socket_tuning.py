@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Send-loop benchmark: default socket + fixed 64 KB chunks vs the tuned transport
+(SO_SNDBUF/TCP_NOTSENT_LOWAT + adaptive chunk size) used by upload_file.
+
+Data goes to a local sink over loopback. With --rtt the loopback interface gets
+a netem delay for the duration of the run (needs root / CAP_NET_ADMIN), which
+emulates a high-latency path to the upload server:
+
+    sudo python benchmarks/socket_tuning.py --rtt 80 --size 256
+"""
+import argparse
+import io
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import chomik  # noqa: E402
+from chomik import ChomikUploader  # noqa: E402
+
+
+def _sink(server_sock):
+    buf = bytearray(1024 * 1024)
+    while True:
+        try:
+            conn, _ = server_sock.accept()
+        except OSError:
+            return
+        with conn:
+            while conn.recv_into(buf):
+                pass
+
+
+def _netem(rtt_ms, rate=None):
+    # lo carries both directions, so each side gets half the round trip.
+    cmd = ["tc", "qdisc", "add", "dev", "lo", "root", "netem", "delay", "%.1fms" % (rtt_ms / 2.0)]
+    if rate:
+        cmd += ["rate", rate]
+    subprocess.check_call(cmd)
+
+
+def _netem_clear():
+    subprocess.call(["tc", "qdisc", "del", "dev", "lo", "root"], stderr=subprocess.DEVNULL)
+
+
+def _run(port, payload, tuned):
+    if tuned:
+        sock, transport = ChomikUploader._open_upload_socket()
+        max_chunk = chomik.MAX_CHUNK_SIZE
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(chomik.UPLOAD_SOCK_TIMEOUT)
+        transport = {"sndbuf": sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+                     "notsent_lowat": None}
+        max_chunk = chomik.DEFAULT_CHUNK_SIZE
+    t0 = time.monotonic()
+    with sock:
+        sock.connect(("127.0.0.1", port))
+        transport["chunk_size"] = ChomikUploader._send_payload(
+            sock, io.BytesIO(payload), len(payload),
+            chunk_size=chomik.DEFAULT_CHUNK_SIZE, max_chunk_size=max_chunk,
+        )
+        sock.shutdown(socket.SHUT_WR)
+        sock.recv(1)  # sink closes once everything has been read
+    return time.monotonic() - t0, transport
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--size", type=int, default=128, help="payload size in MB (default 128)")
+    ap.add_argument("--rtt", type=float, default=0, help="emulated round-trip time in ms (tc netem on lo)")
+    ap.add_argument("--rate", default=None, help="emulated bottleneck for netem, e.g. 500mbit")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args(argv)
+
+    payload = os.urandom(1024 * 1024) * args.size
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024 * 1024)
+    server.bind(("127.0.0.1", 0))
+    server.listen(4)
+    threading.Thread(target=_sink, args=(server,), daemon=True).start()
+    port = server.getsockname()[1]
+
+    if args.rtt:
+        try:
+            _netem(args.rtt, args.rate)
+        except (OSError, subprocess.CalledProcessError):
+            server.close()
+            print("cannot apply netem on lo (needs root and the sch_netem kernel module)", file=sys.stderr)
+            return 2
+    try:
+        print("payload %d MB, rtt %s ms" % (args.size, args.rtt or "loopback"))
+        for tuned in (False, True):
+            best = None
+            for _ in range(args.repeat):
+                elapsed, transport = _run(port, payload, tuned)
+                best = elapsed if best is None else min(best, elapsed)
+            print("%-8s %8.1f MB/s  %s" % (
+                "tuned" if tuned else "default", args.size / best, transport))
+    finally:
+        if args.rtt:
+            _netem_clear()
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+End-to-end upload benchmarks against the local fake server (fake_chomik.py).
+
+Scenarios (what drives the upload):
+  uploader  - ChomikUploader.upload_file, one file after another
+  batch     - app._run_batch_upload over the dataset folder (dedupe, hashing, workers)
+  api       - POST /api/upload/folder through the Flask test client, polled to the end
+
+Datasets (generated once under --data-dir and reused):
+  big       - one large file (sparse, default 10 GiB)
+  small     - 10,000 files of 1 KB in 100 folders
+  mixed     - 500 files from 1 KB to 16 MB, log-distributed, in a nested tree
+
+Each scenario/dataset pair runs in a fresh child process so CPU time and peak
+RSS belong to that run alone; the fake server runs in its own process too.
+Results (MB/s, files/s, CPU seconds per GB, peak RSS) go to
+benchmarks/results/<commit>-<time>.json; --compare prints the change against
+an earlier result file:
+
+    python benchmarks/throughput.py --quick
+    python benchmarks/throughput.py --scenario batch --dataset small --compare benchmarks/results/abc1234-....json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, ROOT)
+
+SCENARIOS = ("uploader", "batch", "api")
+DATASETS = ("big", "small", "mixed")
+GB = 1024 ** 3
+
+
+def _write(path, size, rng):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        block = rng.randbytes(min(size, 1024 * 1024))
+        left = size
+        while left > 0:
+            f.write(block[:left])
+            left -= len(block)
+
+
+def make_dataset(data_dir, name, big_size, small_count):
+    """Create data_dir/name unless a previous run left a matching one."""
+    path = os.path.join(data_dir, name)
+    spec = {"big": big_size, "small": small_count, "mixed": 500}[name]
+    marker = os.path.join(data_dir, "." + name + ".json")
+    try:
+        with open(marker) as f:
+            if json.load(f) == spec:
+                return path
+    except (OSError, ValueError):
+        pass
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    rng = random.Random(42)
+    if name == "big":
+        # Sparse: reads come from the page cache, so the disk doesn't cap the upload.
+        with open(os.path.join(path, "big.bin"), "wb") as f:
+            f.truncate(big_size)
+    elif name == "small":
+        for i in range(small_count):
+            _write(os.path.join(path, "d%02d" % (i % 100), "f%05d.txt" % i), 1024, rng)
+    else:
+        for i in range(500):
+            depth = rng.randint(0, 3)
+            dirs = ["l%d_%d" % (d, rng.randint(0, 3)) for d in range(depth)]
+            size = int(2 ** rng.uniform(10, 24))
+            _write(os.path.join(path, *dirs, "m%03d.bin" % i), size, rng)
+    with open(marker, "w") as f:
+        json.dump(spec, f)
+    return path
+
+
+def _dataset_files(path):
+    out = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for fname in sorted(filenames):
+            fpath = os.path.join(dirpath, fname)
+            out.append((fpath, os.path.relpath(dirpath, path), os.path.getsize(fpath)))
+    return out
+
+
+# Child side: one scenario on one dataset, prints a JSON result.
+
+def _run_uploader(data_dir, dataset):
+    from chomik import ChomikUploader
+
+    up = ChomikUploader("bench", "bench")
+    if not up.login():
+        raise RuntimeError("login to fake server failed")
+    files = nbytes = errors = 0
+    for fpath, rel_dir, size in _dataset_files(os.path.join(data_dir, dataset)):
+        dest = "/bench/uploader/" + dataset + ("" if rel_dir == "." else "/" + rel_dir)
+        ok, _ = up.upload_file(fpath, dest)
+        files += 1
+        nbytes += size
+        errors += not ok
+    return files, nbytes, errors
+
+
+def _run_batch(data_dir, dataset):
+    import app
+
+    app.start_background()  # progress sampling feeds the batch's AdaptiveConcurrency
+    app.BROWSE_FOLDER = data_dir
+    all_files = app.order_files(app.get_files_recursive(dataset), app.UPLOAD_ORDER)
+    files_info = []
+    with app.upload_lock:
+        app.batch_status["bench"] = {"folder": dataset, "files": len(all_files), "concurrency": 0,
+                                     "throughput": 0, "started_at": time.time(), "finished_at": None}
+        for i, fi in enumerate(all_files):
+            uid = "bench-%d" % i
+            app.upload_status[uid] = {"status": "queued", "bytes_sent": 0, "total_bytes": fi["size"],
+                                      "filename": fi["relative_path"], "message": "Queued",
+                                      "started_at": time.time(), "finished_at": None, "batch_id": "bench"}
+            files_info.append({"upload_id": uid, "full_path": fi["full_path"],
+                               "filename": fi["filename"], "relative_dir": fi["relative_dir"]})
+    app._run_batch_upload(files_info, "/bench/batch/" + dataset, False, 0, "bench", app.UPLOAD_SPLIT_SIZE)
+    with app.upload_lock:
+        errors = sum(1 for fi in files_info if app.upload_status[fi["upload_id"]]["status"] != "success")
+    return len(all_files), sum(fi["size"] for fi in all_files), errors
+
+
+def _run_api(data_dir, dataset):
+    import app
+
+    app.start_background()  # progress sampling feeds the batch's AdaptiveConcurrency
+    app.BROWSE_FOLDER = data_dir
+    client = app.app.test_client()
+    with client.session_transaction() as s:
+        s["logged_in"] = True
+    resp = client.post("/api/upload/folder", json={"folder_path": dataset, "confirmed": True})
+    body = resp.get_json()
+    if resp.status_code != 202:
+        raise RuntimeError("upload/folder failed: %s" % body)
+    ids = {u["upload_id"] for u in body["uploads"]}
+    nbytes = sum(u["total_bytes"] for u in body["uploads"])
+    while True:
+        time.sleep(0.2)
+        active = client.get("/api/uploads/active").get_json()
+        batch = next((b for b in active["batches"] if b["batch_id"] == body["batch_id"]), None)
+        if batch is None or batch.get("finished_at"):
+            break
+    errors = sum(1 for u in active["uploads"] if u["upload_id"] in ids and u["status"] != "success")
+    return len(ids), nbytes, errors
+
+
+def child(scenario, data_dir, dataset):
+    fn = {"uploader": _run_uploader, "batch": _run_batch, "api": _run_api}[scenario]
+    ru0 = resource.getrusage(resource.RUSAGE_SELF)
+    t0 = time.monotonic()
+    files, nbytes, errors = fn(data_dir, dataset)
+    elapsed = time.monotonic() - t0
+    ru1 = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (ru1.ru_utime - ru0.ru_utime) + (ru1.ru_stime - ru0.ru_stime)
+    peak_kb = ru1.ru_maxrss if sys.platform.startswith("linux") else ru1.ru_maxrss // 1024
+    return {
+        "scenario": scenario,
+        "dataset": dataset,
+        "files": files,
+        "bytes": nbytes,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "mb_per_s": round(nbytes / 1048576.0 / elapsed, 2) if elapsed else None,
+        "files_per_s": round(files / elapsed, 1) if elapsed else None,
+        "cpu_seconds": round(cpu, 3),
+        "cpu_s_per_gb": round(cpu / (nbytes / GB), 2) if nbytes else None,
+        "peak_rss_mb": round(peak_kb / 1024.0, 1),
+    }
+
+
+# Parent side.
+
+def _start_server(args):
+    cmd = [sys.executable, os.path.join(HERE, "fake_chomik.py"), "--port", "0", "--quiet", "--no-digest",
+           "--latency", str(args.latency)]
+    if args.bandwidth:
+        cmd += ["--bandwidth", args.bandwidth]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline().strip()
+    if not line.startswith("CHOMIK_BOX_URL="):
+        proc.kill()
+        raise RuntimeError("fake server did not start")
+    return proc, line.split("=", 1)[1]
+
+
+def _git(*cmd):
+    try:
+        return subprocess.check_output(["git", "-C", ROOT] + list(cmd), stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _compare(results, path):
+    with open(path) as f:
+        old = {(r["scenario"], r["dataset"]): r for r in json.load(f)["results"]}
+    print("\nvs %s" % path)
+    for r in results:
+        o = old.get((r["scenario"], r["dataset"]))
+        if not o:
+            continue
+        parts = []
+        for key in ("mb_per_s", "files_per_s", "cpu_s_per_gb", "peak_rss_mb"):
+            if r.get(key) and o.get(key):
+                parts.append("%s %+.1f%%" % (key, (r[key] / o[key] - 1) * 100))
+        print("%-9s %-6s %s" % (r["scenario"], r["dataset"], "  ".join(parts)))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scenario", default=",".join(SCENARIOS), help="comma-separated, default all")
+    ap.add_argument("--dataset", default=",".join(DATASETS), help="comma-separated, default all")
+    ap.add_argument("--quick", action="store_true", help="1 GiB big file and 1,000 small files")
+    ap.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "chomik-bench"))
+    ap.add_argument("--latency", type=float, default=0, help="fake server latency per request, ms")
+    ap.add_argument("--bandwidth", default="", help="fake server receive cap, e.g. 100M")
+    ap.add_argument("--out", default=os.path.join(HERE, "results"))
+    ap.add_argument("--compare", help="earlier result file to compare against")
+    ap.add_argument("--child", nargs=3, metavar=("SCENARIO", "DATA_DIR", "DATASET"), help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(child(*args.child)))
+        return 0
+
+    scenarios = [s for s in args.scenario.split(",") if s]
+    datasets = [d for d in args.dataset.split(",") if d]
+    for s in scenarios:
+        if s not in SCENARIOS:
+            ap.error("unknown scenario: " + s)
+    for d in datasets:
+        if d not in DATASETS:
+            ap.error("unknown dataset: " + d)
+    big_size = GB if args.quick else 10 * GB
+    small_count = 1000 if args.quick else 10000
+    os.makedirs(args.data_dir, exist_ok=True)
+    for d in datasets:
+        make_dataset(args.data_dir, d, big_size, small_count)
+
+    proc, box_url = _start_server(args)
+    results = []
+    try:
+        for scenario in scenarios:
+            for dataset in datasets:
+                with tempfile.TemporaryDirectory() as tmp:
+                    env = dict(os.environ, CHOMIK_BOX_URL=box_url, CHOMIK_USERNAME="bench",
+                               CHOMIK_PASSWORD="bench", UPLOAD_HISTORY_DB=os.path.join(tmp, "history.db"),
+                               PREHASH_ENABLED="", CHOMIK_ACCOUNTS="")
+                    out = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), "--child", scenario, args.data_dir, dataset],
+                        env=env, stdout=subprocess.PIPE, text=True,
+                    )
+                if out.returncode:
+                    print("%-9s %-6s failed (exit %d)" % (scenario, dataset, out.returncode))
+                    continue
+                r = json.loads(out.stdout.strip().splitlines()[-1])
+                results.append(r)
+                print("%-9s %-6s %6d files %9.1f MB/s %8.1f files/s %6.2f CPU s/GB %7.1f MB RSS%s" % (
+                    scenario, dataset, r["files"], r["mb_per_s"] or 0, r["files_per_s"] or 0,
+                    r["cpu_s_per_gb"] or 0, r["peak_rss_mb"],
+                    "  (%d errors)" % r["errors"] if r["errors"] else ""))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    commit = _git("rev-parse", "--short", "HEAD") or "unknown"
+    dirty = bool(_git("status", "--porcelain", "--untracked-files=no"))
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, "%s%s-%s.json" % (commit, "-dirty" if dirty else "",
+                                                      time.strftime("%Y%m%d-%H%M%S")))
+    with open(path, "w") as f:
+        json.dump({
+            "commit": commit,
+            "dirty": dirty,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "options": {"quick": args.quick, "latency_ms": args.latency, "bandwidth": args.bandwidth},
+            "results": results,
+        }, f, indent=2)
+    print("saved " + path)
+    if args.compare:
+        _compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,19 +8,179 @@ Reverse-engineered ChomikBox protocol; verified live 2026-05.
 import hashlib
 import os
 import re
+import struct
+import sys
 import time
 import html
 import socket
+import threading
 import requests
 import warnings
 import xml.etree.ElementTree as ET
 
+try:
+    import fcntl
+    import termios
+except ImportError:  # not a Unix
+    fcntl = termios = None
+
+from metrics import SOAP_DURATION, SOAP_REQUESTS, UPLOAD_BYTES
+from readahead import ReadAheadReader
+from retry import RetryPolicy
+
 warnings.filterwarnings("ignore", category=UserWarning, module="urllib3")
 
-CHOMIK_BOX_URL = "https://box.chomikuj.pl/services/ChomikBoxService.svc"
+# Overridable for a local stand-in (benchmarks/fake_chomik.py).
+CHOMIK_BOX_URL = os.environ.get("CHOMIK_BOX_URL", "https://box.chomikuj.pl/services/ChomikBoxService.svc")
 CLIENT_VERSION = "2.0.8.2"
-UPLOAD_SOCK_TIMEOUT = 300  # per-recv/send timeout; big files take many of these
+UPLOAD_SOCK_TIMEOUT = int(os.environ.get("CHOMIK_UPLOAD_TIMEOUT", "300"))  # per-recv/send; big files take many
 DEFAULT_CHUNK_SIZE = 65536
+MAX_CHUNK_SIZE = 256 * 1024  # bigger chunks fall out of CPU cache and get slower
+# Chunks are sized to take roughly this long on the wire, so slow links keep small
+# chunks (smooth progress/throttling) and fast ones stop paying per-chunk overhead.
+# The wire rate is what left the send buffer (SIOCOUTQ), measured over at least this
+# long: sendall() itself returns as soon as the data is copied into the buffer.
+CHUNK_TARGET_SECONDS = 0.05
+# Linux autotunes the send buffer up to tcp_wmem[2] (4 MiB by default), which keeps a
+# high bandwidth-delay path full. An explicit SO_SNDBUF turns autotuning off and is
+# capped at net.core.wmem_max (~208 KiB stock), so it is off by default and only set
+# when wmem_max allows it. NOTSENT_LOWAT stops the kernel from queueing far more
+# unsent data than the path needs.
+UPLOAD_SNDBUF = int(os.environ.get("CHOMIK_UPLOAD_SNDBUF", "0"))
+UPLOAD_NOTSENT_LOWAT = int(os.environ.get("CHOMIK_UPLOAD_NOTSENT_LOWAT", str(512 * 1024)))
+SOAP_RETRY = RetryPolicy.from_env("CHOMIK_SOAP_RETRY", max_attempts=3, base_delay=0.5, max_delay=10)
+UPLOAD_RETRY = RetryPolicy.from_env("CHOMIK_UPLOAD_RETRY", max_attempts=4, base_delay=2, max_delay=120)
+MIN_VOLUME_SIZE = 1024 * 1024
+TCP_NOTSENT_LOWAT = getattr(socket, "TCP_NOTSENT_LOWAT", 25 if sys.platform.startswith("linux") else None)
+# SIOCOUTQ (same number as TIOCOUTQ on Linux): bytes in a socket's send queue, not yet acked.
+SIOCOUTQ = getattr(termios, "TIOCOUTQ", None) if sys.platform.startswith("linux") else None
+# Where an upload's time goes, summed over attempts (see upload_stream).
+PHASES = ("login", "chdir", "upload_token", "dns", "connect", "send", "ack")
+
+
+def _wmem_max():
+    try:
+        with open("/proc/sys/net/core/wmem_max") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+WMEM_MAX = _wmem_max()
+
+
+def _send_queue(sock):
+    """Bytes sock has queued but the peer hasn't acknowledged yet; None where unsupported."""
+    if SIOCOUTQ is None:
+        return None
+    try:
+        return struct.unpack("i", fcntl.ioctl(sock.fileno(), SIOCOUTQ, b"\0\0\0\0"))[0]
+    except (OSError, ValueError):
+        return None
+
+
+def _phase(timings, name, t0):
+    """Add the time since t0 to timings[name]; returns now, the start of the next phase."""
+    now = time.monotonic()
+    timings[name] = timings.get(name, 0.0) + (now - t0)
+    return now
+
+
+class _SizedSource:
+    """
+    Reader (readinto) over an upload_stream source that yields at most size
+    bytes; remaining > 0 after EOF means the source came up short.
+    """
+
+    def __init__(self, raw, size, owned=True):
+        self.raw = raw
+        self.remaining = size
+        self.owned = owned
+        self._readinto = getattr(raw, "readinto", None)
+
+    def readinto(self, buf):
+        n = min(len(buf), self.remaining)
+        if n <= 0:
+            return 0
+        mv = memoryview(buf)[:n]
+        if self._readinto is not None:
+            got = self._readinto(mv) or 0
+        else:
+            data = self.raw.read(n)
+            got = len(data)
+            mv[:got] = data
+        self.remaining -= got
+        return got
+
+    def fileno(self):
+        return self.raw.fileno()  # lets read-ahead pass fadvise hints to real files
+
+    def close(self):
+        if self.owned and hasattr(self.raw, "close"):
+            self.raw.close()
+
+
+class _BufferSource:
+    """readinto() over a bytes-like object without copying it first."""
+
+    def __init__(self, data):
+        self._mv = memoryview(data).cast("B")
+        self._pos = 0
+
+    def readinto(self, buf):
+        n = min(len(buf), len(self._mv) - self._pos)
+        buf[:n] = self._mv[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+class _ChunkSource:
+    """readinto() over an iterator of byte chunks (generators, pipes read in pieces)."""
+
+    def __init__(self, chunks):
+        self._it = iter(chunks)
+        self._pending = memoryview(b"")
+
+    def readinto(self, buf):
+        while not len(self._pending):
+            chunk = next(self._it, None)
+            if chunk is None:
+                return 0
+            self._pending = memoryview(chunk).cast("B")
+        n = min(len(buf), len(self._pending))
+        buf[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+def _open_binary(path):
+    return open(path, "rb")
+
+
+def _source_factory(source, size):
+    """
+    Normalise an upload_stream source into (open_fn, replayable). open_fn()
+    returns a fresh _SizedSource; replayable tells whether a retry can
+    start the data over.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return (lambda: _SizedSource(_BufferSource(source), size)), True
+    if callable(source):
+        return (lambda: _SizedSource(source(), size)), True
+    if hasattr(source, "readinto") or hasattr(source, "read"):
+        try:
+            start = source.tell() if source.seekable() else None
+        except (AttributeError, OSError):
+            start = None
+
+        def open_fn():
+            if start is not None:
+                source.seek(start)
+            return _SizedSource(source, size, owned=False)
+        return open_fn, start is not None
+    if hasattr(source, "__iter__"):
+        return (lambda: _SizedSource(_ChunkSource(source), size)), False
+    raise TypeError("Unsupported upload source: " + type(source).__name__)
 
 
 class ChomikUploader:
@@ -39,22 +199,41 @@ class ChomikUploader:
         self.folder_id = "0"
         self.folders_dom = None
         self.last_login = 0
+        self.last_transport = None
+        self.last_attempts = 0
+        self.last_volumes = []
+        self.last_timings = {}
+        self.soap_retry = SOAP_RETRY
 
     def _soap_post(self, soap_body, soap_action_suffix):
+        """POST a SOAP envelope; network errors and 5xx/429 are retried. "" on failure."""
         headers = {
             "SOAPAction": "http://chomikuj.pl/IChomikBoxService/" + soap_action_suffix,
             "Content-Type": "text/xml;charset=utf-8",
         }
-        try:
-            r = self.session.post(
-                CHOMIK_BOX_URL,
-                data=soap_body.encode("utf-8"),
-                headers=headers,
-                timeout=30,
-            )
-            return r.text
-        except Exception:
-            return ""
+        data = soap_body.encode("utf-8")
+
+        def attempt():
+            try:
+                r = self.session.post(
+                    CHOMIK_BOX_URL,
+                    data=data,
+                    headers=headers,
+                    timeout=30,
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                return True, "", "network"
+            except Exception:
+                return False, "", "network"
+            if r.status_code >= 400:
+                return r.status_code >= 500 or r.status_code == 429, r.text, "http_" + str(r.status_code)
+            return False, r.text, "ok"
+
+        t0 = time.monotonic()
+        (_, text, outcome), _ = self.soap_retry.call(attempt, lambda r: r[0])
+        SOAP_DURATION.observe(time.monotonic() - t0, action=soap_action_suffix)
+        SOAP_REQUESTS.inc(action=soap_action_suffix, outcome=outcome)
+        return text
 
     def login(self):
         if self.last_login and time.time() < self.last_login + 300:
@@ -227,6 +406,9 @@ class ChomikUploader:
             if not found:
                 if not self._add_folder(part_esc, current_id):
                     return False, None
+                if current_id == "0":
+                    # The root listing is cached from login; refresh it or the new folder is missed.
+                    self._get_dir_list(0)
                 children = self._fetch_children(current_id)
                 for f in children:
                     if self._unescape_name((f.get("name") or "").strip()) == part_clean:
@@ -280,25 +462,240 @@ class ChomikUploader:
             return True
         return False
 
-    def upload_file(self, local_path, dest_folder_path, filename=None,
-                    on_progress=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    def upload_file(self, local_path, dest_folder_path, filename=None, opener=None, **kwargs):
         """
-        Upload a file to Chomikuj with streaming + optional progress callback.
-
-        on_progress(sent_bytes, total_bytes) is called before the first chunk
-        with (0, total) and after every chunk. Total counts only the file
-        payload, not multipart framing.
+        Upload a local file to Chomikuj; see upload_stream for the keyword
+        arguments (progress, throttling, chunking, retries). opener(path)
+        replaces open(path, "rb"), e.g. to pace reads per device.
 
         Returns (True, None) on success or (False, error_message) on failure.
         """
         if not os.path.isfile(local_path):
             return False, "File not found"
         name = filename or os.path.basename(local_path)
-        name = self._filename_refinement(name)
+        opener = opener or _open_binary
+        return self.upload_stream(
+            lambda: opener(local_path), os.path.getsize(local_path), name,
+            dest_folder_path, **kwargs
+        )
+
+    def _clone(self):
+        """Uploader sharing this one's credentials and session token, for a parallel connection."""
+        other = ChomikUploader(self.username, "")
+        other.password_hash = self.password_hash
+        other.token = self.token
+        other.chomik_id = self.chomik_id
+        other.folders_dom = self.folders_dom
+        other.folder_id = self.folder_id
+        other.last_login = self.last_login
+        return other
+
+    @staticmethod
+    def volume_names(name, count):
+        width = max(3, len(str(count)))
+        return [name + "." + str(i + 1).zfill(width) for i in range(count)]
+
+    def upload_file_split(self, local_path, dest_folder_path, volume_size, filename=None,
+                          workers=4, on_progress=None, on_attempt=None, opener=None, **kwargs):
+        """
+        Upload local_path as volumes name.001, name.002, ... of volume_size bytes,
+        sent concurrently over up to `workers` connections. Each volume reads its
+        byte range straight from the source file; nothing is copied to disk.
+        opener is as for upload_file. Remaining keyword arguments go to
+        upload_stream for every volume.
+
+        on_progress(sent, total) reports the whole file; on_attempt(attempt,
+        error) fires for retries of any volume. Volume names are left in
+        self.last_volumes, the highest attempt count in self.last_attempts and
+        the volumes' phase timings, summed, in self.last_timings (on_timings
+        is called once with those).
+
+        Returns (True, None) when every volume was accepted, otherwise
+        (False, error_message) naming the failed volumes.
+        """
+        if not os.path.isfile(local_path):
+            return False, "File not found"
+        on_timings = kwargs.pop("on_timings", None)
+        opener = opener or _open_binary
+        started = time.monotonic()
+        volume_size = max(MIN_VOLUME_SIZE, int(volume_size))
+        size = os.path.getsize(local_path)
+        count = max(1, -(-size // volume_size))
+        name = self._filename_refinement(filename or os.path.basename(local_path))
+        names = self.volume_names(name, count)
+        self.last_volumes = names
+        # Resolve the destination once; the clones inherit folder_id and only fetch upload tokens.
         if not self.chdir(dest_folder_path):
             return False, "Cannot access or create destination folder"
+        folder_id = self.folder_id
+
+        lock = threading.Lock()
+        sent = [0] * count
+        errors = {}
+        attempts = [0] * count
+        timings = dict.fromkeys(PHASES + ("other",), 0.0)
+        timings["bytes"] = 0
+        _phase(timings, "chdir", started)
+        pending = list(range(count))
+
+        def report(idx, n, total):
+            if not on_progress:
+                return
+            with lock:
+                # A retried volume starts again from 0: keep its best mark so the
+                # file total only moves forward (progress counts it as new bytes otherwise).
+                # Reported under the lock so concurrent volumes can't deliver totals out of order.
+                if n > sent[idx]:
+                    sent[idx] = n
+                    on_progress(sum(sent), size)
+
+        def run():
+            uploader = self._clone()
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    idx = pending.pop(0)
+                offset = idx * volume_size
+                length = min(volume_size, size - offset)
+
+                def open_range(offset=offset):
+                    f = opener(local_path)
+                    f.seek(offset)
+                    return f
+
+                try:
+                    ok, err = uploader.upload_stream(
+                        open_range, length, names[idx], dest_folder_path,
+                        on_progress=lambda n, total, idx=idx: report(idx, n, total),
+                        on_attempt=on_attempt, folder_id=folder_id, **kwargs
+                    )
+                except Exception as e:
+                    # Popped from pending already: unless recorded, the volume would count as sent.
+                    with lock:
+                        errors[names[idx]] = "%s: %s" % (type(e).__name__, e)
+                    continue
+                attempts[idx] = uploader.last_attempts
+                with lock:
+                    for key in PHASES + ("other", "bytes"):
+                        timings[key] += uploader.last_timings.get(key, 0)
+                    if not ok:
+                        errors[names[idx]] = err
+
+        if on_progress:
+            on_progress(0, size)
+        threads = [threading.Thread(target=run, daemon=True) for _ in range(min(workers, count))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for idx in pending:  # left over if every worker thread died
+            errors[names[idx]] = "Not sent"
+        self.last_attempts = max(attempts)
+        timings["attempts"] = self.last_attempts
+        timings["total"] = time.monotonic() - started
+        self.last_timings = timings
+        if on_timings:
+            try:
+                on_timings(timings)
+            except Exception:
+                pass
+        if errors:
+            first = sorted(errors)[0]
+            return False, ("%d of %d volumes failed, %s: %s"
+                           % (len(errors), count, first, errors[first]))
+        return True, None
+
+    def upload_stream(self, source, size, name, dest_folder_path,
+                      on_progress=None, chunk_size=DEFAULT_CHUNK_SIZE, limiters=(),
+                      max_chunk_size=MAX_CHUNK_SIZE, retry_policy=None, on_attempt=None,
+                      on_timings=None, folder_id=None):
+        """
+        Upload exactly size bytes from source to Chomikuj as file name.
+
+        source may be:
+          - a bytes-like object (bytes, bytearray, memoryview), sent without copying;
+          - a readable object (readinto or read: files, pipes, sockets' makefile).
+            Seekable ones are rewound for retries; they are never closed;
+          - an iterator/iterable of byte chunks (single pass, so no retries);
+          - a zero-argument callable returning a fresh readable for every
+            attempt (closed afterwards), e.g. an on-the-fly archive.
+        The size must be declared up front (it goes into Content-Length); a
+        source that ends early fails the upload, extra data is not sent.
+
+        on_progress(sent_bytes, total_bytes) is called before the first chunk
+        with (0, total) and after every chunk. Total counts only the file
+        payload, not multipart framing. A retried upload starts again from 0.
+
+        limiters is an iterable of throttle.TokenBucket-like objects; each
+        chunk is charged to all of them before it is sent.
+
+        chunk_size is the starting chunk; it grows with the measured send rate
+        up to max_chunk_size (pass the same value to keep it fixed). The socket
+        options and final chunk size actually used end up in self.last_transport.
+
+        Transient failures (network errors while sending, a connection reset
+        before the server answered) are retried per retry_policy (default UPLOAD_RETRY),
+        re-authenticating and asking for a fresh UploadToken each time. A timeout
+        or clean close after the whole body went out is not retried: the server may
+        already have stored the file, and the API offers no way to look.
+        on_attempt(failed_attempt, error_message) is called before each retry;
+        the number of attempts used is left in self.last_attempts.
+
+        Seconds spent per phase (PHASES: login, chdir, upload_token, dns,
+        connect, send, ack), summed over attempts, plus "other" (retry backoff,
+        opening the source), "total", "attempts" and "bytes" (request bytes
+        fully sent) are left in self.last_timings and passed to on_timings.
+
+        folder_id, when dest_folder_path has already been resolved to it (see
+        upload_file_split), skips chdir on every attempt.
+
+        Returns (True, None) on success or (False, error_message) on failure.
+        """
+        started = time.monotonic()
+        timings = dict.fromkeys(PHASES, 0.0)
+        timings["bytes"] = 0
+        policy = retry_policy or UPLOAD_RETRY
+        name = self._filename_refinement(name)
+        open_source, replayable = _source_factory(source, size)
+        if not replayable:
+            policy = RetryPolicy(max_attempts=1)
+
+        def attempt():
+            return self._upload_once(open_source, size, name, dest_folder_path, on_progress,
+                                     chunk_size, limiters, max_chunk_size, timings, folder_id)
+
+        def on_retry(attempt_no, result):
+            self.last_login = 0  # a stale session token is one of the things that goes wrong
+            if on_attempt:
+                on_attempt(attempt_no, result[1])
+
+        (ok, err, _), self.last_attempts = policy.call(attempt, lambda r: r[2], on_retry)
+        timings["total"] = time.monotonic() - started
+        timings["other"] = max(0.0, timings["total"] - sum(timings[p] for p in PHASES))
+        timings["attempts"] = self.last_attempts
+        self.last_timings = timings
+        if on_timings:
+            try:
+                on_timings(timings)
+            except Exception:
+                pass
+        return ok, err
+
+    def _upload_once(self, open_source, size, name, dest_folder_path, on_progress,
+                     chunk_size, limiters, max_chunk_size, timings, folder_id=None):
+        """One upload attempt; adds to timings. Returns (ok, error_message, transient)."""
+        t = time.monotonic()
         if not self.login():
-            return False, "Authentication failed"
+            _phase(timings, "login", t)
+            return False, "Authentication failed", False
+        t = _phase(timings, "login", t)
+        if folder_id is not None:
+            self.folder_id = folder_id
+        elif not self.chdir(dest_folder_path):
+            _phase(timings, "chdir", t)
+            return False, "Cannot access or create destination folder", False
+        t = _phase(timings, "chdir", t)
 
         xml = (
             '<?xml version="1.0" encoding="UTF-8"?>'
@@ -312,17 +709,18 @@ class ChomikUploader:
             "</UploadToken></s:Body></s:Envelope>"
         )
         resp = self._soap_post(xml, "UploadToken")
+        t = _phase(timings, "upload_token", t)
         if not resp:
-            return False, "UploadToken request failed"
+            return False, "UploadToken request failed", True
         status_m = re.search(r"<a:status>(.*?)</a:status>", resp, re.DOTALL)
         if not status_m or status_m.group(1).strip() != "Ok":
             err = re.search(r"<a:errorMessage[^>]*>([^<]*)</a:errorMessage>", resp)
-            return False, "UploadToken rejected: " + (err.group(1) if err else "unknown")
+            return False, "UploadToken rejected: " + (err.group(1) if err else "unknown"), False
         key_m = re.search(r"<a:key>(.*?)</a:key>", resp)
         stamp_m = re.search(r"<a:stamp>(.*?)</a:stamp>", resp)
         server_m = re.search(r"<a:server>(.*?)</a:server>", resp)
         if not key_m or not stamp_m or not server_m:
-            return False, "UploadToken missing key/stamp/server"
+            return False, "UploadToken missing key/stamp/server", False
         key = key_m.group(1)
         stamp = stamp_m.group(1)
         server = server_m.group(1)
@@ -331,43 +729,41 @@ class ChomikUploader:
         else:
             port = "80"
 
-        size = os.path.getsize(local_path)
         header_bytes, tail = self._build_upload_header(
             server, port, key, stamp, name, size, self.chomik_id, self.folder_id
         )
 
+        t = time.monotonic()
         try:
             host = socket.gethostbyname(server)
         except socket.gaierror as e:
-            return False, "DNS lookup failed for " + server + ": " + str(e)
+            _phase(timings, "dns", t)
+            return False, "DNS lookup failed for " + server + ": " + str(e), True
+        _phase(timings, "dns", t)
 
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(UPLOAD_SOCK_TIMEOUT)
+        try:
+            f = open_source()
+        except OSError as e:
+            return False, "Cannot open upload source: " + str(e), False
+
+        sock, transport = self._open_upload_socket()
+        self.last_transport = transport
+        phase, t = "connect", time.monotonic()
         try:
             sock.connect((host, int(port)))
+            phase, t = "send", _phase(timings, "connect", t)
             sock.sendall(header_bytes)
 
-            sent = 0
-            if on_progress:
-                try:
-                    on_progress(0, size)
-                except Exception:
-                    pass
-
-            with open(local_path, "rb") as f:
-                while True:
-                    chunk = f.read(chunk_size)
-                    if not chunk:
-                        break
-                    sock.sendall(chunk)
-                    sent += len(chunk)
-                    if on_progress:
-                        try:
-                            on_progress(sent, size)
-                        except Exception:
-                            pass
+            transport["chunk_size"] = self._send_payload(
+                sock, f, size, on_progress, limiters, chunk_size, max_chunk_size
+            )
+            if f.remaining:
+                _phase(timings, phase, t)
+                return False, "Upload source ended " + str(f.remaining) + " bytes short", False
 
             sock.sendall(tail)
+            timings["bytes"] += len(header_bytes) + size + len(tail)
+            phase, t = "ack", _phase(timings, "send", t)
 
             resp_bytes = b""
             while True:
@@ -377,17 +773,107 @@ class ChomikUploader:
                 resp_bytes += chunk
                 if b"/>" in resp_bytes or b"</" in resp_bytes:
                     break
+            _phase(timings, "ack", t)
         except (socket.error, socket.timeout, OSError) as e:
-            return False, "Socket error during upload: " + str(e)
+            _phase(timings, phase, t)
+            if phase == "ack" and not isinstance(e, ConnectionResetError):
+                # The whole body is out: the server may have stored the file and lost only
+                # the answer, and a retry would upload it twice. A reset is safe to retry:
+                # the server hung up with our data still unread.
+                return False, ("No answer after the whole file was sent (" + str(e)
+                               + "); not retried, check the destination"), False
+            return False, "Socket error during upload: " + str(e), True
         finally:
             try:
                 sock.close()
             except Exception:
                 pass
+            try:
+                f.close()
+            except Exception:
+                pass
 
         if b'res="1"' in resp_bytes or b"res='1'" in resp_bytes:
-            return True, None
-        return False, "Upload server rejected file: " + resp_bytes.decode("utf-8", "replace")[-300:]
+            return True, None, False
+        if not resp_bytes:
+            # Closed after the whole body without an answer: as above, it may have been stored.
+            return False, "Upload server closed connection without response; not retried, check the destination", False
+        return False, "Upload server rejected file: " + resp_bytes.decode("utf-8", "replace")[-300:], False
+
+    @staticmethod
+    def _open_upload_socket():
+        """TCP socket tuned for bulk upload; returns (sock, effective settings)."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(UPLOAD_SOCK_TIMEOUT)
+        transport = {"timeout": UPLOAD_SOCK_TIMEOUT, "sndbuf": None, "notsent_lowat": None}
+        if UPLOAD_SNDBUF > 0 and (WMEM_MAX is None or UPLOAD_SNDBUF <= WMEM_MAX):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, UPLOAD_SNDBUF)
+            except OSError:
+                pass
+        if UPLOAD_NOTSENT_LOWAT > 0 and TCP_NOTSENT_LOWAT is not None:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, TCP_NOTSENT_LOWAT, UPLOAD_NOTSENT_LOWAT)
+                transport["notsent_lowat"] = sock.getsockopt(socket.IPPROTO_TCP, TCP_NOTSENT_LOWAT)
+            except OSError:
+                pass
+        try:
+            # Linux reports double the requested value (bookkeeping overhead), capped by wmem_max.
+            transport["sndbuf"] = sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+        except OSError:
+            pass
+        return sock, transport
+
+    @staticmethod
+    def _send_payload(sock, f, size, on_progress=None, limiters=(),
+                      chunk_size=DEFAULT_CHUNK_SIZE, max_chunk_size=MAX_CHUNK_SIZE):
+        """
+        Stream f to sock, sizing the chunk from the rate data actually leaves the
+        send buffer (limiter waits included). Without SIOCOUTQ that is the rate of
+        the loop itself, which matches the wire once the buffer is full. Disk reads
+        run ahead in a helper thread (see readahead.py). Returns the final chunk size.
+        """
+        sent = 0
+        if on_progress:
+            try:
+                on_progress(0, size)
+            except Exception:
+                pass
+
+        min_chunk = chunk_size
+        max_chunk_size = max(max_chunk_size, min_chunk)
+        adaptive = max_chunk_size > min_chunk
+        reader = ReadAheadReader(f, chunk_size, buffer_size=max_chunk_size)
+        queued = _send_queue(sock) if adaptive else None  # header bytes still in flight
+        start = queued or 0
+        drained_at, window_start = 0, time.monotonic()
+        for chunk in reader:
+            n = len(chunk)
+            for limiter in limiters:
+                limiter.consume(n)
+            sock.sendall(chunk)
+            sent += n
+            UPLOAD_BYTES.inc(n)
+            if on_progress:
+                try:
+                    on_progress(sent, size)
+                except Exception:
+                    pass
+            if not adaptive:
+                continue
+            now = time.monotonic()
+            elapsed = now - window_start
+            if elapsed < CHUNK_TARGET_SECONDS:
+                continue
+            queued = _send_queue(sock) if queued is not None else None
+            drained = sent + start - queued if queued is not None else sent
+            target = int((drained - drained_at) / elapsed * CHUNK_TARGET_SECONDS)
+            drained_at, window_start = drained, now
+            # Round to whole minimal chunks and move at most 2x per step.
+            target = max(min_chunk, min(max_chunk_size, target, chunk_size * 2))
+            chunk_size = max(min_chunk, target - target % min_chunk)
+            reader.chunk_size = chunk_size
+        return chunk_size
 
     @staticmethod
     def _build_upload_header(server, port, token, stamp, filename, size, chomik_id, folder_id):
@@ -410,3 +896,8 @@ class ChomikUploader:
             "Content-Length: " + str(contentlength) + "\r\n\r\n"
         )
         return (http_header + contentheader).encode("utf-8"), contenttail.encode("utf-8")
+
+
+if __name__ == "__main__":
+    from cli import main
+    sys.exit(main())
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+Command-line uploader for scripts and cron jobs, no web panel needed:
+
+    python -m chomik upload <path> <dest> [options]
+
+<path> is a file or a folder; a folder goes up recursively as
+<dest>/<folder name>/..., like "Upload" in the panel. Accounts come from the
+same variables as the panel (CHOMIK_USERNAME / CHOMIK_PASSWORD or
+CHOMIK_ACCOUNTS) and the history DB is the same file (UPLOAD_HISTORY_DB or
+--history), so anything already sent from either side is skipped, by path or
+by content. An interrupted run resumes by running the same command again.
+
+Exit status: 0 everything uploaded or skipped, 1 some files failed,
+2 bad arguments or configuration, 130 interrupted.
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+import history
+from accounts import POLICIES, AccountPool, parse_accounts
+from chomik import ChomikUploader
+from iosched import DeviceScheduler
+from ordering import ORDERS, order_files
+from progress import ProgressSampler
+from throttle import TokenBucket, parse_rate, parse_size
+
+RESULTS = ("uploaded", "skipped", "duplicate", "would_upload", "failed")
+
+
+def scan(path, dest):
+    """File dicts as app.get_files_recursive builds them, plus each file's destination folder."""
+    path = os.path.abspath(path)
+    dest = "/" + dest.strip("/")
+    if os.path.isfile(path):
+        st = os.stat(path)
+        name = os.path.basename(path)
+        return [{"full_path": path, "filename": name, "relative_path": name, "size": st.st_size,
+                 "dev": st.st_dev, "inode": st.st_ino, "dest": dest, "shard_key": dest}]
+    base = dest.rstrip("/") + "/" + os.path.basename(path.rstrip("/"))
+    files = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        rel_dir = os.path.relpath(dirpath, path)
+        rel_dir = "" if rel_dir == "." else rel_dir
+        for fname in sorted(filenames):
+            fpath = os.path.join(dirpath, fname)
+            try:
+                st = os.stat(fpath)
+            except OSError:
+                continue
+            files.append({
+                "full_path": fpath,
+                "filename": fname,
+                "relative_path": os.path.join(rel_dir, fname) if rel_dir else fname,
+                "size": st.st_size,
+                "dev": st.st_dev,
+                "inode": st.st_ino,
+                "dest": base + "/" + rel_dir.replace(os.sep, "/") if rel_dir else base,
+                "shard_key": base,
+            })
+    return files
+
+
+def _fmt_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return ("%d %s" if unit == "B" else "%.1f %s") % (n, unit)
+        n /= 1024.0
+
+
+def _fmt_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class Reporter:
+    """JSON lines on stdout (--json), or one line per file plus a live status line on stderr."""
+
+    def __init__(self, as_json):
+        self.as_json = as_json
+        self.live = not as_json and sys.stderr.isatty()
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        with self._lock:
+            if self.as_json:
+                sys.stdout.write(json.dumps(dict(event=event, ts=round(time.time(), 3), **fields)) + "\n")
+                sys.stdout.flush()
+                return
+            if self.live:
+                sys.stderr.write("\r\033[K")
+            if event == "file":
+                line = "%-12s %s" % (fields["result"], fields["path"])
+                if fields.get("message"):
+                    line += "  (" + fields["message"] + ")"
+                sys.stdout.write(line + "\n")
+                sys.stdout.flush()
+            elif event == "progress" and self.live:
+                sys.stderr.write("[%d/%d] %s / %s  %s/s  ETA %s" % (
+                    fields["done_files"], fields["total_files"], _fmt_bytes(fields["done_bytes"]),
+                    _fmt_bytes(fields["total_bytes"]), _fmt_bytes(fields["rate"]), _fmt_eta(fields["eta"])))
+                sys.stderr.flush()
+            elif event in ("start", "done", "notice"):
+                if event == "start":
+                    text = "%d files, %s" % (fields["files"], _fmt_bytes(fields["bytes"]))
+                elif event == "done":
+                    text = ", ".join("%s %d" % (k, fields[k]) for k in RESULTS if fields[k])
+                    text = (text or "nothing to do") + " in %.1f s" % fields["seconds"]
+                    if fields["not_processed"]:
+                        text += "; %d not processed" % fields["not_processed"]
+                else:
+                    text = fields["message"]
+                sys.stderr.write(text + "\n")
+                sys.stderr.flush()
+
+
+class BulkUpload:
+
+    def __init__(self, files, pool, reporter, workers=4, force=False, dry_run=False, rate_limit=0,
+                 split_size=0, split_workers=4, progress_interval=1.0):
+        self.files = files
+        self.pool = pool
+        self.reporter = reporter
+        self.workers = max(1, workers)
+        self.force = force
+        self.dry_run = dry_run
+        self.limiters = (TokenBucket(rate_limit),) if rate_limit else ()
+        self.split_size = split_size
+        self.split_workers = split_workers
+        self.io = DeviceScheduler()
+        self.stop = threading.Event()
+        self.sampler = ProgressSampler(self._on_progress, progress_interval)
+        self._lock = threading.Lock()
+        self._pending = iter(files)
+        self._inflight = {}  # checksum -> Event, so identical files in one run go up once
+        self._seen = set()  # dry run: checksums already counted as would_upload
+        self._active = {}
+        self.counts = dict.fromkeys(RESULTS, 0)
+        self.done_files = 0
+        self.done_bytes = 0
+        self.total_bytes = sum(fi["size"] for fi in files)
+
+    def run(self):
+        self.reporter.emit("start", files=len(self.files), bytes=self.total_bytes, dry_run=self.dry_run)
+        started = time.monotonic()
+        self.sampler.start()
+        threads = [threading.Thread(target=self._worker, name="upload-%d" % i, daemon=True)
+                   for i in range(min(self.workers, len(self.files)))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            while t.is_alive():
+                t.join(0.5)  # short joins keep the main thread responsive to Ctrl+C
+        self.reporter.emit("done", seconds=round(time.monotonic() - started, 3),
+                           not_processed=len(self.files) - self.done_files, **self.counts)
+        return 1 if self.counts["failed"] or self.done_files < len(self.files) else 0
+
+    def _worker(self):
+        while not self.stop.is_set():
+            with self._lock:
+                fi = next(self._pending, None)
+            if fi is None:
+                return
+            t0 = time.monotonic()
+            try:
+                result, message = self._upload_one(fi)
+            except Exception as e:
+                result, message = "failed", "Worker exception: " + str(e)
+            with self._lock:
+                self.counts[result] += 1
+                self.done_files += 1
+                self.done_bytes += fi["size"]
+                self._active.pop(fi["full_path"], None)
+            self.reporter.emit("file", path=fi["full_path"], dest=fi["dest"], size=fi["size"],
+                               result=result, message=message, seconds=round(time.monotonic() - t0, 3))
+
+    def _upload_one(self, fi):
+        path, dest = fi["full_path"], fi["dest"]
+        try:
+            size = os.path.getsize(path)
+            mtime = os.path.getmtime(path)
+        except OSError as e:
+            return "failed", "File stat failed: " + str(e)
+        if not self.force and history.is_uploaded(path, dest, size, mtime):
+            return "skipped", "Already uploaded (cached)"
+        checksum = history.file_checksum(path, size, mtime, scheduler=self.io)
+        owner = None
+        try:
+            if not self.force and checksum:
+                owner = self._claim(checksum)
+                if history.checksum_uploaded(checksum):
+                    return "duplicate", "Already uploaded (duplicate content)"
+                if self.dry_run:
+                    with self._lock:
+                        seen, _ = checksum in self._seen, self._seen.add(checksum)
+                    if seen:
+                        return "duplicate", "Same content as another file in this run"
+            if self.dry_run:
+                return "would_upload", None
+            return self._send(fi, size, mtime, checksum)
+        finally:
+            if owner is not None:
+                with self._lock:
+                    self._inflight.pop(checksum, None)
+                owner.set()
+
+    def _claim(self, checksum):
+        """Wait while another worker sends the same content; returns our Event (or None)."""
+        with self._lock:
+            ev = self._inflight.get(checksum)
+            if ev is None:
+                ev = self._inflight[checksum] = threading.Event()
+                return ev
+        ev.wait()
+        return None
+
+    def _send(self, fi, size, mtime, checksum):
+        path, dest = fi["full_path"], fi["dest"]
+        account, uploader = self.pool.acquire(fi["shard_key"], size)
+        if uploader is None:
+            self.stop.set()  # no account can log in: don't grind through the rest
+            return "failed", "Authentication with Chomikuj failed"
+        with self._lock:
+            self._active[path] = size
+        progress = self.sampler.register(path)
+        volumes = None
+        try:
+            if self.split_size and size > self.split_size:
+                ok, err = uploader.upload_file_split(path, dest, self.split_size, filename=fi["filename"],
+                                                     workers=self.split_workers, on_progress=progress.update,
+                                                     limiters=self.limiters, opener=self.io.open)
+                volumes = len(uploader.last_volumes)
+            else:
+                ok, err = uploader.upload_file(path, dest, filename=fi["filename"],
+                                               on_progress=progress.update, limiters=self.limiters,
+                                               opener=self.io.open)
+        finally:
+            self.sampler.unregister(path)
+            self.pool.release(account, uploader, size)
+        if not ok:
+            return "failed", err or "Upload failed"
+        history.record(path, fi["filename"], dest, size, mtime, checksum, volumes, account.username)
+        return "uploaded", "as %d volumes" % volumes if volumes else None
+
+    def _on_progress(self, samples):
+        with self._lock:
+            sent = {key: s for key, s, _, _ in samples}
+            inflight = sum(sent.get(path, 0) for path in self._active)
+            rate = sum(r for _, _, r, _ in samples)
+            done_files, done_bytes = self.done_files, self.done_bytes + inflight
+            active = [{"path": path, "sent": sent.get(path, 0), "size": size}
+                      for path, size in self._active.items()]
+        left = self.total_bytes - done_bytes
+        self.reporter.emit("progress", done_files=done_files, total_files=len(self.files),
+                           done_bytes=done_bytes, total_bytes=self.total_bytes, rate=int(rate),
+                           eta=round(left / rate, 1) if rate > 1 else None, active=active)
+
+
+def _upload(args):
+    try:
+        rate_limit = parse_rate(args.rate_limit)
+        split_size = parse_size(args.split_size)
+    except ValueError as e:
+        sys.stderr.write(str(e) + "\n")
+        return 2
+    if not os.path.exists(args.path):
+        sys.stderr.write("No such file or folder: " + args.path + "\n")
+        return 2
+    pool = AccountPool(
+        parse_accounts(os.environ.get("CHOMIK_ACCOUNTS", ""),
+                       os.environ.get("CHOMIK_USERNAME"), os.environ.get("CHOMIK_PASSWORD")),
+        ChomikUploader,
+        policy=args.sharding,
+    )
+    if not len(pool) and not args.dry_run:
+        sys.stderr.write("Set CHOMIK_USERNAME and CHOMIK_PASSWORD (or CHOMIK_ACCOUNTS)\n")
+        return 2
+    history.HISTORY_DB = args.history
+    history.init()
+
+    reporter = Reporter(args.json)
+    files = order_files(scan(args.path, args.dest), args.order)
+    job = BulkUpload(files, pool, reporter, workers=args.workers, force=args.force, dry_run=args.dry_run,
+                     rate_limit=rate_limit, split_size=split_size, split_workers=args.split_workers,
+                     progress_interval=args.progress_interval)
+
+    interrupted = []
+
+    def on_sigint(*_):
+        if interrupted:
+            raise KeyboardInterrupt
+        interrupted.append(True)
+        job.stop.set()
+        reporter.emit("notice", message="Stopping after the files in progress (Ctrl+C again to abort)")
+
+    signal.signal(signal.SIGINT, on_sigint)
+    signal.signal(signal.SIGTERM, on_sigint)
+    try:
+        status = job.run()
+    except KeyboardInterrupt:
+        return 130
+    return 130 if interrupted and job.done_files < len(files) else status
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m chomik", description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="command", required=True)
+    up = sub.add_parser("upload", help="upload a file or a folder tree")
+    up.add_argument("path", help="local file or folder")
+    up.add_argument("dest", help="Chomikuj folder, e.g. /Moje_Uploady")
+    up.add_argument("-j", "--workers", type=int, default=4, help="files sent in parallel (default 4)")
+    up.add_argument("-n", "--dry-run", action="store_true",
+                    help="only report what would be uploaded (files are still hashed, hashes are cached)")
+    up.add_argument("--force", action="store_true", help="upload even if history says it was sent")
+    up.add_argument("--json", action="store_true", help="JSON lines on stdout: start, file, progress, done")
+    up.add_argument("--history", default=history.HISTORY_DB,
+                    help="upload history DB (default: UPLOAD_HISTORY_DB or %(default)s)")
+    up.add_argument("--rate-limit", default=os.environ.get("UPLOAD_RATE_LIMIT", ""),
+                    help="cap for the whole run, e.g. 10M")
+    up.add_argument("--split-size", default=os.environ.get("UPLOAD_SPLIT_SIZE", ""),
+                    help="send bigger files as parallel volumes, e.g. 4G")
+    up.add_argument("--split-workers", type=int, default=int(os.environ.get("UPLOAD_SPLIT_WORKERS", "4")))
+    up.add_argument("--order", choices=ORDERS, default=os.environ.get("UPLOAD_ORDER", "locality"))
+    up.add_argument("--sharding", choices=POLICIES, default=os.environ.get("CHOMIK_SHARDING", "round_robin"))
+    up.add_argument("--progress-interval", type=float, default=1.0, help="seconds between progress events")
+    args = ap.parse_args(argv)
+    return _upload(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
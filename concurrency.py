@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+AIMD controller for the number of parallel upload workers in a batch.
+Workers call acquire()/release() around each file and report sent bytes and
+failures; every window the limit is raised by one while throughput keeps
+improving and halved when the server or the network starts failing.
+"""
+import math
+import threading
+import time
+
+WINDOW_SECONDS = 5.0
+IMPROVE_RATIO = 1.05  # throughput must grow this much to justify one more worker
+REGRESS_RATIO = 0.90  # ... and an extra worker that costs this much is taken back
+
+
+class AdaptiveConcurrency:
+
+    def __init__(self, initial=2, minimum=1, maximum=8, window=WINDOW_SECONDS):
+        self.minimum = max(1, int(minimum))
+        self.maximum = max(self.minimum, int(maximum))
+        self.window = window
+        self._limit = min(self.maximum, max(self.minimum, int(initial)))
+        self._active = 0
+        self._cond = threading.Condition()
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._saturated = False
+        self._prev_throughput = 0.0
+        self._last_change = 0  # +1 / -1 / 0: direction of the previous adjustment
+        self.throughput = 0.0
+
+    @property
+    def limit(self):
+        return self._limit
+
+    def acquire(self):
+        with self._cond:
+            while self._active >= self._limit:
+                self._cond.wait(1.0)
+                self._maybe_adjust()
+            self._active += 1
+            if self._active >= self._limit:
+                self._saturated = True
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._maybe_adjust()
+            self._cond.notify_all()
+
+    def add_bytes(self, n):
+        with self._cond:
+            self._window_bytes += n
+            self._maybe_adjust()
+
+    def record_error(self):
+        with self._cond:
+            # The only multiplicative decrease: back off right away, as waiting for the
+            # window end would keep hammering a server that is already refusing us.
+            self._set_limit(math.ceil(self._limit / 2), -1)
+            self._reset_window(time.monotonic())
+
+    def _maybe_adjust(self):
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.window:
+            return
+        tp = self._window_bytes / elapsed
+        self.throughput = tp
+        if self._last_change > 0 and tp < self._prev_throughput * REGRESS_RATIO:
+            self._set_limit(self._limit - 1, -1)
+        elif self._saturated and tp >= self._prev_throughput * IMPROVE_RATIO:
+            self._set_limit(self._limit + 1, +1)
+        else:
+            self._last_change = 0
+        self._prev_throughput = tp
+        self._reset_window(now)
+
+    def _set_limit(self, value, direction):
+        value = min(self.maximum, max(self.minimum, value))
+        self._last_change = direction if value != self._limit else 0
+        self._limit = value
+        self._cond.notify_all()
+
+    def _reset_window(self, now):
+        self._window_start = now
+        self._window_bytes = 0
+        self._saturated = self._active >= self._limit
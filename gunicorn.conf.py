@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Production serving: gunicorn -c gunicorn.conf.py app:app
+
+Worker processes with a few threads each. In the default inline mode that is
+one process: every process would run its own uploads, rate limiter,
+concurrency controller and metrics. With UPLOAD_MODE=queue the web processes
+only enqueue, so there are two. WEB_WORKERS overrides either; with more than
+one, upload status and dedupe claims are shared through SHARED_STATUS_DB
+(see statusdb.py).
+"""
+import os
+
+bind = "0.0.0.0:" + os.environ.get("PORT", "5000")
+workers = int(os.environ.get("WEB_WORKERS", "2" if os.environ.get("UPLOAD_MODE") == "queue" else "1"))
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", "8"))
+# Long-running /api/admin/profile requests hold a thread for up to 120 s.
+timeout = 180
+graceful_timeout = 30
+preload_app = False
+
+if workers > 1:
+    os.environ.setdefault("SHARED_STATUS_DB", os.path.join(
+        os.path.dirname(os.environ.get("UPLOAD_HISTORY_DB", "/app/data/upload_history.db")), "status.db"))
+
+
+def post_worker_init(worker):
+    # Importing app starts no threads (worker.py imports it too); every web worker starts its own.
+    import app
+    app.start_background()
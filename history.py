@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Upload history and the checksum cache, one SQLite file (UPLOAD_HISTORY_DB)
+shared by the web panel, worker.py and the command-line uploader (cli.py).
+"uploads" remembers what went where (path, size, mtime, checksum, account);
+"file_hashes" caches sha256 per (path, size, mtime) and (dev, inode), so a
+file is read at most once and a moved file is recognised without reading it.
+"""
+import contextlib
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from metrics import HASH_BYTES, HASH_SECONDS, HISTORY_QUERY
+
+HISTORY_DB = os.environ.get("UPLOAD_HISTORY_DB", "/app/data/upload_history.db")
+HASH_CHUNK_SIZE = 65536  # 64 KB
+# Optionally keep checksums in extended attributes on the files themselves
+# (<prefix>.sha256 + <prefix>.stamp = "size:mtime_ns"), so they survive losing the
+# history DB and other tools on the NAS can reuse them.
+CHECKSUM_XATTR = os.environ.get("CHECKSUM_XATTR", "").lower() in ("1", "true", "yes") \
+    and hasattr(os, "getxattr")
+CHECKSUM_XATTR_PREFIX = os.environ.get("CHECKSUM_XATTR_PREFIX", "user.chomik")
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+lock = threading.Lock()
+xattr_unwritable_devs = set()  # read-only mounts / filesystems without user xattrs
+log = logging.getLogger(__name__)
+
+
+def init():
+    db_dir = os.path.dirname(HISTORY_DB)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    with sqlite3.connect(HISTORY_DB) as c:
+        # WAL: readers don't block the writer when several processes share the DB.
+        c.execute("PRAGMA journal_mode=WAL")
+        # The web panel and queue workers start together: take the write lock before
+        # looking at the schema, so only one of them runs each migration.
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("""CREATE TABLE IF NOT EXISTS uploads(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            abs_path TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            dest_path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            checksum TEXT,
+            finished_at REAL NOT NULL,
+            UNIQUE(abs_path, dest_path, size, mtime))""")
+        # Migrate pre-checksum DBs created by older versions.
+        cols = [r[1] for r in c.execute("PRAGMA table_info(uploads)").fetchall()]
+        if "checksum" not in cols:
+            c.execute("ALTER TABLE uploads ADD COLUMN checksum TEXT")
+        if "volumes" not in cols:
+            # NULL for plain uploads; N when the file went up as N split volumes.
+            c.execute("ALTER TABLE uploads ADD COLUMN volumes INTEGER")
+        if "account" not in cols:
+            c.execute("ALTER TABLE uploads ADD COLUMN account TEXT")
+        # (dev, inode) lets a moved/renamed file be recognised without reading it.
+        if "inode" not in cols:
+            c.execute("ALTER TABLE uploads ADD COLUMN dev INTEGER")
+            c.execute("ALTER TABLE uploads ADD COLUMN inode INTEGER")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_lookup ON uploads(abs_path, dest_path)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_checksum ON uploads(checksum)")
+        # Cache file content hashes so each (path,size,mtime) is hashed at most once.
+        c.execute("""CREATE TABLE IF NOT EXISTS file_hashes(
+            abs_path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            checksum TEXT NOT NULL,
+            UNIQUE(abs_path, size, mtime))""")
+        cols = [r[1] for r in c.execute("PRAGMA table_info(file_hashes)").fetchall()]
+        if "inode" not in cols:
+            c.execute("ALTER TABLE file_hashes ADD COLUMN dev INTEGER")
+            c.execute("ALTER TABLE file_hashes ADD COLUMN inode INTEGER")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_hash_inode ON file_hashes(dev, inode, size, mtime)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_upload_inode ON uploads(dev, inode, size, mtime)")
+
+
+@HISTORY_QUERY.time(query="is_uploaded")
+def is_uploaded(abs_path, dest_path, size, mtime):
+    try:
+        with lock, sqlite3.connect(HISTORY_DB) as c:
+            row = c.execute(
+                "SELECT 1 FROM uploads WHERE abs_path=? AND dest_path=? AND size=? AND mtime=?",
+                (abs_path, dest_path, size, mtime),
+            ).fetchone()
+        return row is not None
+    except sqlite3.Error:
+        return False
+
+
+@HISTORY_QUERY.time(query="any_uploaded")
+def any_uploaded(abs_path, size, mtime):
+    try:
+        with lock, sqlite3.connect(HISTORY_DB) as c:
+            row = c.execute(
+                "SELECT 1 FROM uploads WHERE abs_path=? AND size=? AND mtime=? LIMIT 1",
+                (abs_path, size, mtime),
+            ).fetchone()
+        return row is not None
+    except sqlite3.Error:
+        return False
+
+
+@HISTORY_QUERY.time(query="checksum_uploaded")
+def checksum_uploaded(checksum):
+    if not checksum:
+        return False
+    try:
+        with lock, sqlite3.connect(HISTORY_DB) as c:
+            row = c.execute(
+                "SELECT 1 FROM uploads WHERE checksum=? LIMIT 1",
+                (checksum,),
+            ).fetchone()
+        return row is not None
+    except sqlite3.Error:
+        return False
+
+
+def file_identity(abs_path):
+    """(st_dev, st_ino) of the file, or (None, None) if it can't be stat'ed."""
+    try:
+        st = os.stat(abs_path)
+    except OSError:
+        return None, None
+    return st.st_dev, st.st_ino
+
+
+def _xattr_stamp(st):
+    return "%d:%d" % (st.st_size, st.st_mtime_ns)
+
+
+def _xattr_get_checksum(abs_path, st):
+    """Checksum from the file's xattrs if present and stamped for its current size/mtime."""
+    try:
+        stamp = os.getxattr(abs_path, CHECKSUM_XATTR_PREFIX + ".stamp").decode("ascii")
+        if stamp != _xattr_stamp(st):
+            return None
+        value = os.getxattr(abs_path, CHECKSUM_XATTR_PREFIX + ".sha256").decode("ascii").strip()
+    except (OSError, UnicodeDecodeError):
+        return None
+    return value if _SHA256_RE.match(value) else None
+
+
+def _xattr_set_checksum(abs_path, st, checksum):
+    if st.st_dev in xattr_unwritable_devs:
+        return
+    try:
+        # Stamp last: a half-written pair is never trusted.
+        os.setxattr(abs_path, CHECKSUM_XATTR_PREFIX + ".sha256", checksum.encode("ascii"))
+        os.setxattr(abs_path, CHECKSUM_XATTR_PREFIX + ".stamp", _xattr_stamp(st).encode("ascii"))
+    except OSError:
+        xattr_unwritable_devs.add(st.st_dev)
+
+
+def file_checksum(abs_path, size, mtime, on_chunk=None, scheduler=None):
+    """
+    sha256 of the file, cached by (abs_path, size, mtime). A file that was moved
+    or renamed reuses the hash stored under its (dev, inode, size, mtime).
+    With CHECKSUM_XATTR the file's own xattrs are consulted first and kept in sync.
+    on_chunk(nbytes) is called after every read (throttling/pausing hook).
+    Reading holds a reader slot on the file's device when a scheduler
+    (iosched.DeviceScheduler) is given.
+    None on read error.
+    """
+    try:
+        st = os.stat(abs_path)
+        dev, inode = st.st_dev, st.st_ino
+    except OSError:
+        st, dev, inode = None, None, None
+
+    checksum = _xattr_get_checksum(abs_path, st) if CHECKSUM_XATTR and st else None
+    if checksum:
+        try:
+            with lock, sqlite3.connect(HISTORY_DB) as c:
+                c.execute(
+                    """INSERT OR IGNORE INTO file_hashes (abs_path, size, mtime, checksum, dev, inode)
+                    VALUES (?,?,?,?,?,?)""",
+                    (abs_path, size, mtime, checksum, dev, inode),
+                )
+        except sqlite3.Error:
+            pass
+        return checksum
+
+    try:
+        with lock, sqlite3.connect(HISTORY_DB) as c:
+            row = c.execute(
+                "SELECT checksum FROM file_hashes WHERE abs_path=? AND size=? AND mtime=?",
+                (abs_path, size, mtime),
+            ).fetchone()
+            if not row and inode is not None:
+                row = c.execute(
+                    "SELECT checksum FROM file_hashes WHERE dev=? AND inode=? AND size=? AND mtime=?",
+                    (dev, inode, size, mtime),
+                ).fetchone()
+                if row:
+                    c.execute(
+                        """INSERT OR IGNORE INTO file_hashes (abs_path, size, mtime, checksum, dev, inode)
+                        VALUES (?,?,?,?,?,?)""",
+                        (abs_path, size, mtime, row[0], dev, inode),
+                    )
+        if row:
+            if CHECKSUM_XATTR and st:
+                _xattr_set_checksum(abs_path, st, row[0])
+            return row[0]
+    except sqlite3.Error:
+        pass
+
+    h = hashlib.sha256()
+    slot = scheduler.slot(dev) if scheduler else contextlib.nullcontext()
+    try:
+        with slot, open(abs_path, "rb") as f:
+            busy = 0.0  # excludes on_chunk, which may throttle or pause
+            while True:
+                t0 = time.monotonic()
+                chunk = f.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                h.update(chunk)
+                busy += time.monotonic() - t0
+                if on_chunk:
+                    on_chunk(len(chunk))
+            HASH_SECONDS.inc(busy)
+            HASH_BYTES.inc(f.tell())
+    except OSError:
+        return None
+    checksum = h.hexdigest()
+
+    if CHECKSUM_XATTR and st:
+        try:
+            unchanged = _xattr_stamp(os.stat(abs_path)) == _xattr_stamp(st)
+        except OSError:
+            unchanged = False
+        if unchanged:
+            _xattr_set_checksum(abs_path, st, checksum)
+
+    try:
+        with lock, sqlite3.connect(HISTORY_DB) as c:
+            c.execute(
+                """INSERT OR IGNORE INTO file_hashes (abs_path, size, mtime, checksum, dev, inode)
+                VALUES (?,?,?,?,?,?)""",
+                (abs_path, size, mtime, checksum, dev, inode),
+            )
+    except sqlite3.Error:
+        pass
+    return checksum
+
+
+@HISTORY_QUERY.time(query="record")
+def record(abs_path, filename, dest_path, size, mtime, checksum=None, volumes=None,
+           account=None):
+    dev, inode = file_identity(abs_path)
+    try:
+        with lock, sqlite3.connect(HISTORY_DB) as c:
+            c.execute(
+                """INSERT OR IGNORE INTO uploads
+                (abs_path, filename, dest_path, size, mtime, checksum, finished_at, volumes, account,
+                 dev, inode)
+                VALUES (?,?,?,?,?,?,?,?,?,?,?)""",
+                (abs_path, filename, dest_path, size, mtime, checksum, time.time(), volumes, account,
+                 dev, inode),
+            )
+    except sqlite3.Error as e:
+        log.warning("History record failed: " + str(e))
+
+
+@HISTORY_QUERY.time(query="record_many")
+def record_many(rows, account=None):
+    """rows: iterable of (abs_path, filename, dest_path, size, mtime, checksum)."""
+    now = time.time()
+    try:
+        with lock, sqlite3.connect(HISTORY_DB) as c:
+            c.executemany(
+                """INSERT OR IGNORE INTO uploads
+                (abs_path, filename, dest_path, size, mtime, checksum, finished_at, account,
+                 dev, inode)
+                VALUES (?,?,?,?,?,?,?,?,?,?)""",
+                [tuple(r) + (now, account) + file_identity(r[0]) for r in rows],
+            )
+    except sqlite3.Error as e:
+        log.warning("History record failed: " + str(e))
+
+
+@HISTORY_QUERY.time(query="relink")
+def relink(root):
+    """
+    Point history rows at files' new paths after the tree under root was moved
+    or renamed. Matches on (dev, inode, size, mtime) from a stat-only walk;
+    file contents are never read. Rows from before inode tracking whose file is
+    still in place get their (dev, inode) filled in, so later moves are caught.
+    Returns {'scanned', 'uploads', 'hashes', 'backfilled'}.
+    """
+    by_identity = {}
+    present = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for fname in filenames:
+            fpath = os.path.join(dirpath, fname)
+            try:
+                st = os.stat(fpath)
+            except OSError:
+                continue
+            present[fpath] = (st.st_dev, st.st_ino)
+            by_identity[(st.st_dev, st.st_ino, st.st_size, st.st_mtime)] = fpath
+
+    result = {"scanned": len(present), "uploads": 0, "hashes": 0, "backfilled": 0}
+    with lock, sqlite3.connect(HISTORY_DB) as c:
+        for table, key in (("uploads", "id"), ("file_hashes", "rowid")):
+            legacy = c.execute(
+                "SELECT " + key + ", abs_path FROM " + table + " WHERE inode IS NULL"
+            ).fetchall()
+            backfill = [present[path] + (rid,) for rid, path in legacy if path in present]
+            c.executemany("UPDATE " + table + " SET dev=?, inode=? WHERE " + key + "=?", backfill)
+            result["backfilled"] += len(backfill)
+            rows = c.execute(
+                "SELECT " + key + ", abs_path, dev, inode, size, mtime FROM " + table
+                + " WHERE inode IS NOT NULL"
+            ).fetchall()
+            moves = []
+            for rid, path, dev, inode, size, mtime in rows:
+                if path in present:
+                    continue
+                new_path = by_identity.get((dev, inode, size, mtime))
+                if new_path and not os.path.exists(path):
+                    moves.append((new_path, rid))
+            # OR IGNORE: the file may already have a row under its new path.
+            before = c.total_changes
+            c.executemany(
+                "UPDATE OR IGNORE " + table + " SET abs_path=? WHERE " + key + "=?", moves
+            )
+            result["uploads" if table == "uploads" else "hashes"] = c.total_changes - before
+    return result
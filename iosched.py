@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Per-device coordination of disk-bound reads.
+Hashing and the upload send loop take a reader slot on the device (st_dev)
+they read from, so two batches on one HDD don't seek-thrash it while an SSD
+volume sits idle.
+Rotational disks get fewer slots than SSDs; devices whose type can't be read
+from /sys (NFS, overlay, non-Linux) get a middle value.
+"""
+import contextlib
+import os
+import threading
+
+READERS_HDD = int(os.environ.get("IO_READERS_HDD", "1"))
+READERS_SSD = int(os.environ.get("IO_READERS_SSD", "4"))
+READERS_UNKNOWN = int(os.environ.get("IO_READERS_UNKNOWN", "2"))
+
+
+def is_rotational(dev):
+    """True/False from /sys/dev/block (partitions look at their parent disk), None if unknown."""
+    try:
+        base = "/sys/dev/block/%d:%d" % (os.major(dev), os.minor(dev))
+    except (AttributeError, ValueError, OverflowError):
+        return None
+    for path in (base + "/queue/rotational", base + "/../queue/rotational"):
+        try:
+            with open(path) as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return None
+
+
+def locality_order(files):
+    """
+    Order file dicts (with 'dev' and 'inode') for sequential access: inode order
+    within a device, devices interleaved so every disk has work queued.
+    Files without a device keep their relative order at the end.
+    """
+    by_dev = {}
+    rest = []
+    for fi in files:
+        if fi.get("dev") is None:
+            rest.append(fi)
+        else:
+            by_dev.setdefault(fi["dev"], []).append(fi)
+    queues = [sorted(group, key=lambda fi: fi.get("inode") or 0) for _, group in sorted(by_dev.items())]
+    ordered = []
+    for i in range(max((len(q) for q in queues), default=0)):
+        ordered.extend(q[i] for q in queues if i < len(q))
+    return ordered + rest
+
+
+class _Device:
+    __slots__ = ("dev", "rotational", "limit", "active", "waiting")
+
+    def __init__(self, dev, rotational, limit):
+        self.dev = dev
+        self.rotational = rotational
+        self.limit = max(1, limit)
+        self.active = 0
+        self.waiting = 0
+
+
+class _SlottedFile:
+    """Binary file whose reads each hold a reader slot on its device."""
+
+    def __init__(self, f, scheduler, dev):
+        self._f = f
+        self._scheduler = scheduler
+        self._dev = dev
+
+    def readinto(self, buf):
+        with self._scheduler.slot(self._dev):
+            return self._f.readinto(buf)
+
+    def read(self, n=-1):
+        with self._scheduler.slot(self._dev):
+            return self._f.read(n)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._f.seek(offset, whence)
+
+    def fileno(self):
+        return self._f.fileno()
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DeviceScheduler:
+
+    def __init__(self, hdd=READERS_HDD, ssd=READERS_SSD, unknown=READERS_UNKNOWN):
+        self.hdd = hdd
+        self.ssd = ssd
+        self.unknown = unknown
+        self._cond = threading.Condition()
+        self._devices = {}
+
+    def _device(self, dev):
+        d = self._devices.get(dev)
+        if d is None:
+            rotational = is_rotational(dev)
+            limit = self.unknown if rotational is None else (self.hdd if rotational else self.ssd)
+            d = self._devices[dev] = _Device(dev, rotational, limit)
+        return d
+
+    @contextlib.contextmanager
+    def slot(self, dev):
+        """Hold one reader slot on dev for the duration of the block (dev None: no limit)."""
+        if dev is None:
+            yield
+            return
+        with self._cond:
+            d = self._device(dev)
+            d.waiting += 1
+            while d.active >= d.limit:
+                self._cond.wait()
+            d.waiting -= 1
+            d.active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                d.active -= 1
+                self._cond.notify_all()
+
+    def open(self, path):
+        """
+        Open path for binary reading; every read then takes a slot on its device,
+        so the upload send loop shares the disk with hashing. Slots are held per
+        read, not per file: an upload waiting on the network leaves the disk free.
+        """
+        f = open(path, "rb")
+        try:
+            dev = os.fstat(f.fileno()).st_dev
+        except OSError:
+            dev = None
+        return _SlottedFile(f, self, dev)
+
+    def snapshot(self):
+        with self._cond:
+            return [
+                {
+                    "dev": "%d:%d" % (os.major(d.dev), os.minor(d.dev)),
+                    "rotational": d.rotational,
+                    "limit": d.limit,
+                    "active": d.active,
+                    "waiting": d.waiting,
+                }
+                for d in self._devices.values()
+            ]
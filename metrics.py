@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal Prometheus metrics (text exposition format 0.0.4), no client library.
+Counters and histograms are updated from the upload paths with one short lock
+per call; gauges are computed only when /metrics is scraped.
+"""
+import bisect
+import functools
+import threading
+import time
+
+_registry = []
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_str(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')
+                                       .replace("\n", "\\n")) for k, v in pairs) + "}"
+
+
+def _fmt(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def render(self):
+        out = ["# HELP %s %s" % (self.name, self.doc), "# TYPE %s %s" % (self.name, self.kind)]
+        out.extend(self._samples())
+        return out
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, doc, labels=()):
+        super().__init__(name, doc, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return ["%s%s %s" % (self.name, _label_str(self.labels, k), _fmt(v)) for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # key -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[i] += 1
+            row[-1] += value
+
+    def time(self, **labels):
+        """Decorator observing the wrapped function's duration."""
+        def deco(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                t0 = time.monotonic()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(time.monotonic() - t0, **labels)
+            return wrapper
+        return deco
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        out = []
+        for key, row in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), row):
+                cumulative += n
+                out.append("%s_bucket%s %d" % (
+                    self.name, _label_str(self.labels, key, [("le", _fmt(float(bound)))]), cumulative))
+            out.append("%s_sum%s %s" % (self.name, _label_str(self.labels, key), _fmt(row[-1])))
+            out.append("%s_count%s %d" % (self.name, _label_str(self.labels, key), cumulative))
+        return out
+
+
+class Gauge(_Metric):
+    """Value(s) computed at scrape time: fn() returns a number or {label tuple: number}."""
+    kind = "gauge"
+
+    def __init__(self, name, doc, fn, labels=()):
+        super().__init__(name, doc, labels)
+        self.fn = fn
+
+    def _samples(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return ["%s%s %s" % (self.name, _label_str(self.labels, k), _fmt(v)) for k, v in sorted(value.items())]
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Shared by chomik.py (transport) and app.py (upload lifecycle).
+SOAP_REQUESTS = Counter("chomik_soap_requests_total", "SOAP calls by action and outcome.",
+                        ("action", "outcome"))
+SOAP_DURATION = Histogram("chomik_soap_duration_seconds", "SOAP call latency including retries.",
+                          ("action",))
+UPLOAD_BYTES = Counter("chomik_upload_bytes_total", "File payload bytes written to upload sockets.")
+UPLOADS_STARTED = Counter("chomik_uploads_started_total", "Uploads picked up by a worker.")
+UPLOADS_FINISHED = Counter("chomik_uploads_finished_total",
+                           "Finished uploads by result (success, error, cached, duplicate).", ("result",))
+HASH_BYTES = Counter("chomik_hash_bytes_total", "Bytes read to compute checksums.")
+HASH_SECONDS = Counter("chomik_hash_seconds_total", "Time spent computing checksums.")
+HISTORY_QUERY = Histogram("chomik_history_query_duration_seconds", "Upload history DB call latency.",
+                          ("query",), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0))
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Processing order for folder batches, chosen when the batch is enqueued:
+
+  locality     - inode order per device, devices interleaved (disk friendly)
+  path         - folder scan order (sorted directories, then names)
+  smallest     - smallest files first: many files finish early, visible progress
+  largest      - largest first: the longest uploads start first, so parallel
+                 workers finish close together (shortest makespan)
+  interleaved  - alternate largest and smallest, so one worker streams a big
+                 file while others churn through the per-file overhead of small ones
+
+Size orders are stable on top of the locality order, so equal sizes still
+read sequentially.
+"""
+from iosched import locality_order
+
+ORDERS = ("locality", "path", "smallest", "largest", "interleaved")
+
+
+def order_files(files, policy="locality"):
+    """Return file dicts (with 'size', 'dev', 'inode') in policy order; files come in scan order."""
+    if policy not in ORDERS:
+        raise ValueError("Unknown batch order: " + str(policy))
+    if policy == "path":
+        return list(files)
+    ordered = locality_order(files)
+    if policy == "smallest":
+        ordered.sort(key=lambda fi: fi["size"])
+    elif policy == "largest":
+        ordered.sort(key=lambda fi: fi["size"], reverse=True)
+    elif policy == "interleaved":
+        by_size = sorted(ordered, key=lambda fi: fi["size"])
+        ordered = []
+        lo, hi = 0, len(by_size) - 1
+        while lo <= hi:
+            ordered.append(by_size[hi])
+            if lo < hi:
+                ordered.append(by_size[lo])
+            lo += 1
+            hi -= 1
+    return ordered
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Background pre-hashing of the browse folder.
+Walks the tree at idle CPU/IO priority and fills the checksum cache ahead of
+time, so the dedupe checks at upload time are index lookups. Backs off while
+uploads run and reads no faster than the configured rate.
+"""
+import ctypes
+import os
+import platform
+import threading
+import time
+
+from throttle import TokenBucket
+
+BUSY_RECHECK_SECONDS = 1.0
+IDLE_POLL_SECONDS = 5.0
+
+# ioprio_set(2) has no libc wrapper; syscall numbers per architecture.
+_SYS_IOPRIO_SET = {"x86_64": 251, "aarch64": 30, "armv7l": 314, "armv6l": 314, "i686": 289}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_IDLE = 3
+_IOPRIO_CLASS_SHIFT = 13
+
+
+def lower_thread_priority():
+    """Make the calling thread nice 19 and idle IO class (Linux; best effort elsewhere)."""
+    tid = threading.get_native_id()
+    try:
+        # On Linux a thread id works with PRIO_PROCESS and only affects that thread.
+        os.setpriority(os.PRIO_PROCESS, tid, 19)
+    except (AttributeError, OSError):
+        pass
+    nr = _SYS_IOPRIO_SET.get(platform.machine())
+    if nr is None:
+        return
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.syscall(nr, _IOPRIO_WHO_PROCESS, tid, _IOPRIO_CLASS_IDLE << _IOPRIO_CLASS_SHIFT)
+    except (OSError, AttributeError):
+        pass
+
+
+class PreHasher(threading.Thread):
+    """
+    checksum_fn(path, size, mtime, on_chunk=...) must be the cached checksum
+    function (cache hits cost a lookup); is_busy() returns True while uploads
+    are running. A full pass repeats every `interval` seconds.
+    """
+
+    def __init__(self, root, checksum_fn, is_busy, rate=0, interval=6 * 3600):
+        super().__init__(name="prehash", daemon=True)
+        self.root = root
+        self.checksum_fn = checksum_fn
+        self.is_busy = is_busy
+        self.limiter = TokenBucket(rate)
+        self.interval = interval
+        self.state = "starting"
+        self.current = None
+        self.files_seen = 0
+        self.bytes_read = 0
+        self.last_pass_at = None
+        self._busy_until_check = 0.0
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "current": self.current,
+            "files_seen": self.files_seen,
+            "bytes_read": self.bytes_read,
+            "last_pass_at": self.last_pass_at,
+        }
+
+    def _wait_idle(self):
+        now = time.monotonic()
+        if now < self._busy_until_check:
+            return
+        while self.is_busy() and not self._stop_event.is_set():
+            self.state = "paused"
+            self._stop_event.wait(IDLE_POLL_SECONDS)
+        self.state = "hashing"
+        self._busy_until_check = time.monotonic() + BUSY_RECHECK_SECONDS
+
+    def _on_chunk(self, nbytes):
+        self.bytes_read += nbytes
+        self.limiter.consume(nbytes)
+        self._wait_idle()
+
+    def run(self):
+        lower_thread_priority()
+        while not self._stop_event.is_set():
+            self._pass()
+            self.state = "idle"
+            self.current = None
+            self.last_pass_at = time.time()
+            self._stop_event.wait(self.interval)
+
+    def _pass(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            for fname in sorted(filenames):
+                if self._stop_event.is_set():
+                    return
+                self._wait_idle()
+                fpath = os.path.join(dirpath, fname)
+                try:
+                    st = os.stat(fpath)
+                except OSError:
+                    continue
+                self.current = fpath
+                self.files_seen += 1
+                self.checksum_fn(fpath, st.st_size, st.st_mtime, on_chunk=self._on_chunk)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Live profiling without restarting the process.
+sample() polls every thread's stack (sys._current_frames) for a while and
+returns collapsed stacks ("thread;outer;...;inner count" lines) that
+flamegraph.pl, speedscope or inferno read directly. profile_call() runs one
+function under cProfile in the calling thread and returns a pstats report.
+"""
+import collections
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+
+MAX_SECONDS = 120
+MIN_INTERVAL = 0.001
+
+
+def _frame_label(code, lineno):
+    name = getattr(code, "co_qualname", code.co_name)
+    # f_lineno is None for a frame that is between instructions (e.g. just created).
+    return "%s (%s:%s)" % (name, os.path.basename(code.co_filename), lineno or "?")
+
+
+def sample(seconds, interval=0.005, stop=None):
+    """Sample all other threads every `interval` seconds; returns collapsed stacks as text."""
+    seconds = min(float(seconds), MAX_SECONDS)
+    interval = max(float(interval), MIN_INTERVAL)
+    me = threading.get_ident()
+    counts = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline and not (stop and stop.is_set()):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code, frame.f_lineno))
+                frame = frame.f_back
+            stack.append(names.get(ident, "thread-%d" % ident))
+            counts[";".join(s.replace(";", ",") for s in reversed(stack))] += 1
+        time.sleep(interval)
+    return "".join("%s %d\n" % (stack, n) for stack, n in counts.most_common())
+
+
+def profile_call(fn, *args, **kwargs):
+    """Run fn under cProfile; returns (result, report text sorted by cumulative time)."""
+    prof = cProfile.Profile()
+    try:
+        result = prof.runcall(fn, *args, **kwargs)
+    finally:
+        out = io.StringIO()
+        stats = pstats.Stats(prof, stream=out)
+        stats.sort_stats("cumulative").print_stats(40)
+        report = out.getvalue()
+    return result, report
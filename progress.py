@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Upload progress without locks in the send loop.
+Each transfer gets a Progress whose update(sent, total) is passed straight to
+the uploader as on_progress: two attribute stores per chunk, no clock reads,
+no locks. One ProgressSampler thread reads every registered Progress at a
+fixed rate, derives an exponentially smoothed throughput and an ETA, and
+hands all samples of a tick to a single publish callback.
+"""
+import math
+import threading
+import time
+
+SAMPLE_SECONDS = 0.25
+EMA_SECONDS = 5.0  # time constant of the throughput average
+
+
+class Progress:
+    __slots__ = ("sent", "total", "on_bytes", "rate", "_seen", "_at")
+
+    def __init__(self, on_bytes=None):
+        self.sent = 0
+        self.total = None  # None until the uploader reports for the first time
+        self.on_bytes = on_bytes  # called by the sampler with newly sent bytes (e.g. AdaptiveConcurrency.add_bytes)
+        self.rate = None  # bytes/s; None until two samples are in
+        self._seen = 0
+        self._at = None
+
+    def update(self, sent, total):
+        self.sent = sent
+        self.total = total
+
+
+class ProgressSampler:
+    """publish([(key, sent, bytes_per_second, eta_seconds or None)]) runs every interval."""
+
+    def __init__(self, publish, interval=SAMPLE_SECONDS, ema_seconds=EMA_SECONDS):
+        self.publish = publish
+        self.interval = interval
+        self.ema_seconds = ema_seconds
+        self._items = {}
+        self._lock = threading.Lock()  # taken per register/unregister and once per tick, never per chunk
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="progress-sampler", daemon=True)
+        self._thread.start()
+
+    def register(self, key, on_bytes=None):
+        progress = Progress(on_bytes)
+        with self._lock:
+            self._items[key] = progress
+        return progress
+
+    def unregister(self, key):
+        """Stop sampling key after publishing its last bytes (ETA cleared)."""
+        with self._lock:
+            progress = self._items.pop(key, None)
+            if progress is None or progress.total is None:
+                return
+            self._sample(progress, time.monotonic())
+        self.publish([(key, progress.sent, progress.rate or 0.0, None)])
+
+    def _sample(self, progress, now):
+        sent = progress.sent
+        delta = sent - progress._seen
+        if delta < 0:
+            delta = sent  # restarted from zero (retry)
+        progress._seen = sent
+        if progress._at is None:
+            progress._at = now  # first report: a baseline, login and token time don't count
+        else:
+            dt = now - progress._at
+            progress._at = now
+            if dt > 0:
+                if progress.rate is None:
+                    progress.rate = delta / dt
+                else:
+                    alpha = 1.0 - math.exp(-dt / self.ema_seconds)
+                    progress.rate += alpha * (delta / dt - progress.rate)
+        if delta and progress.on_bytes is not None:
+            progress.on_bytes(delta)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            samples = []
+            with self._lock:
+                for key, progress in self._items.items():
+                    if progress.total is None:
+                        continue
+                    self._sample(progress, now)
+                    rate = progress.rate or 0.0
+                    eta = (progress.total - progress.sent) / rate if rate > 1 else None
+                    samples.append((key, progress.sent, rate, eta))
+            if samples:
+                try:
+                    self.publish(samples)
+                except Exception:
+                    pass
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Read-ahead file reader for the upload send loop.
+A background thread fills a small ring of preallocated buffers with readinto()
+while the caller is busy in sendall(), so a seeking disk and a draining socket
+overlap instead of taking turns. No per-chunk allocations.
+"""
+import os
+import queue
+import threading
+
+READAHEAD_BUFFERS = int(os.environ.get("CHOMIK_READAHEAD_BUFFERS", "4"))
+
+
+def advise_sequential(f):
+    """Hint the kernel that f will be read front to back (bigger readahead window)."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    except (OSError, ValueError, AttributeError):
+        # Not a real file (pipe, BytesIO) or a filesystem that ignores hints.
+        pass
+
+
+class ReadAheadReader:
+    """
+    Iterate over f as memoryviews of at most chunk_size bytes.
+
+    Each yielded view is only valid until the next one is requested; its buffer
+    then goes back to the ring. chunk_size may be changed while iterating (the
+    send loop grows it) and is capped at buffer_size. With buffers=0 reads
+    happen inline in the caller's thread, still into a reused buffer.
+    """
+
+    def __init__(self, f, chunk_size, buffer_size=None, buffers=READAHEAD_BUFFERS):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer_size = max(buffer_size or chunk_size, chunk_size)
+        self.nbuffers = max(0, int(buffers))
+        self._bufs = [bytearray(self.buffer_size) for _ in range(max(1, self.nbuffers))]
+        self._views = [memoryview(b) for b in self._bufs]
+        self._free = queue.Queue()
+        self._filled = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        advise_sequential(f)
+
+    def __iter__(self):
+        if not self.nbuffers:
+            return self._iter_inline()
+        return self._iter_threaded()
+
+    def _read_into(self, idx):
+        size = min(self.chunk_size, self.buffer_size)
+        return self.f.readinto(self._views[idx][:size])
+
+    def _iter_inline(self):
+        while True:
+            n = self._read_into(0)
+            if not n:
+                return
+            yield self._views[0][:n]
+
+    def _producer(self):
+        try:
+            while not self._stop.is_set():
+                idx = self._free.get()
+                if idx is None or self._stop.is_set():
+                    return
+                n = self._read_into(idx)
+                self._filled.put((idx, n))
+                if not n:
+                    return
+        except Exception as e:
+            self._filled.put((None, e))
+
+    def _iter_threaded(self):
+        for idx in range(self.nbuffers):
+            self._free.put(idx)
+        self._thread = threading.Thread(target=self._producer, daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                idx, n = self._filled.get()
+                if idx is None:
+                    raise n
+                if not n:
+                    return
+                yield self._views[idx][:n]
+                self._free.put(idx)
+        finally:
+            self.close()
+
+    def close(self):
+        self._stop.set()
+        self._free.put(None)  # wake the producer if it waits for a buffer
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
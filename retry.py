@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Retry policy with capped exponential backoff and full jitter.
+Callers decide what is transient; the policy only decides how many times and
+how long to wait, so SOAP calls and whole-file uploads share one implementation.
+"""
+import os
+import random
+import time
+
+
+class RetryPolicy:
+
+    def __init__(self, max_attempts=4, base_delay=1.0, max_delay=60.0, sleep=time.sleep):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+        self.sleep = sleep
+
+    @classmethod
+    def from_env(cls, prefix, **defaults):
+        """Read PREFIX_ATTEMPTS / PREFIX_BASE_DELAY / PREFIX_MAX_DELAY, falling back to defaults."""
+        kwargs = dict(defaults)
+        for key, cast in (("max_attempts", int), ("base_delay", float), ("max_delay", float)):
+            env = prefix + "_" + ("ATTEMPTS" if key == "max_attempts" else key.upper())
+            if os.environ.get(env):
+                kwargs[key] = cast(os.environ[env])
+        return cls(**kwargs)
+
+    def backoff(self, attempt):
+        """Delay before attempt+1, with attempt counted from 1 ("full jitter")."""
+        cap = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, cap)
+
+    def call(self, fn, is_transient, on_retry=None):
+        """
+        Run fn() until it returns a result that is_transient(result) rejects as
+        not transient, or attempts run out. on_retry(attempt, result) is called
+        before each backoff sleep. Returns (result, attempts_used).
+        """
+        attempt = 1
+        while True:
+            result = fn()
+            if attempt >= self.max_attempts or not is_transient(result):
+                return result, attempt
+            if on_retry:
+                try:
+                    on_retry(attempt, result)
+                except Exception:
+                    pass
+            self.sleep(self.backoff(attempt))
+            attempt += 1
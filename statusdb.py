@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Upload status shared between processes through one SQLite file.
+Each process keeps its live records in memory and publishes the ones that
+changed a few times per second; any process can serve status reads from the
+table. Dedupe claims (an identical file being uploaded right now) live here
+too, so two web workers never send the same content at once.
+
+Rows belong to an owner ("host:pid:nonce"; the nonce tells a restarted
+process from its predecessor with the same PID). When a process dies, its
+unfinished rows are marked failed and its claims dropped by whoever sweeps
+next. Claims are leases as well: heartbeat() renews them, and one not renewed
+for CLAIM_LEASE_SECONDS can be taken over, e.g. after a machine went away.
+
+The same file holds the job queue of UPLOAD_MODE=queue: the web process
+enqueues jobs together with their "queued" status rows, worker processes
+(worker.py, possibly on other machines sharing the volume) claim them one by
+one. A running job whose worker died or stopped heartbeating goes back to
+the queue, up to JOB_MAX_ATTEMPTS times.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+BUSY_TIMEOUT = 30  # seconds a writer waits for the lock before "database is locked"
+# WAL needs shared memory between the processes: use DELETE when machines share the file over NFS/SMB.
+JOURNAL_MODE = os.environ.get("SHARED_STATUS_JOURNAL", "WAL")
+QUEUE_OWNER = "queue"  # owner of the status rows of jobs no worker has claimed yet
+JOB_LEASE_SECONDS = 60  # a running job without a heartbeat for this long is requeued
+JOB_MAX_ATTEMPTS = 3
+CLAIM_LEASE_SECONDS = JOB_LEASE_SECONDS
+
+
+def _owner_alive(owner, me):
+    if owner == QUEUE_OWNER:
+        return True
+    host, _, pid = owner.partition(":")
+    pid = pid.partition(":")[0]
+    if host != socket.gethostname():
+        return True  # can't tell for another machine; leases expire its jobs and claims
+    if pid == str(os.getpid()):
+        return owner == me  # our PID, another nonce: this process before a restart
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    try:
+        # A killed child its parent hasn't reaped yet still answers kill(0).
+        with open("/proc/%s/stat" % pid) as f:
+            return f.read().rpartition(")")[2].split()[0] != "Z"
+    except (OSError, IndexError):
+        return True
+
+
+class SharedStatus:
+
+    def __init__(self, path):
+        self.path = path
+        # Taken at construction, i.e. in the worker process after a pre-fork server forked.
+        self.owner = "%s:%d:%s" % (socket.gethostname(), os.getpid(), os.urandom(4).hex())
+        self._local = threading.local()
+        db_dir = os.path.dirname(path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._conn() as c:
+            c.execute("PRAGMA journal_mode=" + JOURNAL_MODE)
+            c.execute("""CREATE TABLE IF NOT EXISTS status(
+                upload_id TEXT PRIMARY KEY,
+                batch_id TEXT,
+                owner TEXT NOT NULL,
+                data TEXT NOT NULL,
+                finished_at REAL,
+                updated_at REAL NOT NULL)""")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_status_finished ON status(finished_at)")
+            c.execute("""CREATE TABLE IF NOT EXISTS batches(
+                batch_id TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                data TEXT NOT NULL,
+                finished_at REAL,
+                updated_at REAL NOT NULL)""")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_batches_finished ON batches(finished_at)")
+            c.execute("""CREATE TABLE IF NOT EXISTS claims(
+                key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                claimed_at REAL NOT NULL)""")
+            c.execute("""CREATE TABLE IF NOT EXISTS jobs(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                upload_id TEXT NOT NULL,
+                batch_id TEXT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'queued',
+                owner TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                enqueued_at REAL NOT NULL,
+                heartbeat_at REAL)""")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state, id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs(batch_id)")
+            c.execute("""CREATE TABLE IF NOT EXISTS profiles(
+                upload_id TEXT PRIMARY KEY,
+                report TEXT NOT NULL,
+                created_at REAL NOT NULL)""")
+
+    def _conn(self):
+        # One connection per thread; sqlite3 connections are not shareable across threads.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def publish(self, uploads=(), batches=()):
+        """Upsert (upload_id, record) and (batch_id, record) pairs owned by this process."""
+        now = time.time()
+        with self._conn() as c:
+            c.executemany(
+                "INSERT OR REPLACE INTO status VALUES (?,?,?,?,?,?)",
+                [(uid, rec.get("batch_id"), self.owner, json.dumps(rec), rec.get("finished_at"), now)
+                 for uid, rec in uploads],
+            )
+            c.executemany(
+                "INSERT OR REPLACE INTO batches VALUES (?,?,?,?,?)",
+                [(bid, self.owner, json.dumps(b), b.get("finished_at"), now) for bid, b in batches],
+            )
+
+    def get(self, upload_id):
+        row = self._conn().execute("SELECT data FROM status WHERE upload_id=?", (upload_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def active(self):
+        """
+        Unfinished records: ([(upload_id, record)], [(batch_id, record)]). Only those
+        rows are read and decoded (idx_status_finished), however many finished ones
+        a big batch has left behind; finished uploads stay readable through get().
+        """
+        c = self._conn()
+        uploads = [(uid, json.loads(d)) for uid, d in
+                   c.execute("SELECT upload_id, data FROM status WHERE finished_at IS NULL")]
+        batches = [(bid, json.loads(d)) for bid, d in
+                   c.execute("SELECT batch_id, data FROM batches WHERE finished_at IS NULL")]
+        return uploads, batches
+
+    def any_running(self):
+        row = self._conn().execute("SELECT 1 FROM status WHERE finished_at IS NULL LIMIT 1").fetchone()
+        return row is not None
+
+    def sweep(self, ttl):
+        """
+        Drop finished rows older than ttl; requeue the jobs and fail the other rows
+        and claims of dead owners; requeue jobs whose lease ran out.
+        """
+        now = time.time()
+        cutoff = now - ttl
+        with self._conn() as c:
+            c.execute("DELETE FROM status WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))
+            c.execute("DELETE FROM batches WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))
+            owners = {o for (o,) in c.execute(
+                "SELECT DISTINCT owner FROM status WHERE finished_at IS NULL "
+                "UNION SELECT DISTINCT owner FROM claims "
+                "UNION SELECT DISTINCT owner FROM jobs WHERE state='running'")}
+            for owner in owners:
+                if owner != self.owner and not _owner_alive(owner, self.owner):
+                    self._requeue(c, "owner=?", (owner,))
+                    self._fail_owner(c, owner)
+            self._requeue(c, "owner!=? AND heartbeat_at<?", (self.owner, now - JOB_LEASE_SECONDS))
+            c.execute("DELETE FROM claims WHERE owner!=? AND claimed_at<?",
+                      (self.owner, now - CLAIM_LEASE_SECONDS))
+
+    def _fail_owner(self, c, owner):
+        now = time.time()
+        rows = c.execute("SELECT upload_id, data FROM status WHERE owner=? AND finished_at IS NULL",
+                         (owner,)).fetchall()
+        for uid, data in rows:
+            rec = json.loads(data)
+            rec.update(status="error", message="Worker process exited", finished_at=now)
+            c.execute("UPDATE status SET data=?, finished_at=? WHERE upload_id=?", (json.dumps(rec), now, uid))
+        for bid, data in c.execute("SELECT batch_id, data FROM batches WHERE owner=? AND finished_at IS NULL",
+                                   (owner,)).fetchall():
+            batch = json.loads(data)
+            batch["finished_at"] = now
+            c.execute("UPDATE batches SET data=?, finished_at=? WHERE batch_id=?", (json.dumps(batch), now, bid))
+        c.execute("DELETE FROM claims WHERE owner=?", (owner,))
+
+    def enqueue(self, jobs, batch=None):
+        """
+        Queue (upload_id, kind, payload, record) jobs; their status records (and the
+        optional (batch_id, record)) are published in the same transaction.
+        """
+        now = time.time()
+        jobs = list(jobs)
+        with self._conn() as c:
+            if batch is not None:
+                c.execute("INSERT OR REPLACE INTO batches VALUES (?,?,?,?,?)",
+                          (batch[0], QUEUE_OWNER, json.dumps(batch[1]), None, now))
+            c.executemany(
+                "INSERT OR REPLACE INTO status VALUES (?,?,?,?,?,?)",
+                [(uid, rec.get("batch_id"), QUEUE_OWNER, json.dumps(rec), None, now)
+                 for uid, _, _, rec in jobs],
+            )
+            c.executemany(
+                "INSERT INTO jobs(upload_id, batch_id, kind, payload, enqueued_at) VALUES (?,?,?,?,?)",
+                [(uid, rec.get("batch_id"), kind, json.dumps(payload), now)
+                 for uid, kind, payload, rec in jobs],
+            )
+
+    def claim_job(self):
+        """Take the oldest queued job: (job_id, upload_id, kind, payload, record) or None."""
+        c = self._conn()
+        with c:
+            # IMMEDIATE takes the write lock up front, so two workers can't pick the same row.
+            c.execute("BEGIN IMMEDIATE")
+            row = c.execute("SELECT id, upload_id, kind, payload FROM jobs WHERE state='queued' "
+                            "ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            job_id, uid, kind, payload = row
+            c.execute("UPDATE jobs SET state='running', owner=?, attempts=attempts+1, heartbeat_at=? "
+                      "WHERE id=?", (self.owner, time.time(), job_id))
+            c.execute("UPDATE status SET owner=? WHERE upload_id=?", (self.owner, uid))
+            rec = c.execute("SELECT data FROM status WHERE upload_id=?", (uid,)).fetchone()
+        return job_id, uid, kind, json.loads(payload), json.loads(rec[0]) if rec else {}
+
+    def heartbeat(self):
+        """Extend the lease of every job and claim this process holds."""
+        now = time.time()
+        with self._conn() as c:
+            c.execute("UPDATE jobs SET heartbeat_at=? WHERE owner=? AND state='running'", (now, self.owner))
+            c.execute("UPDATE claims SET claimed_at=? WHERE owner=?", (now, self.owner))
+
+    def finish_job(self, job_id, upload_id, record, update_batch=None):
+        """
+        Drop a finished job and store its final record; update_batch(batch) -> batch
+        folds it into the batch record, which is closed once no jobs of it are left.
+        False if the job was requeued meanwhile (lease lost).
+        """
+        with self._conn() as c:
+            if c.execute("DELETE FROM jobs WHERE id=? AND owner=?", (job_id, self.owner)).rowcount != 1:
+                return False
+            c.execute("INSERT OR REPLACE INTO status VALUES (?,?,?,?,?,?)",
+                      (upload_id, record.get("batch_id"), self.owner, json.dumps(record),
+                       record.get("finished_at"), time.time()))
+            if record.get("batch_id"):
+                self._update_batch(c, record["batch_id"], update_batch)
+        return True
+
+    def job_counts(self):
+        """{"queued": n, "running": m}"""
+        counts = {"queued": 0, "running": 0}
+        counts.update(self._conn().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        return counts
+
+    def running_owners(self):
+        """
+        {batch_id: processes running its jobs}, with None -> processes running any job;
+        worker.py splits the global and per-batch rate limits between them.
+        """
+        c = self._conn()
+        counts = dict(c.execute("SELECT batch_id, COUNT(DISTINCT owner) FROM jobs WHERE state='running' "
+                                "AND batch_id IS NOT NULL GROUP BY batch_id").fetchall())
+        counts[None] = c.execute("SELECT COUNT(DISTINCT owner) FROM jobs WHERE state='running'").fetchone()[0]
+        return counts
+
+    def _update_batch(self, c, batch_id, update=None):
+        row = c.execute("SELECT data FROM batches WHERE batch_id=?", (batch_id,)).fetchone()
+        if row is None:
+            return
+        batch = json.loads(row[0])
+        if update is not None:
+            batch = update(batch)
+        if c.execute("SELECT 1 FROM jobs WHERE batch_id=? LIMIT 1", (batch_id,)).fetchone() is None:
+            batch["finished_at"] = time.time()
+        c.execute("UPDATE batches SET data=?, finished_at=?, updated_at=? WHERE batch_id=?",
+                  (json.dumps(batch), batch.get("finished_at"), time.time(), batch_id))
+
+    def _requeue(self, c, where, args):
+        now = time.time()
+        rows = c.execute("SELECT id, upload_id, batch_id, attempts FROM jobs WHERE state='running' AND "
+                         + where, args).fetchall()
+        for job_id, uid, batch_id, attempts in rows:
+            row = c.execute("SELECT data FROM status WHERE upload_id=?", (uid,)).fetchone()
+            rec = json.loads(row[0]) if row else {}
+            if attempts >= JOB_MAX_ATTEMPTS:
+                c.execute("DELETE FROM jobs WHERE id=?", (job_id,))
+                rec.update(status="error", message="Worker process exited", finished_at=now)
+            else:
+                c.execute("UPDATE jobs SET state='queued', owner=NULL, heartbeat_at=NULL WHERE id=?",
+                          (job_id,))
+                rec.update(status="queued", message="Requeued after worker exit", bytes_sent=0,
+                           finished_at=None)
+            c.execute("INSERT OR REPLACE INTO status VALUES (?,?,?,?,?,?)",
+                      (uid, batch_id, QUEUE_OWNER, json.dumps(rec), rec["finished_at"], now))
+            if batch_id:
+                self._update_batch(c, batch_id)
+
+    def claim(self, key):
+        """Take a dedupe key for this process; False while another process holds a live lease on it."""
+        now = time.time()
+        with self._conn() as c:
+            key = json.dumps(key)
+            c.execute("DELETE FROM claims WHERE key=? AND claimed_at<?", (key, now - CLAIM_LEASE_SECONDS))
+            cur = c.execute("INSERT OR IGNORE INTO claims VALUES (?,?,?)", (key, self.owner, now))
+            return cur.rowcount == 1
+
+    def release(self, keys):
+        with self._conn() as c:
+            c.executemany("DELETE FROM claims WHERE key=? AND owner=?",
+                          [(json.dumps(k), self.owner) for k in keys])
+
+    def put_profile(self, upload_id, report, keep):
+        """Store the cProfile report of an upload, whichever process ran it; the newest keep stay."""
+        with self._conn() as c:
+            c.execute("INSERT OR REPLACE INTO profiles VALUES (?,?,?)", (upload_id, report, time.time()))
+            c.execute("DELETE FROM profiles WHERE upload_id NOT IN "
+                      "(SELECT upload_id FROM profiles ORDER BY created_at DESC LIMIT ?)", (keep,))
+
+    def get_profile(self, upload_id):
+        row = self._conn().execute("SELECT report FROM profiles WHERE upload_id=?", (upload_id,)).fetchone()
+        return row[0] if row else None
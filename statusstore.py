@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+This process's upload status, compact enough for folder batches with hundreds
+of thousands of files.
+
+Records are slotted objects with the face of the dicts they replace
+(rec["status"], rec.get("attempts", 0), dict(rec)) at a fraction of the
+memory. The store keeps finished records in a heap by finished_at, so
+expiring them costs O(expired * log n) instead of a scan over every record;
+it also tracks which records changed since the status publisher last looked,
+how many are still unfinished and how many are in each status.
+
+Not thread-safe by itself: callers hold upload_lock, as they did for the dict.
+"""
+import collections
+import heapq
+
+FIELDS = ("status", "bytes_sent", "total_bytes", "filename", "message", "started_at", "finished_at",
+          "batch_id", "attempts", "account", "transport", "timings", "throughput", "eta")
+# Always in dict(record); the others only once set, like the optional keys of the old dicts.
+REQUIRED = frozenset(FIELDS[:7])
+_FIELD_SET = frozenset(FIELDS)
+# timings dicts all have the same few key sets: kept as (shared key tuple, value tuple).
+_timing_keys = {}
+
+
+def _pack_timings(timings):
+    if timings is None:
+        return None
+    keys = tuple(timings)
+    return _timing_keys.setdefault(keys, keys), tuple(timings.values())
+
+
+class UploadRecord:
+    __slots__ = FIELDS + ("_store", "_uid")
+
+    def __init__(self, store, uid, data):
+        self._store = store
+        self._uid = uid
+        for name in FIELDS:
+            setattr(self, name, data.get(name))
+        self.timings = _pack_timings(self.timings)
+
+    def _get(self, key):
+        value = getattr(self, key)
+        if key == "timings" and value is not None:
+            return dict(zip(*value))
+        return value
+
+    def __getitem__(self, key):
+        if key not in _FIELD_SET:
+            raise KeyError(key)
+        return self._get(key)
+
+    def __setitem__(self, key, value):
+        if key not in _FIELD_SET:
+            raise KeyError(key)
+        old = getattr(self, key)
+        setattr(self, key, _pack_timings(value) if key == "timings" else value)
+        if self._store is not None:
+            self._store._changed(self, key, old, value)
+
+    def get(self, key, default=None):
+        value = self._get(key) if key in _FIELD_SET else None
+        return default if value is None else value
+
+    def keys(self):
+        return [k for k in FIELDS if k in REQUIRED or getattr(self, k) is not None]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key):
+        return key in _FIELD_SET and (key in REQUIRED or getattr(self, key) is not None)
+
+    def items(self):
+        return [(k, self._get(k)) for k in self.keys()]
+
+    def update(self, other=(), **kwargs):
+        for key, value in dict(other, **kwargs).items():
+            self[key] = value
+
+
+class StatusStore:
+    """
+    upload_id -> UploadRecord; assigning a dict (or record) stores a copy as a record.
+    Changes are only collected for take_dirty() once track_dirty is set.
+    """
+
+    def __init__(self):
+        self._records = {}
+        self._expiry = []  # (finished_at, upload_id); entries for re-finished or dropped records are skipped
+        self._dirty = set()
+        self._unfinished = 0
+        self._by_status = collections.Counter()
+        self.track_dirty = False
+
+    def __setitem__(self, upload_id, data):
+        self.pop(upload_id)
+        rec = UploadRecord(self, upload_id, data)
+        self._records[upload_id] = rec
+        self._by_status[rec.status] += 1
+        if self.track_dirty:
+            self._dirty.add(upload_id)
+        if rec.finished_at is None:
+            self._unfinished += 1
+        else:
+            heapq.heappush(self._expiry, (rec.finished_at, upload_id))
+
+    def __getitem__(self, upload_id):
+        return self._records[upload_id]
+
+    def __contains__(self, upload_id):
+        return upload_id in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def get(self, upload_id, default=None):
+        return self._records.get(upload_id, default)
+
+    def items(self):
+        return self._records.items()
+
+    def values(self):
+        return self._records.values()
+
+    def update(self, records):
+        for upload_id, data in records.items():
+            self[upload_id] = data
+
+    def pop(self, upload_id, default=None):
+        rec = self._records.pop(upload_id, None)
+        if rec is None:
+            return default
+        if rec.finished_at is None:
+            self._unfinished -= 1
+        self._by_status[rec.status] -= 1
+        rec._store = None
+        self._dirty.discard(upload_id)
+        return rec
+
+    def running(self):
+        """True while any record is unfinished (queued or uploading)."""
+        return self._unfinished > 0
+
+    def count(self, status):
+        """Records currently in status, without a scan."""
+        return self._by_status[status]
+
+    def expire(self, cutoff):
+        """Drop records that finished before cutoff; returns how many went."""
+        dropped = 0
+        while self._expiry and self._expiry[0][0] < cutoff:
+            finished_at, upload_id = heapq.heappop(self._expiry)
+            rec = self._records.get(upload_id)
+            if rec is not None and rec.finished_at == finished_at:
+                self.pop(upload_id)
+                dropped += 1
+        return dropped
+
+    def take_dirty(self):
+        """[(upload_id, dict copy)] of records changed since the last call."""
+        out = [(uid, dict(self._records[uid])) for uid in self._dirty if uid in self._records]
+        self._dirty.clear()
+        return out
+
+    def mark_dirty(self, upload_ids):
+        self._dirty.update(uid for uid in upload_ids if uid in self._records)
+
+    def _changed(self, rec, key, old, new):
+        if self.track_dirty:
+            self._dirty.add(rec._uid)
+        if key == "status" and old != new:
+            self._by_status[old] -= 1
+            self._by_status[new] += 1
+        if key != "finished_at" or old == new:
+            return
+        if old is None:
+            self._unfinished -= 1
+        elif new is None:
+            self._unfinished += 1
+        if new is not None:
+            heapq.heappush(self._expiry, (new, rec._uid))
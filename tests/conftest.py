@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""The modules live at the repository root, next to app.py; make them importable."""
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _ModuleTime:
+    """A module's `time` with some functions replaced; the rest is the real module."""
+
+    def __init__(self, funcs):
+        self.__dict__.update(funcs)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+@pytest.fixture
+def patch_time(monkeypatch):
+    """
+    patch_time(module, monotonic=f, ...) fakes the clock for that module only:
+    patching the time module itself would also move it for stray threads
+    (samplers, socket servers) other tests left running.
+    """
+    def patch(module, **funcs):
+        monkeypatch.setattr(module, "time", _ModuleTime(funcs))
+    return patch
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import accounts
+from accounts import AccountPool, parse_accounts
+
+
+class FakeUploader:
+    """ChomikUploader stand-in; usernames in `failing` can't log in."""
+
+    failing = set()
+    created = []
+
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        FakeUploader.created.append(self)
+
+    def login(self):
+        return self.username not in FakeUploader.failing
+
+
+@pytest.fixture(autouse=True)
+def reset_fake():
+    FakeUploader.failing = set()
+    FakeUploader.created = []
+
+
+@pytest.fixture
+def clock(patch_time):
+    now = [1000.0]
+    patch_time(accounts, time=lambda: now[0])
+    return now
+
+
+def _pool(n=3, policy="round_robin"):
+    return AccountPool([("user%d" % i, "pw") for i in range(n)], FakeUploader, policy)
+
+
+def test_parse_accounts():
+    assert parse_accounts("a:1; b:p:w ;") == [("a", "1"), ("b", "p:w")]
+    assert parse_accounts('[{"username": "a", "password": "1"}]') == [("a", "1")]
+    assert parse_accounts("", "solo", "pw") == [("solo", "pw")]
+    assert parse_accounts("", "solo", "") == []
+    with pytest.raises(ValueError, match="nopassword"):
+        parse_accounts("nopassword")
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        _pool(policy="random")
+
+
+def test_round_robin_and_session_reuse():
+    pool = _pool()
+    picked = []
+    for _ in range(6):
+        acc, up = pool.acquire()
+        picked.append(acc.username)
+        pool.release(acc, up)
+    assert picked == ["user0", "user1", "user2"] * 2
+    assert len(FakeUploader.created) == 3  # idle sessions are reused
+
+
+def test_by_folder_is_stable():
+    pool = _pool(policy="by_folder")
+    first = {key: pool.acquire(key)[0].username for key in ("/a", "/b", "/c", "/d")}
+    assert {key: pool.acquire(key)[0].username for key in first} == first
+
+
+def test_least_loaded_follows_bytes_in_flight():
+    pool = _pool(policy="least_loaded")
+    big, _ = pool.acquire(size=100)
+    small, _ = pool.acquire(size=10)
+    third, _ = pool.acquire(size=50)
+    assert len({big.username, small.username, third.username}) == 3
+    assert pool.acquire(size=1)[0] is small
+    snap = {a["username"]: a for a in pool.snapshot()}
+    assert snap[small.username]["inflight_bytes"] == 11
+    assert snap[small.username]["active"] == 2
+
+
+def test_failed_login_falls_through_to_the_next_account(clock):
+    FakeUploader.failing = {"user0"}
+    pool = _pool()
+    acc, _ = pool.acquire()
+    assert acc.username != "user0"
+    bad = pool.accounts[0]
+    assert bad.active == 0 and bad.login_failures == 1
+    assert bad.disabled_until == 1000.0 + accounts.LOGIN_FAIL_BACKOFF
+
+
+def test_all_accounts_failing(clock):
+    FakeUploader.failing = {"user0", "user1"}
+    pool = _pool(2)
+    assert pool.acquire() == (None, None)
+    assert all(a["disabled"] for a in pool.snapshot())
+
+
+def test_single_account_retries_login_with_backoff(clock):
+    FakeUploader.failing = {"user0"}
+    pool = _pool(1)
+    delays = []
+    for _ in range(6):
+        assert pool.acquire() == (None, None)  # tried again every time, never skipped
+        delays.append(pool.accounts[0].disabled_until - clock[0])
+    b = accounts.LOGIN_FAIL_BACKOFF
+    assert delays == [min(accounts.LOGIN_FAIL_COOLDOWN, b * 2 ** i) for i in range(6)]
+    FakeUploader.failing = set()
+    acc, _ = pool.acquire()
+    assert acc.username == "user0" and acc.login_failures == 0
+
+
+def test_disabled_account_is_skipped_while_another_is_ready(clock):
+    FakeUploader.failing = {"user0"}
+    pool = _pool(2)
+    pool.acquire()
+    FakeUploader.failing = set()
+    assert [pool.acquire()[0].username for _ in range(3)] == ["user1"] * 3
+    clock[0] += accounts.LOGIN_FAIL_BACKOFF
+    assert "user0" in {pool.acquire()[0].username for _ in range(2)}
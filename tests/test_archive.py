@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from archive import TAR_RECORD, ArchiveEntry, ZipStream, open_archive
+
+
+def _read_all(reader, bufsize):
+    out = bytearray()
+    buf = bytearray(bufsize)
+    while True:
+        n = reader.readinto(buf)
+        if not n:
+            break
+        out += buf[:n]
+    reader.close()
+    return bytes(out)
+
+
+@pytest.fixture
+def files(tmp_path):
+    contents = {
+        "a.txt": b"hello\n",
+        "empty.bin": b"",
+        "sub/b.bin": os.urandom(70000),
+        "sub/zażółć " + "x" * 120 + ".dat": os.urandom(513),
+    }
+    entries = []
+    for rel, data in contents.items():
+        path = tmp_path / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        entries.append(ArchiveEntry(str(path), rel, len(data), 1700000000))
+    return entries, contents
+
+
+@pytest.mark.parametrize("bufsize", [1, 511, 4096, 1 << 20])
+def test_tar_matches_declared_size_and_reads_back(files, bufsize):
+    entries, contents = files
+    reader = open_archive("tar", entries)
+    data = _read_all(reader, bufsize)
+    assert len(data) == reader.size
+    assert len(data) % TAR_RECORD == 0
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert tar.getnames() == list(contents)
+        for name, body in contents.items():
+            assert tar.extractfile(name).read() == body
+            assert tar.getmember(name).mtime == 1700000000
+
+
+@pytest.mark.parametrize("bufsize", [1, 30, 4096, 1 << 20])
+def test_zip_matches_declared_size_and_reads_back(files, bufsize):
+    entries, contents = files
+    reader = open_archive("zip", entries)
+    data = _read_all(reader, bufsize)
+    assert len(data) == reader.size
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None  # every CRC from the data descriptors checks out
+        assert zf.namelist() == list(contents)
+        for name, body in contents.items():
+            assert zf.read(name) == body
+            assert zf.getinfo(name).compress_type == zipfile.ZIP_STORED
+
+
+@pytest.mark.parametrize("fmt", ["tar", "zip"])
+def test_changed_files_keep_the_stream_size(tmp_path, fmt):
+    shrunk, grown, gone = tmp_path / "shrunk", tmp_path / "grown", tmp_path / "gone"
+    shrunk.write_bytes(b"abc")
+    grown.write_bytes(b"0123456789")
+    entries = [ArchiveEntry(str(shrunk), "shrunk", 8, 0), ArchiveEntry(str(grown), "grown", 4, 0),
+               ArchiveEntry(str(gone), "gone", 5, 0)]
+    reader = open_archive(fmt, entries)
+    data = _read_all(reader, 4096)
+    assert len(data) == reader.size
+    assert reader.changed == [str(shrunk), str(grown), str(gone)]
+    if fmt == "tar":
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            assert tar.extractfile("shrunk").read() == b"abc" + bytes(5)
+            assert tar.extractfile("grown").read() == b"0123"
+            assert tar.extractfile("gone").read() == bytes(5)
+    else:
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            assert zf.testzip() is None
+            assert zf.read("shrunk") == b"abc" + bytes(5)
+            assert zf.read("grown") == b"0123"
+
+
+def test_opener_is_used_for_every_entry(files):
+    entries, _ = files
+    opened = []
+
+    def opener(path):
+        opened.append(path)
+        return open(path, "rb")
+
+    _read_all(open_archive("tar", entries, opener), 4096)
+    assert opened == [e.path for e in entries]
+
+
+def test_zip_refuses_what_needs_zip64(tmp_path):
+    entry = ArchiveEntry(str(tmp_path / "huge"), "huge", 5 * 1024 ** 3, 0)
+    with pytest.raises(ValueError, match="ZIP64"):
+        ZipStream([entry])
+
+
+def test_backslashes_become_slashes():
+    assert ArchiveEntry("/x", "dir\\file", 0, 0).arcname == "dir/file"
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError, match="Unknown archive format"):
+        open_archive("rar", [])
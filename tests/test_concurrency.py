@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+import concurrency
+from concurrency import AdaptiveConcurrency
+
+
+@pytest.fixture
+def clock(patch_time):
+    now = [100.0]
+    patch_time(concurrency, monotonic=lambda: now[0])
+    return now
+
+
+def _window(ctl, clock, nbytes):
+    """Send nbytes during one full window with every slot busy."""
+    held = ctl.limit
+    for _ in range(held):
+        ctl.acquire()
+    clock[0] += ctl.window
+    ctl.add_bytes(nbytes)
+    for _ in range(held):
+        ctl.release()
+
+
+def test_limit_is_clamped():
+    assert AdaptiveConcurrency(initial=20, maximum=4).limit == 4
+    assert AdaptiveConcurrency(initial=0, minimum=2).limit == 2
+    ctl = AdaptiveConcurrency(minimum=5, maximum=3)
+    assert ctl.maximum == ctl.minimum == 5
+
+
+def test_grows_while_throughput_improves(clock):
+    ctl = AdaptiveConcurrency(initial=2, maximum=4)
+    _window(ctl, clock, 1000)
+    assert ctl.limit == 3
+    _window(ctl, clock, 2000)
+    assert ctl.limit == 4
+    _window(ctl, clock, 4000)
+    assert ctl.limit == 4  # maximum
+
+
+def test_does_not_grow_when_not_saturated(clock):
+    ctl = AdaptiveConcurrency(initial=3, maximum=6)
+    ctl.acquire()  # one of three slots busy
+    clock[0] += ctl.window
+    ctl.add_bytes(10 ** 6)
+    ctl.release()
+    assert ctl.limit == 3
+
+
+def test_takes_back_a_worker_that_made_it_slower(clock):
+    ctl = AdaptiveConcurrency(initial=2, maximum=8)
+    _window(ctl, clock, 1000)
+    assert ctl.limit == 3
+    _window(ctl, clock, 800)  # below REGRESS_RATIO of the previous window
+    assert ctl.limit == 2
+
+
+def test_flat_throughput_holds_the_limit(clock):
+    ctl = AdaptiveConcurrency(initial=2, maximum=8)
+    _window(ctl, clock, 1000)
+    _window(ctl, clock, 1010)  # under IMPROVE_RATIO, over REGRESS_RATIO
+    assert ctl.limit == 3
+    assert ctl.throughput == pytest.approx(1010 / ctl.window)
+
+
+def test_record_error_halves_once(clock):
+    ctl = AdaptiveConcurrency(initial=7, maximum=8)
+    ctl.record_error()
+    assert ctl.limit == 4
+    ctl.record_error()
+    assert ctl.limit == 2
+    ctl.record_error()
+    ctl.record_error()
+    assert ctl.limit == 1  # minimum
+
+
+def test_error_window_is_not_halved_again_at_window_end(clock):
+    ctl = AdaptiveConcurrency(initial=8, maximum=8)
+    ctl.acquire()
+    ctl.record_error()
+    clock[0] += ctl.window
+    ctl.add_bytes(0)
+    ctl.release()
+    assert ctl.limit == 4
+
+
+def test_acquire_blocks_at_the_limit():
+    ctl = AdaptiveConcurrency(initial=1, maximum=1)
+    ctl.acquire()
+    entered = threading.Event()
+
+    def second():
+        ctl.acquire()
+        entered.set()
+        ctl.release()
+
+    t = threading.Thread(target=second, daemon=True)
+    t.start()
+    assert not entered.wait(0.1)
+    ctl.release()
+    assert entered.wait(2)
+    t.join(2)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import hashlib
+import os
+import sqlite3
+
+import pytest
+
+import history
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / "data" / "history.db")
+    monkeypatch.setattr(history, "HISTORY_DB", path)
+    monkeypatch.setattr(history, "CHECKSUM_XATTR", False)
+    history.init()
+    return path
+
+
+def _file(tmp_path, name, data):
+    path = tmp_path / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    st = os.stat(str(path))
+    return str(path), st.st_size, st.st_mtime
+
+
+def test_record_and_lookups(db, tmp_path):
+    path, size, mtime = _file(tmp_path, "a.bin", b"abc")
+    assert not history.any_uploaded(path, size, mtime)
+    history.record(path, "a.bin", "/dest", size, mtime, "sum-a", volumes=3, account="u1")
+    history.record(path, "a.bin", "/dest", size, mtime, "sum-a")  # duplicate: ignored
+    assert history.is_uploaded(path, "/dest", size, mtime)
+    assert not history.is_uploaded(path, "/other", size, mtime)
+    assert history.any_uploaded(path, size, mtime)
+    assert not history.any_uploaded(path, size + 1, mtime)
+    assert history.checksum_uploaded("sum-a")
+    assert not history.checksum_uploaded("sum-b") and not history.checksum_uploaded(None)
+    with sqlite3.connect(db) as c:
+        rows = c.execute("SELECT volumes, account, inode FROM uploads").fetchall()
+    assert rows == [(3, "u1", os.stat(path).st_ino)]
+
+
+def test_record_many(db, tmp_path):
+    rows = [_file(tmp_path, n, n.encode()) for n in ("x", "y")]
+    history.record_many([(p, os.path.basename(p), "/d", s, m, None) for p, s, m in rows], account="u2")
+    assert all(history.is_uploaded(p, "/d", s, m) for p, s, m in rows)
+
+
+def test_file_checksum_is_cached(db, tmp_path):
+    data = os.urandom(200000)
+    path, size, mtime = _file(tmp_path, "f.bin", data)
+    read = []
+    assert history.file_checksum(path, size, mtime, read.append) == hashlib.sha256(data).hexdigest()
+    assert sum(read) == size
+    read.clear()
+    assert history.file_checksum(path, size, mtime, read.append) == hashlib.sha256(data).hexdigest()
+    assert read == []  # served from file_hashes
+
+
+def test_moved_file_reuses_its_hash(db, tmp_path):
+    path, size, mtime = _file(tmp_path, "old/f.bin", b"payload")
+    first = history.file_checksum(path, size, mtime)
+    new_path = str(tmp_path / "new.bin")
+    os.rename(path, new_path)
+    read = []
+    assert history.file_checksum(new_path, size, mtime, read.append) == first
+    assert read == []
+
+
+def test_file_checksum_takes_a_device_slot(db, tmp_path):
+    path, size, mtime = _file(tmp_path, "f.bin", b"data")
+    devs = []
+
+    class Scheduler:
+        def slot(self, dev):
+            devs.append(dev)
+            return contextlib.nullcontext()
+
+    history.file_checksum(path, size, mtime, scheduler=Scheduler())
+    assert devs == [os.stat(path).st_dev]
+
+
+def test_unreadable_file_has_no_checksum(db, tmp_path):
+    assert history.file_checksum(str(tmp_path / "missing"), 1, 1.0) is None
+
+
+def test_relink_follows_moves_and_backfills_legacy_rows(db, tmp_path):
+    root = tmp_path / "browse"
+    moved, size, mtime = _file(root, "dir/a.bin", b"aaa")
+    legacy, lsize, lmtime = _file(root, "b.bin", b"bbb")
+    history.record(moved, "a.bin", "/d", size, mtime, "sum-a")
+    history.file_checksum(moved, size, mtime)
+    with sqlite3.connect(db) as c:
+        c.execute("INSERT INTO uploads (abs_path, filename, dest_path, size, mtime, finished_at) "
+                  "VALUES (?,?,?,?,?,?)", (legacy, "b.bin", "/d", lsize, lmtime, 0))
+    os.rename(str(root / "dir"), str(root / "renamed"))
+    new_path = str(root / "renamed" / "a.bin")
+    result = history.relink(str(root))
+    assert result == {"scanned": 2, "uploads": 1, "hashes": 1, "backfilled": 1}
+    assert history.is_uploaded(new_path, "/d", size, mtime)
+    assert not history.is_uploaded(moved, "/d", size, mtime)
+
+
+def test_init_migrates_an_old_schema(tmp_path, monkeypatch):
+    path = str(tmp_path / "old.db")
+    with sqlite3.connect(path) as c:
+        c.execute("""CREATE TABLE uploads(id INTEGER PRIMARY KEY AUTOINCREMENT, abs_path TEXT NOT NULL,
+                     filename TEXT NOT NULL, dest_path TEXT NOT NULL, size INTEGER NOT NULL,
+                     mtime REAL NOT NULL, finished_at REAL NOT NULL,
+                     UNIQUE(abs_path, dest_path, size, mtime))""")
+        c.execute("INSERT INTO uploads (abs_path, filename, dest_path, size, mtime, finished_at) "
+                  "VALUES ('/p', 'p', '/d', 1, 1.0, 0)")
+    monkeypatch.setattr(history, "HISTORY_DB", path)
+    history.init()
+    history.init()  # idempotent
+    with sqlite3.connect(path) as c:
+        cols = {r[1] for r in c.execute("PRAGMA table_info(uploads)")}
+    assert {"checksum", "volumes", "account", "dev", "inode"} <= cols
+    assert history.is_uploaded("/p", "/d", 1, 1.0)
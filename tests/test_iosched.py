@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+import pytest
+
+import iosched
+from iosched import DeviceScheduler, locality_order
+
+
+def test_locality_order_interleaves_devices_in_inode_order():
+    files = [
+        {"name": "a3", "dev": 1, "inode": 30}, {"name": "b2", "dev": 2, "inode": 20},
+        {"name": "x", "dev": None}, {"name": "a1", "dev": 1, "inode": 10},
+        {"name": "b1", "dev": 2, "inode": 5}, {"name": "a2", "dev": 1, "inode": 20},
+        {"name": "y"},
+    ]
+    assert [f["name"] for f in locality_order(files)] == ["a1", "b1", "a2", "b2", "a3", "x", "y"]
+    assert locality_order([]) == []
+
+
+@pytest.fixture
+def rotational(monkeypatch):
+    kinds = {}
+    monkeypatch.setattr(iosched, "is_rotational", lambda dev: kinds.get(dev))
+    return kinds
+
+
+def test_limits_follow_the_device_type(rotational):
+    rotational.update({1: True, 2: False})
+    sched = DeviceScheduler(hdd=1, ssd=4, unknown=2)
+    for dev in (1, 2, 3):
+        with sched.slot(dev):
+            pass
+    limits = {d["dev"]: (d["rotational"], d["limit"]) for d in sched.snapshot()}
+    assert limits == {"0:1": (True, 1), "0:2": (False, 4), "0:3": (None, 2)}
+
+
+def test_slot_blocks_past_the_limit(rotational):
+    rotational[1] = True
+    sched = DeviceScheduler(hdd=1)
+    entered = threading.Event()
+
+    def reader():
+        with sched.slot(1):
+            entered.set()
+
+    with sched.slot(1):
+        t = threading.Thread(target=reader, daemon=True)
+        t.start()
+        assert not entered.wait(0.1)
+        assert sched.snapshot()[0]["waiting"] == 1
+    assert entered.wait(2)
+    t.join(2)
+    assert sched.snapshot()[0]["active"] == 0
+
+
+def test_slot_without_device_is_unlimited():
+    sched = DeviceScheduler(hdd=0, ssd=0, unknown=0)
+    with sched.slot(None), sched.slot(None):
+        pass
+    assert sched.snapshot() == []
+
+
+def test_open_takes_a_slot_per_read(tmp_path, monkeypatch):
+    path = tmp_path / "data"
+    path.write_bytes(b"0123456789")
+    sched = DeviceScheduler()
+    devs = []
+    slot = sched.slot
+    monkeypatch.setattr(sched, "slot", lambda dev: devs.append(dev) or slot(dev))
+    with sched.open(str(path)) as f:
+        f.seek(2)
+        buf = bytearray(4)
+        assert f.readinto(buf) == 4 and bytes(buf) == b"2345"
+        assert f.read() == b"6789"
+        assert f.fileno() >= 0
+    assert devs == [os.stat(str(path)).st_dev] * 2
+
+
+def test_is_rotational_unknown_device():
+    assert iosched.is_rotational(os.makedev(4095, 4095)) is None
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import math
+import threading
+
+import pytest
+
+import progress
+from progress import ProgressSampler
+
+
+@pytest.fixture
+def clock(patch_time):
+    now = [50.0]
+    patch_time(progress, monotonic=lambda: now[0])
+    return now
+
+
+def test_first_report_is_only_a_baseline():
+    sampler = ProgressSampler(lambda samples: None)
+    bytes_seen = []
+    p = sampler.register("k", on_bytes=bytes_seen.append)
+    p.update(1000, 10000)
+    sampler._sample(p, 10.0)
+    assert p.rate is None
+    assert bytes_seen == [1000]
+    p.update(3000, 10000)
+    sampler._sample(p, 11.0)
+    assert p.rate == pytest.approx(2000.0)
+    assert bytes_seen == [1000, 2000]
+
+
+def test_rate_is_an_exponential_average():
+    sampler = ProgressSampler(lambda samples: None, ema_seconds=5.0)
+    p = sampler.register("k")
+    p.update(0, 10 ** 9)
+    sampler._sample(p, 0.0)
+    p.update(1000, 10 ** 9)
+    sampler._sample(p, 1.0)  # 1000 B/s
+    p.update(4000, 10 ** 9)
+    sampler._sample(p, 2.0)  # 3000 B/s now
+    alpha = 1 - math.exp(-1 / 5.0)
+    assert p.rate == pytest.approx(1000 + alpha * 2000)
+
+
+def test_retry_from_zero_counts_only_the_new_bytes():
+    sampler = ProgressSampler(lambda samples: None)
+    counted = []
+    p = sampler.register("k", on_bytes=counted.append)
+    p.update(0, 100)
+    sampler._sample(p, 0.0)
+    p.update(80, 100)
+    sampler._sample(p, 1.0)
+    p.update(30, 100)  # the upload restarted and has resent 30 bytes
+    sampler._sample(p, 2.0)
+    assert counted == [80, 30]
+
+
+def test_no_bytes_no_callback():
+    sampler = ProgressSampler(lambda samples: None)
+    counted = []
+    p = sampler.register("k", on_bytes=counted.append)
+    p.update(0, 100)
+    sampler._sample(p, 0.0)
+    sampler._sample(p, 1.0)
+    assert counted == []
+    assert p.rate == 0.0
+
+
+def test_unregister_publishes_the_last_bytes_without_eta(clock):
+    published = []
+    sampler = ProgressSampler(published.extend)
+    p = sampler.register("k")
+    p.update(0, 100)
+    sampler._sample(p, clock[0])
+    p.update(100, 100)
+    clock[0] += 2
+    sampler.unregister("k")
+    assert published == [("k", 100, pytest.approx(50.0), None)]
+    sampler.unregister("k")  # already gone
+    sampler.register("silent")
+    sampler.unregister("silent")  # never reported
+    assert len(published) == 1
+
+
+def test_sampler_thread_publishes_rate_and_eta():
+    batches = []
+    ready = threading.Event()
+
+    def publish(samples):
+        batches.append(samples)
+        if len(batches) >= 3:
+            ready.set()
+
+    sampler = ProgressSampler(publish, interval=0.01)
+    p = sampler.register("k")
+    sampler.register("not-started")  # no update() yet: not published
+    p.update(0, 10 ** 6)
+    sampler.start()
+    sent = 0
+    while not ready.wait(0.005):
+        sent += 1000
+        p.update(sent, 10 ** 6)
+    _, _, rate, eta = batches[-1][0]
+    assert [s[0] for s in batches[-1]] == ["k"]
+    assert rate > 0 and (eta is None or eta > 0)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+import chomik
+import retry
+from retry import RetryPolicy
+
+
+def _policy(**kwargs):
+    slept = []
+    return RetryPolicy(sleep=slept.append, **kwargs), slept
+
+
+def test_stops_at_first_non_transient_result():
+    policy, slept = _policy(max_attempts=5)
+    results = iter(["busy", "busy", "done", "busy"])
+    assert policy.call(lambda: next(results), lambda r: r == "busy") == ("done", 3)
+    assert len(slept) == 2
+
+
+def test_gives_up_after_max_attempts():
+    policy, slept = _policy(max_attempts=3)
+    seen = []
+    result = policy.call(lambda: "busy", lambda r: True, lambda attempt, r: seen.append(attempt))
+    assert result == ("busy", 3)
+    assert seen == [1, 2]  # no on_retry after the last attempt
+    assert len(slept) == 2
+
+
+def test_on_retry_errors_do_not_stop_retrying():
+    policy, _ = _policy(max_attempts=2)
+    results = iter([False, True])
+
+    def boom(attempt, result):
+        raise RuntimeError("callback bug")
+
+    assert policy.call(lambda: next(results), lambda r: not r, boom) == (True, 2)
+
+
+def test_at_least_one_attempt():
+    policy, _ = _policy(max_attempts=0)
+    assert policy.max_attempts == 1
+    assert policy.call(lambda: "x", lambda r: True) == ("x", 1)
+
+
+def test_backoff_is_capped_full_jitter(monkeypatch):
+    monkeypatch.setattr(retry.random, "uniform", lambda lo, hi: (lo, hi))
+    policy = RetryPolicy(base_delay=0.5, max_delay=3)
+    assert [policy.backoff(a) for a in (1, 2, 3, 4, 5)] == [
+        (0, 0.5), (0, 1.0), (0, 2.0), (0, 3.0), (0, 3.0),
+    ]
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.setenv("X_RETRY_ATTEMPTS", "7")
+    monkeypatch.setenv("X_RETRY_MAX_DELAY", "2.5")
+    monkeypatch.setenv("X_RETRY_BASE_DELAY", "")
+    policy = RetryPolicy.from_env("X_RETRY", max_attempts=3, base_delay=0.25)
+    assert (policy.max_attempts, policy.base_delay, policy.max_delay) == (7, 0.25, 2.5)
+
+
+def test_from_env_rejects_garbage(monkeypatch):
+    monkeypatch.setenv("X_RETRY_ATTEMPTS", "many")
+    with pytest.raises(ValueError):
+        RetryPolicy.from_env("X_RETRY")
+
+
+class _Sink:
+    """Upload server stand-in: reads the whole body then goes silent, or resets mid-body."""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen()
+        self.connections = 0
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            conn, _ = self.sock.accept()
+            self.connections += 1
+            if self.mode == "silent":
+                data = b""
+                while not data.endswith(b"--\r\n\r\n"):
+                    chunk = conn.recv(65536)
+                    if not chunk:
+                        break
+                    data = data[-16:] + chunk
+                time.sleep(1)
+            else:
+                conn.recv(100)
+                conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            conn.close()
+
+
+def _uploader(port):
+    up = chomik.ChomikUploader("user", "pass")
+    up.login = lambda: True
+    up.chdir = lambda path: True
+    up._soap_post = lambda xml, action: (
+        "<a:status>Ok</a:status><a:key>k</a:key><a:stamp>1</a:stamp>"
+        "<a:server>127.0.0.1:%d</a:server>" % port)
+    return up
+
+
+def test_no_answer_after_full_send_is_not_retried(monkeypatch):
+    monkeypatch.setattr(chomik, "UPLOAD_SOCK_TIMEOUT", 0.3)
+    sink = _Sink("silent")
+    up = _uploader(sink.sock.getsockname()[1])
+    ok, err = up.upload_stream(b"x" * 200000, 200000, "f.bin", "/", retry_policy=_policy(max_attempts=3)[0])
+    assert not ok and "not retried" in err
+    assert up.last_attempts == 1 and sink.connections == 1
+
+
+def test_reset_mid_body_is_retried():
+    sink = _Sink("reset")
+    up = _uploader(sink.sock.getsockname()[1])
+    ok, err = up.upload_stream(b"x" * 4000000, 4000000, "f.bin", "/", retry_policy=_policy(max_attempts=3)[0])
+    assert not ok
+    assert up.last_attempts == 3
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+import subprocess
+import sys
+
+import pytest
+
+import statusdb
+from statusdb import CLAIM_LEASE_SECONDS, SharedStatus, _owner_alive
+
+
+@pytest.fixture
+def clock(patch_time):
+    now = [1000000.0]
+    patch_time(statusdb, time=lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def db(tmp_path, clock):
+    return str(tmp_path / "status.db")
+
+
+def _peer(path, host="otherhost"):
+    """A SharedStatus posing as a process on another machine (always presumed alive)."""
+    peer = SharedStatus(path)
+    peer.owner = "%s:4242:cafe" % host
+    return peer
+
+
+def _rec(status="uploading", finished_at=None, **kw):
+    return dict(status=status, finished_at=finished_at, **kw)
+
+
+def test_publish_get_and_active(db, clock):
+    s = SharedStatus(db)
+    s.publish([("u1", _rec()), ("u2", _rec("success", clock[0]))], [("b1", {"finished_at": None})])
+    assert s.get("u2")["status"] == "success"
+    assert s.get("missing") is None
+    uploads, batches = s.active()
+    assert [uid for uid, _ in uploads] == ["u1"]  # finished rows are not read
+    assert batches == [("b1", {"finished_at": None})]
+    assert s.any_running()
+
+
+def test_sweep_drops_old_finished_rows(db, clock):
+    s = SharedStatus(db)
+    s.publish([("old", _rec("success", clock[0] - 700)), ("new", _rec("success", clock[0] - 10)),
+               ("live", _rec())])
+    s.sweep(600)
+    assert s.get("old") is None
+    assert s.get("new") is not None and s.get("live") is not None
+
+
+def test_claims_are_exclusive_until_released(db):
+    a, b = SharedStatus(db), _peer(db)
+    assert a.claim(["sha", "abc"])
+    assert not b.claim(["sha", "abc"])
+    assert b.claim(["sha", "def"])
+    a.release([["sha", "abc"]])
+    assert b.claim(["sha", "abc"])
+
+
+def test_claim_lease_expires_unless_renewed(db, clock):
+    a, b = SharedStatus(db), _peer(db)
+    assert a.claim("k1") and a.claim("k2")
+    clock[0] += CLAIM_LEASE_SECONDS - 1
+    a.heartbeat()  # renews k1 and k2
+    clock[0] += CLAIM_LEASE_SECONDS - 1
+    assert not b.claim("k1")
+    clock[0] += 2
+    assert b.claim("k1")  # a stopped heartbeating: the lease is taken over
+    b.sweep(600)
+    assert b.claim("k2")
+
+
+def test_restarted_process_with_the_same_pid_is_dead(db, clock):
+    before = SharedStatus(db)  # same host and PID, another nonce: the process before a restart
+    before.publish([("u1", _rec())], [("b1", {"finished_at": None})])
+    assert before.claim("k")
+    now = SharedStatus(db)
+    assert before.owner != now.owner
+    now.sweep(600)
+    assert now.get("u1")["status"] == "error"
+    assert now.active() == ([], [])
+    assert now.claim("k")
+
+
+def test_rows_of_a_live_peer_are_left_alone(db, clock):
+    peer = _peer(db)
+    peer.publish([("u1", _rec())])
+    assert peer.claim("k")
+    me = SharedStatus(db)
+    me.sweep(600)
+    assert me.get("u1")["status"] == "uploading"
+    assert not me.claim("k")
+
+
+def test_owner_alive():
+    me = statusdb.socket.gethostname() + ":%d:aaaa" % statusdb.os.getpid()
+    assert _owner_alive(statusdb.QUEUE_OWNER, me)
+    assert _owner_alive("elsewhere:1:x", me)
+    assert _owner_alive(me, me)
+    assert not _owner_alive(me[:-4] + "bbbb", me)
+    child = subprocess.Popen([sys.executable, "-c", "pass"])
+    child.wait()
+    assert not _owner_alive("%s:%d:x" % (statusdb.socket.gethostname(), child.pid), me)
+
+
+def _job(uid, batch_id=None, **payload):
+    return uid, "file", dict(payload, batch_id=batch_id), {"status": "queued", "batch_id": batch_id,
+                                                           "finished_at": None}
+
+
+def test_jobs_are_claimed_oldest_first_and_once(db):
+    s, peer = SharedStatus(db), _peer(db)
+    s.enqueue([_job("u1", path="/a"), _job("u2", path="/b")])
+    assert s.job_counts() == {"queued": 2, "running": 0}
+    job_id, uid, kind, payload, record = s.claim_job()
+    assert (uid, kind, payload["path"], record["status"]) == ("u1", "file", "/a", "queued")
+    assert peer.claim_job()[1] == "u2"
+    assert s.claim_job() is None
+    assert s.job_counts() == {"queued": 0, "running": 2}
+
+
+def test_finish_job_folds_into_the_batch_and_closes_it(db):
+    s = SharedStatus(db)
+    s.enqueue([_job("u1", "b1"), _job("u2", "b1")], ("b1", {"files": 2, "finished_at": None}))
+
+    def add(batch):
+        return dict(batch, done=batch.get("done", 0) + 1)
+
+    for _ in range(2):
+        job_id, uid, _, _, rec = s.claim_job()
+        assert s.active()[1][0][1]["finished_at"] is None
+        assert s.finish_job(job_id, uid, dict(rec, status="success", finished_at=1.0), add)
+    assert s.active()[1] == []  # closed once its last job finished
+    assert s.get("u2")["status"] == "success"
+    assert s.job_counts() == {"queued": 0, "running": 0}
+
+
+def test_expired_job_lease_is_requeued_then_failed(db, clock):
+    worker, sweeper = _peer(db, "worker"), SharedStatus(db)
+    worker.enqueue([_job("u1")])
+    for attempt in range(1, statusdb.JOB_MAX_ATTEMPTS + 1):
+        job_id, uid, _, _, _ = worker.claim_job()
+        clock[0] += statusdb.JOB_LEASE_SECONDS - 1
+        worker.heartbeat()
+        sweeper.sweep(600)
+        assert worker.job_counts()["running"] == 1  # the heartbeat kept it
+        clock[0] += statusdb.JOB_LEASE_SECONDS + 1
+        sweeper.sweep(600)
+        if attempt < statusdb.JOB_MAX_ATTEMPTS:
+            assert sweeper.get("u1")["status"] == "queued"
+            assert sweeper.job_counts() == {"queued": 1, "running": 0}
+    assert sweeper.get("u1")["status"] == "error"
+    assert sweeper.job_counts() == {"queued": 0, "running": 0}
+    assert not worker.finish_job(job_id, uid, {"status": "success", "finished_at": 1.0})
+
+
+def test_jobs_of_a_restarted_worker_go_back_to_the_queue(db):
+    before = SharedStatus(db)
+    before.enqueue([_job("u1")])
+    before.claim_job()
+    now = SharedStatus(db)
+    now.sweep(600)
+    assert now.get("u1")["message"] == "Requeued after worker exit"
+    assert now.claim_job()[1] == "u1"
+
+
+def test_running_owners(db):
+    a, b = _peer(db, "a"), _peer(db, "b")
+    a.enqueue([_job("u1", "b1"), _job("u2", "b1"), _job("u3", "b2"), _job("u4")])
+    a.claim_job()
+    b.claim_job()
+    a.claim_job()
+    assert a.running_owners() == {"b1": 2, "b2": 1, None: 2}
+
+
+def test_profiles_keep_the_newest(db, clock):
+    s = SharedStatus(db)
+    for i in range(5):
+        clock[0] += 1
+        s.put_profile("u%d" % i, "report %d" % i, keep=3)
+    assert s.get_profile("u4") == "report 4"
+    assert s.get_profile("u1") is None
+    assert [s.get_profile("u%d" % i) is not None for i in range(5)] == [False, False, True, True, True]
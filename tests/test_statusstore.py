@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from statusstore import StatusStore
+
+
+def _rec(status="queued", finished_at=None, **kw):
+    base = dict(status=status, bytes_sent=0, total_bytes=10, filename="f", message="",
+                started_at=1.0, finished_at=finished_at)
+    base.update(kw)
+    return base
+
+
+def test_records_behave_like_the_dicts_they_replace():
+    store = StatusStore()
+    store["u"] = _rec(batch_id="b", timings={"send": 1.5, "ack": 0.1})
+    rec = store["u"]
+    assert rec["status"] == "queued"
+    assert rec.get("attempts", 0) == 0
+    assert rec.get("nope", "dflt") == "dflt"
+    assert "batch_id" in rec and "account" not in rec
+    assert dict(rec) == _rec(batch_id="b", timings={"send": 1.5, "ack": 0.1})
+    rec.update({"attempts": 2}, message="Retrying")
+    assert (rec["attempts"], rec["message"]) == (2, "Retrying")
+    with pytest.raises(KeyError):
+        rec["nope"]
+    with pytest.raises(KeyError):
+        rec["nope"] = 1
+
+
+def test_timings_key_tuples_are_shared():
+    store = StatusStore()
+    store["a"] = _rec(timings={"send": 1.0, "ack": 2.0})
+    store["b"] = _rec(timings={"send": 3.0, "ack": 4.0})
+    assert store["a"].timings[0] is store["b"].timings[0]
+    assert store["b"]["timings"] == {"send": 3.0, "ack": 4.0}
+
+
+def test_unfinished_and_status_counts_follow_changes():
+    store = StatusStore()
+    store["a"] = _rec()
+    store["b"] = _rec()
+    assert store.running() and store.count("queued") == 2
+    store["a"]["status"] = "uploading"
+    assert (store.count("queued"), store.count("uploading")) == (1, 1)
+    store["a"].update(status="success", finished_at=5.0)
+    store["b"].update(status="error", finished_at=6.0)
+    assert not store.running()
+    assert store.count("uploading") == 0 and store.count("success") == 1
+    store["b"]["finished_at"] = None  # back in play (requeued)
+    assert store.running()
+    store.pop("b")
+    assert not store.running() and store.count("error") == 0
+    store["a"] = _rec()  # replacing a record recounts it
+    assert store.count("success") == 0 and store.count("queued") == 1 and store.running()
+
+
+def test_expire_drops_only_what_finished_before_the_cutoff():
+    store = StatusStore()
+    for i in range(6):
+        store["u%d" % i] = _rec("success", finished_at=float(i))
+    store["live"] = _rec()
+    assert store.expire(3.0) == 3
+    assert sorted(store) == ["live", "u3", "u4", "u5"]
+    assert store.expire(3.0) == 0
+
+
+def test_expire_skips_stale_heap_entries():
+    store = StatusStore()
+    store["a"] = _rec("success", finished_at=1.0)
+    store["a"]["finished_at"] = 10.0  # finished again later: the old entry must not drop it
+    store["b"] = _rec("success", finished_at=2.0)
+    store["b"] = _rec()  # replaced by an unfinished record
+    store["c"] = _rec("success", finished_at=3.0)
+    store.pop("c")
+    assert store.expire(5.0) == 0
+    assert sorted(store) == ["a", "b"]
+    assert store.expire(11.0) == 1 and "a" not in store
+
+
+def test_dirty_tracking():
+    store = StatusStore()
+    store["quiet"] = _rec()
+    assert store.take_dirty() == []
+    store.track_dirty = True
+    store["a"] = _rec()
+    store["quiet"]["bytes_sent"] = 5
+    store["gone"] = _rec()
+    store.pop("gone")
+    dirty = dict(store.take_dirty())
+    assert sorted(dirty) == ["a", "quiet"]
+    assert dirty["quiet"]["bytes_sent"] == 5 and isinstance(dirty["quiet"], dict)
+    assert store.take_dirty() == []
+    store.mark_dirty(["a", "unknown"])
+    assert [uid for uid, _ in store.take_dirty()] == ["a"]
+
+
+def test_detached_record_no_longer_touches_the_store():
+    store = StatusStore()
+    store["a"] = _rec()
+    rec = store.pop("a")
+    rec["status"] = "success"
+    assert store.count("success") == 0 and store.count("queued") == 0
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+import throttle
+from throttle import TokenBucket, parse_rate, parse_schedule, parse_size, schedule_rate
+
+MIB = 1024 ** 2
+
+
+class FakeClock:
+    """monotonic() that only moves when sleep() is called (or by hand)."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(patch_time):
+    c = FakeClock()
+    patch_time(throttle, monotonic=c.monotonic, sleep=c.sleep)
+    return c
+
+
+@pytest.mark.parametrize("value, expected", [
+    (None, 0), ("", 0), (0, 0), (2048, 2048), (1.5, 1),
+    ("512K", 512 * 1024), ("10M", 10 * MIB), ("1.5MB/s", int(1.5 * MIB)),
+    ("2g", 2 * 1024 ** 3), (" 7 kib ", 7 * 1024), ("100", 100),
+])
+def test_parse_rate(value, expected):
+    assert parse_rate(value) == expected
+
+
+@pytest.mark.parametrize("value", [True, False, "fast", "10X", "-5M", "1M/h"])
+def test_parse_rate_rejects(value):
+    with pytest.raises(ValueError):
+        parse_rate(value)
+
+
+def test_parse_size_reports_size():
+    assert parse_size("700M") == 700 * MIB
+    with pytest.raises(ValueError, match="Invalid size"):
+        parse_size("big")
+
+
+def test_parse_schedule():
+    assert parse_schedule("08:00-18:00=2M; 22:00-06:00=0, 18:00-22:00=512K") == [
+        (8 * 60, 18 * 60, 2 * MIB), (22 * 60, 6 * 60, 0), (18 * 60, 22 * 60, 512 * 1024),
+    ]
+    assert parse_schedule("") == []
+    assert parse_schedule("00:00-24:00=1M") == [(0, 24 * 60, MIB)]
+
+
+@pytest.mark.parametrize("spec", ["08:00=1M", "8-18=1M", "24:59-01:00=1M", "10:60-11:00=1M",
+                                  "08:00-18:00=lots"])
+def test_parse_schedule_rejects(spec):
+    with pytest.raises(ValueError, match="Invalid schedule entry"):
+        parse_schedule(spec)
+
+
+def _at(hour, minute):
+    return time.mktime((2026, 1, 15, hour, minute, 0, 0, 0, -1))
+
+
+def test_schedule_rate_windows_and_midnight_wrap():
+    windows = parse_schedule("08:00-18:00=2M;22:00-06:00=1M")
+    assert schedule_rate(windows, 5, _at(12, 0)) == 2 * MIB
+    assert schedule_rate(windows, 5, _at(18, 0)) == 5  # end is exclusive
+    assert schedule_rate(windows, 5, _at(23, 30)) == MIB
+    assert schedule_rate(windows, 5, _at(3, 0)) == MIB
+    assert schedule_rate(windows, 5, _at(6, 0)) == 5
+    assert schedule_rate([], 5, _at(12, 0)) == 5
+
+
+def test_unlimited_bucket_never_sleeps(clock):
+    bucket = TokenBucket(0)
+    for _ in range(100):
+        bucket.consume(10 * MIB)
+    assert clock.slept == []
+
+
+def test_consume_sleeps_off_the_debt(clock):
+    bucket = TokenBucket(MIB)
+    bucket.consume(MIB)
+    assert clock.slept == [pytest.approx(1.0)]
+    # Back-to-back chunks keep the aggregate at the cap.
+    for _ in range(4):
+        bucket.consume(MIB // 2)
+    assert sum(clock.slept) == pytest.approx(3.0)
+
+
+def test_idle_credit_is_capped_at_the_burst(clock):
+    bucket = TokenBucket(MIB)
+    clock.now += 60  # a minute idle banks only BURST_SECONDS worth of tokens
+    bucket.consume(int(MIB * throttle.BURST_SECONDS))
+    assert clock.slept == []
+    bucket.consume(MIB)
+    assert clock.slept == [pytest.approx(1.0)]
+
+
+def test_set_share_splits_the_cap(clock):
+    bucket = TokenBucket(MIB)
+    bucket.set_share(4)
+    assert bucket.rate == MIB // 4
+    bucket.consume(MIB // 4)
+    assert clock.slept == [pytest.approx(1.0)]
+    bucket.set_share(0)
+    assert bucket.rate == MIB
+
+
+def test_set_rate_and_schedule(clock, monkeypatch):
+    bucket = TokenBucket("1M")
+    bucket.set_rate("2M")
+    assert bucket.rate == 2 * MIB
+    monkeypatch.setattr(throttle, "schedule_rate", lambda windows, default, now=None: 512 * 1024)
+    bucket.set_rate("2M", schedule=[(0, 24 * 60, 512 * 1024)])
+    assert bucket.rate == 512 * 1024
+
+
+def test_schedule_is_rechecked_while_consuming(clock, monkeypatch):
+    rates = iter([0, MIB])
+    monkeypatch.setattr(throttle, "schedule_rate", lambda windows, default, now=None: next(rates))
+    bucket = TokenBucket(0, schedule=[(0, 60, MIB)])
+    bucket.consume(MIB)  # the window is closed: unlimited
+    assert clock.slept == []
+    clock.now += throttle.SCHEDULE_RECHECK_SECONDS
+    bucket.consume(MIB)
+    assert bucket.rate == MIB
+    assert clock.slept and clock.slept[-1] > 0
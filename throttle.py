@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Bandwidth shaping for uploads.
+One TokenBucket is shared by every upload thread (global cap); batches may add
+their own bucket on top. The send loop calls consume() once per chunk, so the
+hot path is a lock, a clock read and a few float ops.
+"""
+import re
+import threading
+import time
+
+_RATE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?(?:/s)?\s*$", re.IGNORECASE)
+_RATE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+SCHEDULE_RECHECK_SECONDS = 30
+BURST_SECONDS = 0.25  # how much idle credit a bucket may bank
+
+
+def parse_rate(value):
+    """'512K', '10M', '1.5MB/s', 2048 -> bytes per second. 0/None/'' means unlimited."""
+    if value is None or value == "":
+        return 0
+    if isinstance(value, bool):  # an int subclass: JSON true would mean 1 B/s
+        raise ValueError("Invalid rate: " + str(value))
+    if isinstance(value, (int, float)):
+        return max(0, int(value))
+    m = _RATE_RE.match(str(value))
+    if not m:
+        raise ValueError("Invalid rate: " + str(value))
+    return int(float(m.group(1)) * _RATE_UNITS[m.group(2).lower()])
+
+
+def parse_size(value):
+    """'4G', '700M', 1048576 -> bytes (same units as rates). 0/None/'' means off."""
+    try:
+        return parse_rate(value)
+    except ValueError:
+        raise ValueError("Invalid size: " + str(value))
+
+
+def parse_schedule(spec):
+    """
+    'HH:MM-HH:MM=RATE;...' -> list of (start_min, end_min, bytes_per_sec).
+    Windows may wrap midnight (22:00-06:00). First matching window wins.
+    """
+    windows = []
+    for part in (spec or "").replace(",", ";").split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            span, rate = part.split("=", 1)
+            start, end = span.split("-", 1)
+            windows.append((_minutes(start), _minutes(end), parse_rate(rate)))
+        except ValueError:
+            raise ValueError("Invalid schedule entry: " + part)
+    return windows
+
+
+def _minutes(hhmm):
+    h, m = hhmm.strip().split(":", 1)
+    h, m = int(h), int(m)
+    if not (0 <= h < 24 and 0 <= m < 60 or h == 24 and m == 0):
+        raise ValueError(hhmm)
+    return h * 60 + m
+
+
+def schedule_rate(windows, default, now=None):
+    if not windows:
+        return default
+    t = time.localtime(now)
+    minute = t.tm_hour * 60 + t.tm_min
+    for start, end, rate in windows:
+        if start <= end:
+            if start <= minute < end:
+                return rate
+        elif minute >= start or minute < end:
+            return rate
+    return default
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket in bytes/second; rate 0 disables limiting.
+
+    consume() never rejects: it books the bytes (tokens may go negative) and
+    sleeps off the debt outside the lock, so concurrent callers are served in
+    arrival order and the aggregate rate stays at the cap.
+    """
+
+    def __init__(self, rate=0, schedule=None):
+        self._lock = threading.Lock()
+        self._base_rate = parse_rate(rate)
+        self._schedule = schedule or []
+        self._share = 1
+        self._rate = schedule_rate(self._schedule, self._base_rate)
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._next_check = self._last + SCHEDULE_RECHECK_SECONDS
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def set_rate(self, rate, schedule=None):
+        with self._lock:
+            self._base_rate = parse_rate(rate)
+            if schedule is not None:
+                self._schedule = schedule
+            self._rate = self._current_rate()
+
+    def _current_rate(self):
+        rate = schedule_rate(self._schedule, self._base_rate)
+        return max(1, rate // self._share) if rate else 0
+
+    def set_share(self, share):
+        """Enforce 1/share of the cap, for a limit that `share` processes split between them."""
+        with self._lock:
+            self._share = max(1, share)
+            self._rate = self._current_rate()
+
+    def consume(self, nbytes):
+        if not self._rate and not self._schedule:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if self._schedule and now >= self._next_check:
+                self._rate = self._current_rate()
+                self._next_check = now + SCHEDULE_RECHECK_SECONDS
+            rate = self._rate
+            if not rate:
+                self._last = now
+                return
+            burst = rate * BURST_SECONDS
+            self._tokens = min(burst, self._tokens + (now - self._last) * rate) - nbytes
+            self._last = now
+            wait = -self._tokens / rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
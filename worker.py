@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Upload worker for UPLOAD_MODE=queue: python worker.py
+
+Claims jobs the web panel put into SHARED_STATUS_DB and uploads them in this
+process, so hashing and transfers never compete with the panel for its GIL.
+Run as many as you like, also on other machines that mount the same data and
+browse volumes; each takes one job at a time per free slot of its
+AdaptiveConcurrency pool (UPLOAD_CONCURRENCY_INITIAL / _MAX).
+WORKER_PROCESSES starts several worker processes from one command.
+
+UPLOAD_RATE_LIMIT and a folder's rate_limit stay limits for the whole queue:
+every few seconds each process sets its share to the cap divided by the
+number of processes currently sending under it.
+
+/api/admin/profile only sees the panel's threads; `kill -USR1 <worker pid>`
+samples a worker for WORKER_PROFILE_SECONDS and writes collapsed stacks to
+profile-worker-<pid>.folded next to the history DB.
+"""
+import functools
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import sqlite3
+import threading
+import time
+import weakref
+
+import app as panel
+import profiler
+from concurrency import AdaptiveConcurrency
+from statusdb import JOB_LEASE_SECONDS
+from throttle import TokenBucket
+
+POLL_SECONDS = float(os.environ.get("WORKER_POLL_SECONDS", "1"))
+HEARTBEAT_SECONDS = JOB_LEASE_SECONDS / 4.0
+RATE_SHARE_SECONDS = 2.0
+PROFILE_SECONDS = float(os.environ.get("WORKER_PROFILE_SECONDS", "10"))
+# batch_id -> bucket for the batch's rate_limit, shared by its jobs running in this process
+_batch_limiters = weakref.WeakValueDictionary()
+_batch_limiters_lock = threading.Lock()
+
+
+def _limiters_for(payload):
+    """Limiters of a file job that belongs to a rate-limited batch; None for the usual ones."""
+    batch_id = payload.get("batch_id")
+    if not batch_id or not payload.get("rate_limit"):
+        return None
+    with _batch_limiters_lock:
+        bucket = _batch_limiters.get(batch_id)
+        if bucket is None:
+            bucket = _batch_limiters[batch_id] = TokenBucket(payload["rate_limit"])
+    return panel.global_limiter, bucket
+
+
+def _share_rates(queue):
+    """Split the global cap and every batch cap between the processes sending under them now."""
+    try:
+        owners = queue.running_owners()
+    except sqlite3.Error:
+        return
+    panel.global_limiter.set_share(owners[None])
+    with _batch_limiters_lock:
+        buckets = list(_batch_limiters.items())
+    for batch_id, bucket in buckets:
+        bucket.set_share(owners.get(batch_id, 1))
+
+
+def _run_job(upload_id, kind, payload, controller, limiters=None):
+    if kind == "archive":
+        panel._run_archive_upload(upload_id, payload["files"], payload["fmt"], payload["archive_name"],
+                                  payload["dest_path"], payload["force"], payload["rate_limit"])
+    else:
+        upload = functools.partial(
+            panel._run_upload, upload_id, payload["filepath"], payload["filename"], payload["dest_path"],
+            payload["force"], payload["rate_limit"], payload["split_size"],
+            controller=controller, shard_key=payload.get("shard_key"), limiters=limiters)
+        if payload.get("profile"):
+            # The report lands in SHARED_STATUS_DB, where /api/admin/profile/<upload_id> finds it.
+            panel._profiled(upload_id, upload)
+        else:
+            upload()
+
+
+def _add_timings(timings):
+    def update(batch):
+        return dict(batch, timings=panel._timings_add(batch.get("timings"), timings))
+    return update
+
+
+def _drain(queue, controller, stop):
+    while not stop.is_set():
+        controller.acquire()
+        try:
+            if stop.is_set():
+                return  # stopped while waiting for a slot: don't start anything new
+            try:
+                job = queue.claim_job()
+            except sqlite3.Error:
+                job = None
+            if job is not None:
+                job_id, upload_id, kind, payload, record = job
+                record.update(status="queued", message="Starting")
+                with panel.upload_lock:
+                    panel.upload_status[upload_id] = record
+                limiters = _limiters_for(payload) if kind == "file" else None
+                _share_rates(queue)  # this process now sends too: take our share before starting
+                _run_job(upload_id, kind, payload, controller, limiters)
+                with panel.upload_lock:
+                    final = dict(panel.upload_status.get(upload_id) or record)
+                timings = final.get("timings") if final.get("batch_id") else None
+                try:
+                    queue.finish_job(job_id, upload_id, final, _add_timings(timings) if timings else None)
+                except sqlite3.Error:
+                    pass  # the publisher still writes the record; the lease requeues the job
+        finally:
+            controller.release()
+        if job is None:
+            stop.wait(POLL_SECONDS)
+
+
+def run(stop=None):
+    """Drain the queue until stop is set (SIGTERM / SIGINT when run as a script)."""
+    stop = stop or threading.Event()
+    panel.start_background(prehash=False)  # progress and status publishing; the panel pre-hashes
+    queue = panel.shared_status
+    controller = AdaptiveConcurrency(initial=panel.UPLOAD_CONCURRENCY_INITIAL,
+                                     maximum=panel.UPLOAD_CONCURRENCY_MAX)
+    threads = [threading.Thread(target=_drain, args=(queue, controller, stop), name="worker-%d" % i,
+                                daemon=True)
+               for i in range(controller.maximum)]
+    for t in threads:
+        t.start()
+    # After stop, keep renewing the leases until the uploads in flight have finished,
+    # or another worker would requeue and send them again.
+    last_heartbeat = 0.0
+    while any(t.is_alive() for t in threads):
+        if stop.is_set():
+            busy = [t for t in threads if t.is_alive()]
+            if busy:
+                busy[0].join(RATE_SHARE_SECONDS)
+        else:
+            stop.wait(RATE_SHARE_SECONDS)
+        _share_rates(queue)
+        if time.monotonic() - last_heartbeat >= HEARTBEAT_SECONDS:
+            last_heartbeat = time.monotonic()
+            try:
+                queue.heartbeat()
+            except sqlite3.Error:
+                pass
+            panel._sweep_status()
+
+
+def _write_profile():
+    if not panel.profile_lock.acquire(blocking=False):
+        return  # a sampling run is already going
+    try:
+        stacks = profiler.sample(PROFILE_SECONDS)
+    finally:
+        panel.profile_lock.release()
+    path = os.path.join(os.path.dirname(panel.HISTORY_DB), "profile-worker-%d.folded" % os.getpid())
+    with open(path, "w") as f:
+        f.write(stacks)
+
+
+def _main():
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    signal.signal(signal.SIGUSR1, lambda *_: threading.Thread(target=_write_profile, daemon=True).start())
+    run(stop)
+
+
+def _supervise(processes):
+    """Keep `processes` worker processes running; SIGTERM / SIGINT stops them all."""
+    ctx = multiprocessing.get_context("spawn")
+    stopping = threading.Event()
+    children = {}
+
+    def stop(*_):
+        stopping.set()
+        for p in children.values():
+            p.terminate()
+
+    def profile(*_):
+        for p in children.values():
+            if p.is_alive():
+                os.kill(p.pid, signal.SIGUSR1)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGUSR1, profile)
+    while True:
+        if not stopping.is_set():
+            for i in range(processes):
+                if i not in children or not children[i].is_alive():
+                    children[i] = ctx.Process(target=_main, name="worker-process-%d" % i)
+                    children[i].start()
+        if stopping.is_set() and not any(p.is_alive() for p in children.values()):
+            return
+        # Wakes up (and reaps) as soon as a child exits.
+        multiprocessing.connection.wait([p.sentinel for p in children.values()], timeout=1.0)
+
+
+if __name__ == "__main__":
+    if panel.UPLOAD_MODE != "queue":
+        raise SystemExit("worker.py needs UPLOAD_MODE=queue (and the same SHARED_STATUS_DB as the panel)")
+    processes = int(os.environ.get("WORKER_PROCESSES", "1"))
+    if processes <= 1:
+        _main()
+    else:
+        _supervise(processes)